@@ -0,0 +1,382 @@
+"""
+Route-level load test against a synthetic user population.
+
+Seeds a scratch database with N users, each with a generated routine and
+months of WorkoutLog/DietLog history, then replays a weighted traffic mix
+through the Flask app (test client, no network) and reports p50/p95/p99
+latency, throughput and SQL statements per request. The OpenFoodFacts API is
+replaced by a local stub HTTP server.
+
+Usage (from the repo root):
+    python -m bench.load_test --users 50 --months 3 --requests 2000
+    python -m bench.load_test --compare bench/results/<older>.json
+
+Results are written as JSON to bench/results/ so runs can be compared between commits.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# (label, weight) - roughly what gym-hours traffic looks like
+TRAFFIC_MIX = [
+    ('GET /log', 35),
+    ('POST /log', 20),
+    ('GET /diet', 10),
+    ('GET /api/foods/search', 10),
+    ('POST /diet add', 10),
+    ('GET /plan', 12),
+    ('POST /setup', 3),
+]
+
+FOOD_WORDS = ['rice', 'banana', 'chicken', 'oats', 'egg', 'milk', 'yogurt', 'salmon', 'pasta', 'apple']
+
+# --- Food API stub ---
+
+def _stub_products(query):
+    word = query.split()[0].title() if query.split() else 'Food'
+    variants = ['', ' Organic', ' Cooked', ' Snack Bar', ' with Sauce', ' Family Pack']
+    return [
+        {
+            'product_name': f"{word}{variant}" if i % 2 == 0 else f"{variant.strip() or 'Plain'} {word}",
+            'unique_scans_n': 1000 - i,
+            'nutriments': {
+                'energy-kcal_100g': 50 + (i * 37) % 400,
+                'proteins_100g': (i * 3) % 30,
+                'carbohydrates_100g': (i * 7) % 80,
+                'fat_100g': (i * 5) % 40
+            }
+        }
+        for i, variant in enumerate(variants * 10)
+    ]
+
+def start_food_stub(latency=0.0):
+    """Serves /cgi/search.pl like OpenFoodFacts. Returns the running server."""
+    from urllib.parse import urlparse, parse_qs
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query).get('search_terms', [''])[0]
+            if latency:
+                time.sleep(latency)
+            body = json.dumps({'products': _stub_products(query)}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# --- Population ---
+
+PROFILES = [
+    ('beginner', 3), ('beginner', 2), ('intermediate', 3), ('intermediate', 4),
+    ('intermediate', 5), ('intermediate', 6),
+]
+GOALS = ['strength', 'hypertrophy', 'endurance', 'weight_loss']
+
+def seed_population(app, users, months, rng):
+    """Creates users with routines and history. Returns {username: password}."""
+    from models import db, User, WorkoutPlan, WorkoutExercise, WorkoutLog, DietLog
+    from logic.workout_generator import generate_routine
+    from logic.diet_totals import rebuild_totals
+    from logic.training_log import backfill_sets
+    from logic.progression import refresh_suggestions
+    from sharding import shard_ids, user_shard
+
+    credentials = {}
+    now = datetime.utcnow()
+    days = months * 30
+
+    with app.app_context():
+        for n in range(users):
+            experience, days_available = rng.choice(PROFILES)
+            user = User(
+                username=f"bench{n}", weight=rng.uniform(55, 110), height=rng.uniform(155, 200),
+                age=rng.randint(18, 65), gender=rng.choice(['male', 'female']), goal=rng.choice(GOALS),
+                experience_level=experience, days_available=days_available
+            )
+            user.set_password('bench')
+            db.session.add(user)
+            db.session.flush()
+            credentials[user.username] = 'bench'
+            generate_routine(user)
+
+            with user_shard(user.id):
+                workout_exercises = db.session.execute(
+                    db.select(WorkoutExercise.id, WorkoutPlan.schedule_day)
+                    .join(WorkoutPlan, WorkoutExercise.plan_id == WorkoutPlan.id)
+                    .where(WorkoutPlan.user_id == user.id)
+                ).all()
+
+            log_rows = []
+            diet_rows = []
+            for day_offset in range(days, 0, -1):
+                day = now - timedelta(days=day_offset)
+                for we_id, schedule_day in workout_exercises:
+                    if day.isoweekday() == schedule_day:
+                        weight = 20 + rng.randint(0, 40) * 2.5
+                        reps = ','.join(str(rng.randint(6, 12)) for _ in range(3))
+                        log_rows.append({'user_id': user.id, 'workout_exercise_id': we_id, 'date': day,
+                                         'weight': weight, 'reps_performed': reps})
+                for meal in range(rng.randint(3, 6)):
+                    diet_rows.append({'user_id': user.id, 'date': day.replace(hour=7 + meal * 3),
+                                      'food_name': f"{rng.choice(FOOD_WORDS).title()} (100g)",
+                                      'calories': rng.randint(80, 700), 'protein': rng.uniform(0, 40),
+                                      'carbs': rng.uniform(0, 90), 'fat': rng.uniform(0, 35)})
+
+            with user_shard(user.id):
+                if log_rows:
+                    db.session.execute(db.insert(WorkoutLog), log_rows)
+                if diet_rows:
+                    db.session.execute(db.insert(DietLog), diet_rows)
+            db.session.commit()
+
+        rebuild_totals()
+        for shard_id in shard_ids():
+            backfill_sets(db.session.connection(bind_arguments={'shard_id': shard_id}))
+        # Steady state: every plan exercise already has its stored suggestion
+        for user_id in db.session.execute(db.select(User.id)).scalars().all():
+            with user_shard(user_id):
+                refresh_suggestions(user_id)
+        db.session.commit()
+    return credentials
+
+# --- Traffic ---
+
+class VirtualUser:
+    def __init__(self, app, username, password, rng):
+        self.app = app
+        self.client = app.test_client()
+        self.rng = rng
+        self.client.post('/login', data={'username': username, 'password': password})
+        self.username = username
+        self.refresh_plan()
+
+    def refresh_plan(self):
+        from models import db, User, WorkoutPlan, WorkoutExercise
+        from sharding import user_shard
+        with self.app.app_context():
+            self.profile = db.session.execute(db.select(User).where(User.username == self.username)).scalar_one()
+            db.session.expunge(self.profile)
+            # Plans may live in a shard database, so no join against User
+            with user_shard(self.profile.id):
+                self.workout_exercise_ids = db.session.execute(
+                    db.select(WorkoutExercise.id)
+                    .join(WorkoutPlan, WorkoutExercise.plan_id == WorkoutPlan.id)
+                    .where(WorkoutPlan.user_id == self.profile.id)
+                ).scalars().all()
+
+    def request(self, label):
+        rng = self.rng
+        if label == 'GET /log':
+            return self.client.get('/log')
+        if label == 'POST /log':
+            if not self.workout_exercise_ids:
+                return self.client.get('/log')
+            return self.client.post('/log', data={
+                'workout_exercise_id': rng.choice(self.workout_exercise_ids),
+                'weight': 20 + rng.randint(0, 40) * 2.5,
+                'reps_performed': ','.join(str(rng.randint(6, 12)) for _ in range(3))
+            })
+        if label == 'GET /diet':
+            return self.client.get('/diet')
+        if label == 'GET /api/foods/search':
+            return self.client.get('/api/foods/search', query_string={'q': rng.choice(FOOD_WORDS)})
+        if label == 'POST /diet add':
+            return self.client.post('/diet', data={
+                'action': 'add', 'name': rng.choice(FOOD_WORDS).title(), 'weight': 100,
+                'calories': rng.randint(50, 600), 'protein': 10, 'carbs': 20, 'fat': 5
+            })
+        if label == 'GET /plan':
+            return self.client.get('/plan')
+        if label == 'POST /setup':
+            p = self.profile
+            response = self.client.post('/setup', data={
+                'weight': p.weight, 'height': p.height, 'age': p.age, 'gender': p.gender,
+                'goal': rng.choice(GOALS), 'experience_level': p.experience_level,
+                'days_available': p.days_available
+            })
+            self.refresh_plan()
+            return response
+        raise ValueError(label)
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+def summarize(latencies, queries, wall_time):
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'throughput_rps': len(latencies) / wall_time if wall_time else 0.0,
+        'mean_ms': 1000 * sum(latencies) / len(latencies) if latencies else 0.0,
+        'p50_ms': 1000 * percentile(latencies, 50),
+        'p95_ms': 1000 * percentile(latencies, 95),
+        'p99_ms': 1000 * percentile(latencies, 99),
+        'queries_per_request': sum(queries) / len(queries) if queries else 0.0,
+        'max_queries': max(queries) if queries else 0
+    }
+
+def run_traffic(app, virtual_users, total_requests, concurrency, seed):
+    from sqlalchemy import event
+    from models import db
+
+    local = threading.local()
+
+    def count_query(*args):
+        if hasattr(local, 'queries'):
+            local.queries += 1
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', count_query)
+
+    labels = [label for label, _ in TRAFFIC_MIX]
+    weights = [weight for _, weight in TRAFFIC_MIX]
+    samples = {label: ([], []) for label in labels}
+    errors = {}
+    lock = threading.Lock()
+
+    def worker(index, count):
+        rng = random.Random(seed + index)
+        for _ in range(count):
+            label = rng.choices(labels, weights)[0]
+            user = rng.choice(virtual_users)
+            local.queries = 0
+            start = time.perf_counter()
+            response = user.request(label)
+            elapsed = time.perf_counter() - start
+            with lock:
+                samples[label][0].append(elapsed)
+                samples[label][1].append(local.queries)
+                if response.status_code >= 400:
+                    errors[label] = errors.get(label, 0) + 1
+
+    per_worker = [total_requests // concurrency + (1 if i < total_requests % concurrency else 0) for i in range(concurrency)]
+    threads = [threading.Thread(target=worker, args=(i, n)) for i, n in enumerate(per_worker)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall_time = time.perf_counter() - start
+    for engine in engines:
+        event.remove(engine, 'before_cursor_execute', count_query)
+
+    all_latencies = [x for lat, _ in samples.values() for x in lat]
+    all_queries = [x for _, q in samples.values() for x in q]
+    return {
+        'wall_time_s': wall_time,
+        'overall': summarize(all_latencies, all_queries, wall_time),
+        'routes': {label: summarize(lat, q, wall_time) for label, (lat, q) in samples.items() if lat},
+        'errors': errors
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_report(result, baseline=None):
+    print(f"{'route':<24}{'count':>7}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'q/req':>8}")
+    rows = list(result['routes'].items()) + [('overall', result['overall'])]
+    for label, stats in rows:
+        line = (f"{label:<24}{stats['count']:>7}{stats['throughput_rps']:>9.1f}{stats['p50_ms']:>9.2f}"
+                f"{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}{stats['queries_per_request']:>8.1f}")
+        if baseline:
+            old = baseline['routes'].get(label) if label != 'overall' else baseline['overall']
+            if old and old['p95_ms']:
+                line += f"   p95 {100 * (stats['p95_ms'] - old['p95_ms']) / old['p95_ms']:+.1f}%"
+                line += f"  q/req {stats['queries_per_request'] - old['queries_per_request']:+.1f}"
+        print(line)
+    if result['errors']:
+        print(f"errors: {result['errors']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--months', type=int, default=3, help='months of history per user')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=1, help='client threads')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--shards', type=int, default=1, help='SHARD_COUNT for the scratch database')
+    parser.add_argument('--stub-latency', type=float, default=0.0, help='seconds added to each food API call')
+    parser.add_argument('--output', help='result JSON path (default bench/results/<time>-<commit>.json)')
+    parser.add_argument('--compare', help='earlier result JSON to diff against')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='titangym-bench-')
+    stub = start_food_stub(args.stub_latency)
+    # Must be set before the app (and logic.nutrition) are imported
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['NUTRITION_API_URL'] = f"http://127.0.0.1:{stub.server_port}"
+    os.environ['SHARD_COUNT'] = str(args.shards)
+    os.environ['FOOD_INDEX_PATH'] = os.path.join(workdir, 'no-food-index.db')
+    os.environ.setdefault('METRICS_DIR', os.path.join(workdir, 'metrics'))
+    # No job worker runs here: /setup generates the plan inside the request
+    os.environ.setdefault('JOBS_INLINE', '1')
+
+    from app import create_app
+    from commands import init_db
+
+    app = create_app()
+    with app.app_context():
+        init_db()
+
+    rng = random.Random(args.seed)
+    t0 = time.perf_counter()
+    credentials = seed_population(app, args.users, args.months, rng)
+    seed_time = time.perf_counter() - t0
+    print(f"Seeded {args.users} users with {args.months} months of history in {seed_time:.1f}s ({workdir})")
+
+    virtual_users = [VirtualUser(app, name, pw, random.Random(args.seed + i)) for i, (name, pw) in enumerate(credentials.items())]
+    result = run_traffic(app, virtual_users, args.requests, args.concurrency, args.seed)
+    result['meta'] = {
+        'commit': git_commit(),
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'params': vars(args),
+        'seed_time_s': seed_time
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}-{result['meta']['commit'] or 'nogit'}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {output}")
+    stub.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+"""
+Micro-benchmarks for the logic package.
+
+Runs generate_routine for every structure/day count (cached templates), fresh
+template generation, calculate_diet, suggest_next_load (and the latest_logs
+lookup feeding it) over long histories, the batch progression engine
+(next_loads, refresh_suggestions), and food-search ranking over large
+candidate lists built from data/sample_foods.jsonl. Everything runs against an in-memory SQLite database
+seeded with the exercise catalog.
+
+Each benchmark reports ops/sec (best of --repeat timed rounds) and, from one
+extra traced call, peak memory allocated and number of live blocks (tracemalloc).
+
+Usage (from the repo root):
+    python -m bench.micro                   # compare against bench/baseline.json
+    python -m bench.micro -k ranking        # only benchmarks whose name contains "ranking"
+    python -m bench.micro --save-baseline   # record a new baseline
+
+Numbers are only comparable on the same machine; re-record the baseline when
+switching hardware.
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+FOODS_FIXTURE = os.path.join(BENCH_DIR, '..', 'data', 'sample_foods.jsonl')
+
+BENCHMARKS = {}
+
+def benchmark(name):
+    """Registers a setup function returning the zero-argument callable to time."""
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+# --- Fixtures ---
+
+def make_user(experience_level='intermediate', days_available=3, goal='hypertrophy', gender='male'):
+    from models import User
+    # Transient: only its attributes are read, and user.id for the plan rows
+    return User(id=1, username='bench', weight=80.0, height=180.0, age=30, gender=gender,
+                goal=goal, experience_level=experience_level, days_available=days_available)
+
+def make_history(length, maxed_every=3):
+    """Newest-first WorkoutLog-like records; every maxed_every-th session hits the top of the range."""
+    exercise = SimpleNamespace(muscle_group='legs_quad')
+    workout_exercise = SimpleNamespace(exercise=exercise, reps_range='8-12')
+    history = []
+    for i in range(length):
+        reps = [12, 12, 12] if i % maxed_every == 0 else [10, 9, 8]
+        history.append(SimpleNamespace(
+            weight=100.0 - i * 0.1, sets_performed=reps, workout_exercise=workout_exercise
+        ))
+    return history
+
+def load_food_items(count, seed=0):
+    """Scales the sample foods fixture to `count` items with deterministic name variants."""
+    from logic.nutrition import product_to_item
+
+    with open(FOODS_FIXTURE) as f:
+        base = [item for item in (product_to_item(json.loads(line)) for line in f if line.strip()) if item]
+
+    rng = random.Random(seed)
+    qualifiers = ['', 'Organic', 'Light', 'Whole', 'Cooked', 'Raw', 'Smoked', 'Classic', 'Family Pack', 'Mini']
+    brands = ['', 'Acme', 'Daily', 'FreshCo', 'Nordic', 'Sunrise']
+    items = []
+    while len(items) < count:
+        item = dict(rng.choice(base))
+        name = ' '.join(part for part in (rng.choice(brands), rng.choice(qualifiers), item['name']) if part)
+        item['name'] = name
+        item['calories'] = item['calories'] * rng.uniform(0.8, 1.2)
+        items.append(item)
+    return items
+
+# --- Benchmarks ---
+
+ROUTINE_CASES = [
+    ('fbw', 'beginner', 1), ('fbw', 'beginner', 2), ('fbw', 'beginner', 3),
+    ('fbw', 'intermediate', 2), ('upperlower', 'intermediate', 4),
+    ('ppl', 'intermediate', 3), ('ppl', 'intermediate', 5), ('ppl', 'intermediate', 6),
+]
+
+def _routine_setup(experience_level, days_available):
+    def setup():
+        from models import db
+        from logic.workout_generator import generate_routine
+        user = make_user(experience_level, days_available)
+
+        def run():
+            generate_routine(user)
+            db.session.rollback()
+        return run
+    return setup
+
+for structure, experience_level, days_available in ROUTINE_CASES:
+    benchmark(f"generate_routine[{structure}-{experience_level}-{days_available}d]")(
+        _routine_setup(experience_level, days_available)
+    )
+
+@benchmark('generate_template[all profiles, fresh]')
+def _generate_template():
+    from logic.workout_generator import Profile, generate_template
+    profiles = [Profile(goal, experience_level, days_available)
+                for _, experience_level, days_available in ROUTINE_CASES
+                for goal in ('strength', 'hypertrophy', 'endurance')]
+
+    def run():
+        rng = random.Random(0)
+        for profile in profiles:
+            generate_template(profile, rng)
+    return run
+
+@benchmark('calculate_diet[all goals]')
+def _calculate_diet():
+    from logic.workout_generator import calculate_diet
+    users = [make_user(goal=goal, gender=gender, days_available=days)
+             for goal in ('strength', 'hypertrophy', 'endurance', 'weight_loss')
+             for gender in ('male', 'female')
+             for days in (2, 4, 6)]
+
+    def run():
+        for user in users:
+            calculate_diet(user)
+    return run
+
+def _suggest_setup(length):
+    def setup():
+        from logic.progression import suggest_next_load
+        history = make_history(length)
+        return lambda: suggest_next_load(history)
+    return setup
+
+for length in (10, 1000, 10000):
+    benchmark(f"suggest_next_load[history={length}]")(_suggest_setup(length))
+
+_history_fixture = None
+
+def seed_history():
+    """A user with 20 plan exercises x 500 logged sessions (3 sets each); seeded once per run."""
+    global _history_fixture
+    if _history_fixture is not None:
+        return _history_fixture
+
+    from datetime import datetime, timedelta
+    from models import db, WorkoutPlan, WorkoutExercise, WorkoutLog
+    from logic.training_log import backfill_sets
+    from logic.workout_generator import generate_routine
+
+    user = make_user('intermediate', 5)
+    generate_routine(user, random.Random(0))
+    we_ids = db.session.execute(
+        db.select(WorkoutExercise.id).join(WorkoutPlan).where(WorkoutPlan.user_id == user.id)
+    ).scalars().all()[:20]
+
+    start = datetime(2024, 1, 1)
+    rows = [
+        {'user_id': user.id, 'workout_exercise_id': we_id, 'date': start + timedelta(days=day),
+         'weight': 60 + day * 0.1, 'reps_performed': '10,10,9'}
+        for we_id in we_ids for day in range(500)
+    ]
+    db.session.execute(db.insert(WorkoutLog), rows)
+    backfill_sets(db.session.connection())
+    db.session.commit()
+    _history_fixture = (user.id, we_ids)
+    return _history_fixture
+
+@benchmark('latest_logs+suggest_next_load[20 exercises x 500 logs]')
+def _latest_logs():
+    from models import db
+    from logic.progression import latest_logs, suggest_next_load
+
+    user_id, we_ids = seed_history()
+
+    def run():
+        logs = latest_logs(user_id, we_ids)
+        for log in logs.values():
+            suggest_next_load([log])
+        db.session.expunge_all()
+    return run
+
+@benchmark('refresh_suggestions[20 exercises x 500 logs]')
+def _refresh_suggestions():
+    from models import db
+    from logic.progression import refresh_suggestions
+
+    user_id, we_ids = seed_history()
+
+    def run():
+        refresh_suggestions(user_id, we_ids)
+        db.session.commit()
+    return run
+
+@benchmark('next_loads[10000 exercises x 3 sessions]')
+def _next_loads():
+    from logic.progression import LoggedSession, next_loads
+
+    rng = random.Random(0)
+    histories, targets = {}, {}
+    for key in range(10000):
+        weight = 20 + rng.randint(0, 40) * 2.5
+        histories[key] = [LoggedSession(weight, [rng.randint(6, 12) for _ in range(3)]) for _ in range(3)]
+        targets[key] = ('8-12', rng.choice(['chest', 'legs_quad', 'back']))
+    return lambda: next_loads(histories, targets)
+
+def _ranking_setup(count, fuzzy):
+    def setup():
+        from logic.nutrition import rank_items
+        items = load_food_items(count)
+        queries = ['yogurt', 'chicken breast', 'oats', 'banana', 'olive oil', 'ric']
+        if fuzzy:
+            queries = ['yoghurt', 'chiken breast', 'oat', 'bananna', 'olive oli', 'rice']
+
+        def run():
+            for query in queries:
+                rank_items(query, items, 10, fuzzy=fuzzy)
+        return run
+    return setup
+
+for count in (1000, 10000, 50000):
+    benchmark(f"ranking[{count} candidates x 6 queries]")(_ranking_setup(count, False))
+benchmark('ranking[10000 candidates x 6 queries, fuzzy]')(_ranking_setup(10000, True))
+
+# --- Runner ---
+
+def measure(fn, min_time=0.2, repeat=5):
+    """Returns (ops_per_sec, mean_seconds) using the fastest of `repeat` rounds."""
+    fn() # warm up caches (catalog index, imports)
+
+    iterations = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 5 or iterations >= 1 << 20:
+            break
+        iterations *= 2
+    iterations = max(1, int(iterations * (min_time / max(elapsed, 1e-9))))
+
+    best = float('inf')
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                fn()
+            best = min(best, (time.perf_counter() - start) / iterations)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return 1.0 / best, best
+
+def measure_allocations(fn):
+    """Peak bytes allocated during one call and blocks still alive after it."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+    return peak - base, blocks
+
+def create_bench_app():
+    os.environ['DATABASE_URL'] = 'sqlite://'
+    from app import create_app
+    from commands import init_db
+
+    app = create_app()
+    with app.app_context():
+        init_db()
+    return app
+
+def run(selected, min_time, repeat):
+    app = create_bench_app()
+    print(f"{'benchmark':<58}{'ops/sec':>12}{'mean us':>12}{'peak KiB':>11}{'blocks':>8}")
+    results = {}
+    with app.app_context():
+        for name in selected:
+            fn = BENCHMARKS[name]()
+            ops, mean = measure(fn, min_time, repeat)
+            peak, blocks = measure_allocations(fn)
+            results[name] = {'ops_per_sec': ops, 'mean_us': mean * 1e6, 'peak_alloc_bytes': peak, 'live_blocks': blocks}
+            print_row(name, results[name])
+    return results
+
+def print_row(name, stats):
+    line = (f"{name:<58}{stats['ops_per_sec']:>12.1f}{stats['mean_us']:>12.1f}"
+            f"{stats['peak_alloc_bytes'] / 1024:>11.1f}{stats['live_blocks']:>8d}")
+    print(line, flush=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-k', dest='filter', help='only run benchmarks whose name contains this')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds per timed round')
+    parser.add_argument('--repeat', type=int, default=5, help='timed rounds per benchmark')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='write results to the baseline file')
+    parser.add_argument('--output', help='also write results JSON here')
+    parser.add_argument('--fail-over', type=float,
+                        help='exit 1 if any benchmark is more than this many percent slower than baseline')
+    args = parser.parse_args(argv)
+
+    selected = [name for name in BENCHMARKS if not args.filter or args.filter in name]
+    results = run(selected, args.min_time, args.repeat)
+    document = {'python': sys.version.split()[0], 'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                previous = json.load(f)['results']
+            # Keep entries for benchmarks that weren't run this time (-k)
+            document['results'] = dict(previous, **results)
+        with open(args.baseline, 'w') as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+
+    print(f"\n{'vs baseline':<58}{'ops/sec':>12}{'peak KiB':>11}")
+    regressions = []
+    for name, stats in results.items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        speed = 100 * (stats['ops_per_sec'] - old['ops_per_sec']) / old['ops_per_sec']
+        memory = 100 * (stats['peak_alloc_bytes'] - old['peak_alloc_bytes']) / old['peak_alloc_bytes'] if old['peak_alloc_bytes'] else 0.0
+        print(f"{name:<58}{speed:>+11.1f}%{memory:>+10.1f}%")
+        if args.fail_over is not None and -speed > args.fail_over:
+            regressions.append(name)
+
+    if regressions:
+        print(f"\nSlower than baseline by more than {args.fail_over}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
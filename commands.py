@@ -0,0 +1,40 @@
+"""
+Boot-phase CLI commands (flask --app app <command>).
+
+These replace the create_all/seed that used to run on every import of app.py,
+where each gunicorn worker raced the others on a fresh database.
+"""
+import click
+
+def init_db():
+    """Migrates the main database and every shard, then seeds an empty exercise catalog."""
+    from migrations import upgrade
+    from seed_data import seed_exercises
+
+    results = upgrade()
+    seeded = seed_exercises()
+    return results, seeded
+
+def _print_migrations(results):
+    for database, versions in results.items():
+        if versions:
+            click.echo(f"{database}: applied migrations {', '.join(map(str, versions))}")
+        else:
+            click.echo(f"{database}: schema is up to date.")
+
+@click.command('init-db')
+def init_db_command():
+    """Create/migrate the databases and seed the exercise catalog."""
+    results, seeded = init_db()
+    _print_migrations(results)
+    click.echo(f"Seeded {seeded} exercises." if seeded else "Exercise catalog already present.")
+
+@click.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations."""
+    from migrations import upgrade
+    _print_migrations(upgrade())
+
+def init_app(app):
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_command)
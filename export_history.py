@@ -0,0 +1,64 @@
+"""
+Dumps workout or diet history as CSV or JSONL, e.g. for the warehouse sync.
+
+Streams from a server-side cursor one shard at a time, so memory stays flat
+for any number of users. --all reads every user (each shard in id order);
+--user-id one user (in date order). Dates are inclusive. An output path
+ending in .gz is gzipped; without --output the dump goes to stdout.
+
+Usage:
+    python export_history.py {workouts,diet} (--all | --user-id ID) [--format csv|jsonl]
+                             [--start YYYY-MM-DD] [--end YYYY-MM-DD] [--output PATH] [--batch-size N]
+"""
+import argparse
+import os
+import sys
+
+def write_export(out, kind, fmt, user_id=None, start=None, end=None, compress=False, batch_size=None):
+    """Writes the export to a binary file object. Returns the bytes written."""
+    from logic.export import BATCH_SIZE, export
+
+    written = 0
+    for chunk in export(kind, fmt, user_id, start, end, compress, batch_size or BATCH_SIZE):
+        out.write(chunk)
+        written += len(chunk)
+    return written
+
+def main(argv=None):
+    from logic.export import KINDS, FORMATS, BATCH_SIZE, parse_date_range
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('kind', choices=list(KINDS))
+    who = parser.add_mutually_exclusive_group(required=True)
+    who.add_argument('--all', action='store_true', help='every user, for bulk dumps')
+    who.add_argument('--user-id', type=int)
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--start', help='first day, YYYY-MM-DD')
+    parser.add_argument('--end', help='last day, YYYY-MM-DD')
+    parser.add_argument('--output', help='file path (.gz to compress); default stdout')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='rows per cursor fetch')
+    args = parser.parse_args(argv)
+
+    try:
+        start, end = parse_date_range(args.start, args.end)
+    except ValueError as e:
+        parser.error(str(e))
+
+    from app import app
+
+    with app.app_context():
+        if args.output:
+            partial = args.output + '.partial'
+            with open(partial, 'wb') as f:
+                written = write_export(f, args.kind, args.format, args.user_id, start, end,
+                                       args.output.endswith('.gz'), args.batch_size)
+            # Only a complete dump gets the real name
+            os.replace(partial, args.output)
+            print(f"Wrote {written} bytes to {args.output}", file=sys.stderr)
+        else:
+            write_export(sys.stdout.buffer, args.kind, args.format, args.user_id, start, end,
+                         batch_size=args.batch_size)
+            sys.stdout.buffer.flush()
+
+if __name__ == '__main__':
+    main()
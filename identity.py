@@ -0,0 +1,75 @@
+"""
+Cached user loading for Flask-Login.
+
+Profiles change about once a month, yet the user loader ran a SELECT on every
+authenticated request. Loaded users are now cached per process for
+USER_CACHE_TTL seconds, keyed on (user id, profile_version). The version the
+browser last saw is kept in the signed Flask session cookie, so a profile
+change made through any worker (which bumps the version and the cookie) misses
+every other worker's cache on that user's next request; a change made from a
+different browser is picked up within the TTL.
+
+Each request gets its own detached User built from the cached column values.
+It is fine for reading; to change a profile, load the session-attached row with
+db.session.get(User, ...) and call profile_changed() before committing.
+"""
+import os
+import time
+
+from flask import session
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from logic.cache import MemoryBackend
+from models import db, User
+
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 60))
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+
+SESSION_KEY = 'profile_version'
+
+_cache = MemoryBackend(max_entries=USER_CACHE_SIZE)
+
+def _key(user_id, version):
+    return f"{user_id}:{version}"
+
+def _columns(user):
+    return {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+
+def _detached(values):
+    user = User(**values)
+    make_transient_to_detached(user)
+    return user
+
+def load_user(user_id):
+    """Flask-Login user loader body. Returns a User or None."""
+    version = session.get(SESSION_KEY)
+    now = time.time()
+    if version is not None and USER_CACHE_TTL > 0:
+        values = _cache.get(_key(user_id, version), now)
+        if values is not None:
+            return _detached(values)
+
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    if version != user.profile_version:
+        session[SESSION_KEY] = user.profile_version
+    if USER_CACHE_TTL > 0:
+        _cache.set(_key(user.id, user.profile_version), _columns(user), now + USER_CACHE_TTL)
+    return user
+
+def remember(user):
+    """Stores the user's profile version in the session (call after login_user)."""
+    session[SESSION_KEY] = user.profile_version
+
+def forget():
+    session.pop(SESSION_KEY, None)
+
+def profile_changed(user):
+    """Bumps the version of a session-attached user before commit; cached copies stop matching."""
+    user.profile_version = (user.profile_version or 1) + 1
+    session[SESSION_KEY] = user.profile_version
+
+def clear():
+    _cache.clear()
@@ -0,0 +1,36 @@
+"""
+Builds the local food search index from an OpenFoodFacts dump.
+
+Usage: python import_foods.py <dump.jsonl[.gz] | dump.csv[.gz]> [index_path]
+
+Once the index exists, search_food reads from it instead of calling the
+OpenFoodFacts API. data/sample_foods.jsonl is a small dump for local use.
+"""
+import sys
+
+from logic.food_index import read_dump, build_index, index_path
+from logic.nutrition import product_to_item
+
+def _popularity(product):
+    try:
+        return int(product.get('unique_scans_n') or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def import_foods(dump_path, path=None):
+    rows = (
+        (item, _popularity(product))
+        for product in read_dump(dump_path)
+        for item in [product_to_item(product)]
+        if item
+    )
+    return build_index(rows, path)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    target = sys.argv[2] if len(sys.argv) > 2 else index_path()
+    count = import_foods(sys.argv[1], target)
+    print(f"Indexed {count} foods into {target}")
@@ -0,0 +1,383 @@
+"""
+Durable background jobs.
+
+Work that doesn't need to finish inside the HTTP request (plan generation at
+/setup, diet total rebuilds, suggestion recomputes) is stored as a Job row in
+the main database (SQLite by default) and run by worker processes:
+
+    python jobs.py work            # run until stopped (SIGTERM finishes the current job)
+    python jobs.py work --drain    # run until the queue is empty
+    python jobs.py status          # jobs per kind and status
+    python jobs.py prune           # run the idle-time cleanup now
+
+Start as many workers as needed (the Procfile has one); they claim jobs with
+a single conditional UPDATE, so a job runs on one worker at a time.
+
+    enqueue(kind, user_id, dedup_key=...)   in the caller's transaction
+    claim -> handler(user_id, **payload) -> done
+    failure -> queued again after JOB_RETRY_DELAY * 2^(attempt-1) seconds,
+               failed after max_attempts
+    a job running longer than JOB_TIMEOUT (worker died) is claimed again
+
+Idle workers run maintain() once every JOB_MAINTENANCE_INTERVAL seconds:
+finished jobs older than JOB_RETENTION_DAYS are deleted (nothing reads them
+after that), and so are expired idempotency keys (logic.training_log).
+
+At most one job per dedup_key is queued at a time; enqueueing another returns
+the queued one, which will see the latest data when it runs. A job that is
+already running doesn't count, so a change made while it runs gets its own job.
+
+With JOBS_INLINE=1 enqueue runs the handler immediately instead (no worker
+needed, e.g. for the load test). `python app.py` defaults to it, since the
+development server starts no worker.
+
+Config (env var of the same name overrides the default):
+    JOBS_INLINE         0
+    JOB_POLL_INTERVAL   1.0 (seconds between polls of an empty queue)
+    JOB_RETRY_DELAY     5 (seconds, doubled per attempt)
+    JOB_TIMEOUT         600 (seconds before a running job is considered abandoned)
+    JOB_MAX_ATTEMPTS    3
+    JOB_RETENTION_DAYS  7
+    JOB_MAINTENANCE_INTERVAL  3600 (seconds)
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+import metrics
+from models import db, Job
+from sharding import user_shard
+
+ACTIVE = ('queued', 'running')
+FINISHED = ('done', 'failed', 'dismissed') # dismissed: failed, and the user has been told
+PRUNE_BATCH_SIZE = 1000
+
+HANDLERS = {}
+
+def handler(kind):
+    """Registers fn(user_id, **payload) as the handler of a job kind. Handlers commit their own work."""
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+def _config(name):
+    return current_app.config[name]
+
+# --- Producer side ---
+
+def enqueue(kind, user_id=None, payload=None, dedup_key=None, max_attempts=None):
+    """
+    Adds a job in the caller's transaction (the caller commits) and returns
+    it, or the already queued job with the same dedup_key. In inline mode the
+    handler runs right away and None is returned.
+    """
+    payload = payload or {}
+    if _config('JOBS_INLINE'):
+        HANDLERS[kind](user_id, **payload)
+        return None
+
+    for _ in range(2):
+        job = Job(
+            kind=kind, user_id=user_id, payload=json.dumps(payload), dedup_key=dedup_key,
+            max_attempts=max_attempts or _config('JOB_MAX_ATTEMPTS')
+        )
+        try:
+            with db.session.begin_nested():
+                db.session.add(job)
+            return job
+        except IntegrityError:
+            existing = db.session.execute(
+                db.select(Job).where(Job.dedup_key == dedup_key, Job.status == 'queued')
+            ).scalar_one_or_none()
+            if existing is not None:
+                return existing
+            # Claimed between our insert and the lookup; the next insert goes through
+    raise RuntimeError(f"could not enqueue {kind} job for key {dedup_key}")
+
+def latest(user_id, kind):
+    """The user's most recent job of a kind, or None."""
+    return db.session.execute(
+        db.select(Job).where(Job.user_id == user_id, Job.kind == kind).order_by(Job.id.desc()).limit(1)
+    ).scalar_one_or_none()
+
+def is_active(job):
+    return job is not None and job.status in ACTIVE
+
+def dismiss(job):
+    """
+    Marks a failed job as seen by its user (status 'dismissed'), so its error
+    is shown once. In the caller's transaction.
+    """
+    db.session.execute(
+        db.update(Job).where(Job.id == job.id, Job.status == 'failed').values(status='dismissed')
+    )
+
+# --- Worker side ---
+
+def _runnable(now):
+    stale = now - timedelta(seconds=_config('JOB_TIMEOUT'))
+    return db.or_(
+        db.and_(Job.status == 'queued', Job.run_after <= now),
+        db.and_(Job.status == 'running', Job.locked_at < stale, Job.attempts < Job.max_attempts),
+    )
+
+def _fail_abandoned(now):
+    stale = now - timedelta(seconds=_config('JOB_TIMEOUT'))
+    db.session.execute(
+        db.update(Job).where(
+            Job.status == 'running', Job.locked_at < stale, Job.attempts >= Job.max_attempts
+        ).values(status='failed', finished_at=now, last_error='timed out')
+    )
+
+def _has_work(now):
+    # Runnable jobs, or abandoned ones for _fail_abandoned
+    stale = now - timedelta(seconds=_config('JOB_TIMEOUT'))
+    return db.session.execute(
+        db.select(Job.id).where(db.or_(
+            db.and_(Job.status == 'queued', Job.run_after <= now),
+            db.and_(Job.status == 'running', Job.locked_at < stale),
+        )).limit(1)
+    ).scalar() is not None
+
+def claim(worker_id):
+    """
+    Marks the oldest runnable job as running on this worker and returns its
+    id, or None. The UPDATE re-checks the condition, so two workers racing for
+    the same row can't both get it. An empty queue costs one SELECT and no
+    write lock, so idle workers don't contend with the web processes.
+    """
+    now = datetime.utcnow()
+    found = _has_work(now)
+    # End the read either way: under WAL a transaction that read and then
+    # writes fails at once if another writer committed in between
+    db.session.commit()
+    if not found:
+        return None
+    _fail_abandoned(now)
+    candidate = db.select(Job.id).where(_runnable(now)).order_by(Job.run_after, Job.id).limit(1).scalar_subquery()
+    job_id = db.session.execute(
+        db.update(Job).where(Job.id == candidate, _runnable(now)).values(
+            status='running', locked_by=worker_id, locked_at=now, attempts=Job.attempts + 1
+        ).returning(Job.id)
+    ).scalar()
+    db.session.commit()
+    return job_id
+
+def _finish(job_id, **values):
+    db.session.execute(db.update(Job).where(Job.id == job_id).values(**values))
+    db.session.commit()
+
+def _retry_or_fail(job_id, error):
+    now = datetime.utcnow()
+    attempts, max_attempts = db.session.execute(
+        db.select(Job.attempts, Job.max_attempts).where(Job.id == job_id)
+    ).one()
+    if attempts >= max_attempts:
+        _finish(job_id, status='failed', finished_at=now, last_error=error)
+        return 'failed'
+
+    delay = _config('JOB_RETRY_DELAY') * 2 ** (attempts - 1)
+    try:
+        with db.session.begin_nested():
+            db.session.execute(db.update(Job).where(Job.id == job_id).values(
+                status='queued', run_after=now + timedelta(seconds=delay), locked_by=None, last_error=error
+            ))
+        db.session.commit()
+        return 'retry'
+    except IntegrityError:
+        # A newer job with the same key is already queued and will do the work
+        _finish(job_id, status='failed', finished_at=now, last_error=f"superseded after: {error}")
+        return 'superseded'
+
+def execute(job_id):
+    """Runs a claimed job and records the outcome. Returns 'done', 'retry', 'failed' or 'superseded'."""
+    job = db.session.get(Job, job_id)
+    kind, user_id, payload = job.kind, job.user_id, json.loads(job.payload)
+    started = time.perf_counter()
+    try:
+        fn = HANDLERS.get(kind)
+        if fn is None:
+            raise LookupError(f"no handler for job kind {kind!r}")
+        fn(user_id, **payload)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception("Job %s (%s, user %s) failed", job_id, kind, user_id)
+        result = _retry_or_fail(job_id, f"{type(e).__name__}: {e}")
+    else:
+        _finish(job_id, status='done', finished_at=datetime.utcnow(), last_error=None)
+        result = 'done'
+
+    metrics.inc('jobs_total', (('kind', kind), ('result', result)))
+    metrics.observe('job_duration_seconds', time.perf_counter() - started, (('kind', kind),))
+    return result
+
+def run_next(worker_id):
+    """Claims and runs one job. Returns False if there was nothing to run."""
+    try:
+        job_id = claim(worker_id)
+        if job_id is None:
+            return False
+        execute(job_id)
+        return True
+    finally:
+        db.session.remove()
+
+def work(app, worker_id=None, drain=False):
+    """Worker loop. Stops on SIGTERM/SIGINT after the current job, or when the queue is empty with drain."""
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    processed = 0
+    last_maintenance = None
+    while not stopping:
+        with app.app_context():
+            ran = run_next(worker_id)
+            if not ran and (last_maintenance is None or
+                            time.monotonic() - last_maintenance >= app.config['JOB_MAINTENANCE_INTERVAL']):
+                # Housekeeping only while there's nothing else to do
+                last_maintenance = time.monotonic()
+                maintain()
+            metrics.maybe_flush()
+        if ran:
+            processed += 1
+        elif drain:
+            break
+        else:
+            time.sleep(app.config['JOB_POLL_INTERVAL'])
+    return processed
+
+def counts(statuses=None):
+    """{(kind, status): jobs}, optionally only for some statuses (an index range scan)."""
+    query = db.select(Job.kind, Job.status, db.func.count(Job.id)).group_by(Job.kind, Job.status)
+    if statuses is not None:
+        query = query.where(Job.status.in_(statuses))
+    return {(kind, status): count for kind, status, count in db.session.execute(query)}
+
+def prune(retention_days=None):
+    """
+    Deletes finished jobs (done, failed, dismissed) that ended more than retention_days
+    (JOB_RETENTION_DAYS) ago, in batches. Returns the number deleted.
+    """
+    if retention_days is None:
+        retention_days = _config('JOB_RETENTION_DAYS')
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    deleted = 0
+    while True:
+        batch = db.select(Job.id).where(
+            Job.status.in_(FINISHED), Job.finished_at < cutoff
+        ).limit(PRUNE_BATCH_SIZE).scalar_subquery()
+        count = db.session.execute(db.delete(Job).where(Job.id.in_(batch))).rowcount
+        db.session.commit()
+        deleted += count
+        if count < PRUNE_BATCH_SIZE:
+            return deleted
+
+def maintain():
+    """
+    Periodic cleanup run by idle workers: finished jobs past their retention
+    and expired /api/sessions idempotency keys. Returns (jobs, keys) deleted.
+    """
+    from logic.training_log import expire_idempotency_keys
+
+    try:
+        pruned = prune()
+        expired = expire_idempotency_keys()
+    except SQLAlchemyError:
+        db.session.rollback()
+        current_app.logger.exception("Maintenance failed")
+        return 0, 0
+    finally:
+        db.session.remove()
+    if pruned or expired:
+        current_app.logger.info("Pruned %d finished jobs, expired %d idempotency keys", pruned, expired)
+    return pruned, expired
+
+@metrics.register_scrape_collector
+def _queue_samples():
+    # Once per scrape, from the database, so every worker's /metrics agrees
+    try:
+        current = counts(ACTIVE)
+    except SQLAlchemyError:
+        db.session.rollback() # e.g. not migrated yet; metrics must not break the scrape
+        return []
+    samples = []
+    for kind in sorted({kind for kind, _ in current}):
+        for status in ACTIVE:
+            samples.append(('job_queue_depth', 'gauge', 'Queued and running background jobs.',
+                            (('kind', kind), ('status', status)), current.get((kind, status), 0)))
+    return samples
+
+def init_app(app):
+    app.config.setdefault('JOBS_INLINE', os.environ.get('JOBS_INLINE', '0') == '1')
+    app.config.setdefault('JOB_POLL_INTERVAL', float(os.environ.get('JOB_POLL_INTERVAL', 1.0)))
+    app.config.setdefault('JOB_RETRY_DELAY', float(os.environ.get('JOB_RETRY_DELAY', 5)))
+    app.config.setdefault('JOB_TIMEOUT', float(os.environ.get('JOB_TIMEOUT', 600)))
+    app.config.setdefault('JOB_MAX_ATTEMPTS', int(os.environ.get('JOB_MAX_ATTEMPTS', 3)))
+    app.config.setdefault('JOB_RETENTION_DAYS', float(os.environ.get('JOB_RETENTION_DAYS', 7)))
+    app.config.setdefault('JOB_MAINTENANCE_INTERVAL', float(os.environ.get('JOB_MAINTENANCE_INTERVAL', 3600)))
+
+# --- Handlers ---
+
+@handler('generate_plans')
+def generate_plans(user_id):
+    """Replaces the user's plans with a fresh routine for their current profile, and precomputes suggestions."""
+    from models import User
+    from logic.workout_generator import clear_plans, generate_routine
+    from logic.progression import refresh_suggestions
+
+    user = db.session.get(User, user_id)
+    if user is None or not user.goal:
+        return
+    with user_shard(user_id):
+        clear_plans([user_id])
+        generate_routine(user)
+        refresh_suggestions(user_id)
+        db.session.commit()
+
+@handler('rebuild_diet_totals')
+def rebuild_diet_totals(user_id):
+    from logic.diet_totals import rebuild_totals
+    rebuild_totals(user_id)
+    db.session.commit()
+
+@handler('refresh_suggestions')
+def refresh_suggestions(user_id):
+    from logic.progression import refresh_suggestions as refresh
+    with user_shard(user_id):
+        refresh(user_id)
+        db.session.commit()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Background job worker')
+    sub = parser.add_subparsers(dest='command', required=True)
+    work_parser = sub.add_parser('work', help='run jobs')
+    work_parser.add_argument('--drain', action='store_true', help='exit once the queue is empty')
+    sub.add_parser('status', help='jobs per kind and status')
+    sub.add_parser('prune', help='delete old finished jobs and expired idempotency keys')
+    args = parser.parse_args()
+
+    from app import app
+
+    if args.command == 'work':
+        print(f"Processed {work(app, drain=args.drain)} jobs")
+    elif args.command == 'prune':
+        with app.app_context():
+            pruned, expired = maintain()
+            print(f"Pruned {pruned} jobs, expired {expired} idempotency keys")
+    else:
+        with app.app_context():
+            for (kind, status), count in sorted(counts().items()):
+                print(f"{kind:<24}{status:<10}{count:>8}")
@@ -0,0 +1,137 @@
+from collections import namedtuple
+from itertools import product
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, Exercise
+
+# Lightweight, session-independent view of an Exercise row.
+# Cached ORM instances would detach/expire between requests, plain tuples don't.
+CatalogEntry = namedtuple('CatalogEntry', ['id', 'name', 'type', 'muscle_group', 'mechanics', 'equipment'])
+
+# Seconds between checks that the Exercise table is still what the index was
+# built from. Commits in this process invalidate at once (see below); this
+# catches other processes' writes, e.g. the init-db seed.
+CATALOG_CHECK_INTERVAL = float(os.environ.get('CATALOG_CHECK_INTERVAL', 30))
+
+_lock = threading.Lock()
+_index = None
+_fingerprint = None # (count, max id) of the Exercise table the index was built from
+_checked_at = 0.0
+_by_id = None # (index it was built from, {id: entry})
+
+
+def _build_index(entries):
+    """
+    Index every entry under each (muscle_group, mechanics, type) key, with None
+    standing in for "any". Each entry lands in 8 buckets, so any combination of
+    filters select_exercise can ask for is a single dict lookup.
+    """
+    index = {}
+    for entry in entries:
+        for mask in product((True, False), repeat=3):
+            key = (
+                entry.muscle_group if mask[0] else None,
+                entry.mechanics if mask[1] else None,
+                entry.type if mask[2] else None,
+            )
+            index.setdefault(key, []).append(entry)
+    return {key: tuple(bucket) for key, bucket in index.items()}
+
+
+def _table_fingerprint():
+    # Detects rows added or removed by any process; in-place edits made
+    # elsewhere show up once this process restarts or commits a catalog write
+    return tuple(db.session.execute(db.select(db.func.count(Exercise.id), db.func.max(Exercise.id))).one())
+
+
+def load_catalog():
+    """
+    Loads the whole Exercise table in one query and returns the index.
+    Entries are ordered by id so selection is stable for a given random state.
+    At most every CATALOG_CHECK_INTERVAL seconds a count/max(id) query checks
+    for rows written by other processes and reloads if there are any.
+    """
+    global _index, _fingerprint, _checked_at
+    index = _index
+    if index is not None and time.monotonic() - _checked_at < CATALOG_CHECK_INTERVAL:
+        return index
+
+    with _lock:
+        if _index is not None and time.monotonic() - _checked_at < CATALOG_CHECK_INTERVAL:
+            return _index
+        fingerprint = _table_fingerprint()
+        if _index is None or fingerprint != _fingerprint:
+            rows = db.session.execute(
+                db.select(
+                    Exercise.id, Exercise.name, Exercise.type,
+                    Exercise.muscle_group, Exercise.mechanics, Exercise.equipment
+                ).order_by(Exercise.id)
+            ).all()
+            _index = _build_index(CatalogEntry(*row) for row in rows)
+            _fingerprint = fingerprint
+        _checked_at = time.monotonic()
+        return _index
+
+
+def invalidate_catalog():
+    global _index, _fingerprint
+    with _lock:
+        _index = None
+        _fingerprint = None
+
+
+def get_entry(exercise_id):
+    """CatalogEntry for an exercise id, or None. The (None, None, None) bucket holds every entry."""
+    global _by_id
+    index = load_catalog()
+    by_id = _by_id
+    if by_id is None or by_id[0] is not index:
+        by_id = _by_id = (index, {entry.id: entry for entry in index.get((None, None, None), ())})
+    return by_id[1].get(exercise_id)
+
+
+def find_candidates(muscle_group=None, mechanics=None, type=None, exclude_ids=()):
+    candidates = load_catalog().get((muscle_group, mechanics, type), ())
+    if not exclude_ids:
+        return list(candidates)
+    excluded = set(exclude_ids)
+    return [c for c in candidates if c.id not in excluded]
+
+
+# --- Invalidation ---
+# Any ORM write touching Exercise (unit-of-work flush or bulk insert/update/delete)
+# marks the session; the index is dropped once that transaction commits.
+
+def _touches_catalog(instances):
+    return any(isinstance(obj, Exercise) for obj in instances)
+
+
+@event.listens_for(Session, 'after_flush')
+def _mark_catalog_flush(session, flush_context):
+    if _touches_catalog(session.new) or _touches_catalog(session.dirty) or _touches_catalog(session.deleted):
+        session.info['catalog_dirty'] = True
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _mark_catalog_bulk(orm_execute_state):
+    if orm_execute_state.is_select:
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.class_ is Exercise:
+        orm_execute_state.session.info['catalog_dirty'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    if session.info.pop('catalog_dirty', False):
+        invalidate_catalog()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop('catalog_dirty', None)
@@ -0,0 +1,137 @@
+from datetime import datetime, time, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, DietLog, DailyNutritionTotal
+from sharding import shard_for_user, shard_ids, using_shard
+
+MACROS = ('calories', 'protein', 'carbs', 'fat')
+
+def add_entry(user_id, food_name, calories, protein, carbs, fat, date=None):
+    """
+    Logs a food entry and folds it into that day's DailyNutritionTotal in the
+    same transaction (the caller commits). Returns the new DietLog.
+    """
+    date = date or datetime.utcnow()
+    entry = DietLog(
+        user_id=user_id,
+        food_name=food_name,
+        calories=calories,
+        protein=protein,
+        carbs=carbs,
+        fat=fat,
+        date=date
+    )
+    db.session.add(entry)
+    _add_to_day(user_id, date.date(), calories, protein, carbs, fat)
+    return entry
+
+def _add_to_day(user_id, day, calories, protein, carbs, fat):
+    # Increment in SQL so concurrent adds from other workers aren't lost
+    increment = db.update(DailyNutritionTotal).where(
+        DailyNutritionTotal.user_id == user_id,
+        DailyNutritionTotal.day == day
+    ).values(
+        calories=DailyNutritionTotal.calories + calories,
+        protein=DailyNutritionTotal.protein + protein,
+        carbs=DailyNutritionTotal.carbs + carbs,
+        fat=DailyNutritionTotal.fat + fat,
+        entries=DailyNutritionTotal.entries + 1
+    ).execution_options(synchronize_session=False)
+
+    if db.session.execute(increment).rowcount:
+        return
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(DailyNutritionTotal(
+                user_id=user_id, day=day,
+                calories=calories, protein=protein, carbs=carbs, fat=fat, entries=1
+            ))
+    except IntegrityError:
+        # Another request created today's row first
+        db.session.execute(increment)
+
+def _as_totals(row):
+    if row is None:
+        return {'calories': 0, 'protein': 0.0, 'carbs': 0.0, 'fat': 0.0, 'entries': 0}
+    return {
+        'calories': row.calories or 0,
+        'protein': row.protein or 0.0,
+        'carbs': row.carbs or 0.0,
+        'fat': row.fat or 0.0,
+        'entries': row.entries or 0
+    }
+
+def day_totals(user_id, day):
+    """Totals for one day: a single-row lookup on (user_id, day)."""
+    row = DailyNutritionTotal.query.filter_by(user_id=user_id, day=day).first()
+    return _as_totals(row)
+
+def range_totals(user_id, start_day, end_day):
+    """
+    Sums over [start_day, end_day) from the daily rows, so a week or a month
+    reads at most 31 rows instead of every DietLog entry in the period.
+    Adds 'days_logged' to the totals.
+    """
+    row = db.session.execute(
+        db.select(
+            db.func.sum(DailyNutritionTotal.calories).label('calories'),
+            db.func.sum(DailyNutritionTotal.protein).label('protein'),
+            db.func.sum(DailyNutritionTotal.carbs).label('carbs'),
+            db.func.sum(DailyNutritionTotal.fat).label('fat'),
+            db.func.sum(DailyNutritionTotal.entries).label('entries'),
+            db.func.count(DailyNutritionTotal.id).label('days_logged')
+        ).where(
+            DailyNutritionTotal.user_id == user_id,
+            DailyNutritionTotal.day >= start_day,
+            DailyNutritionTotal.day < end_day
+        )
+    ).one()
+    totals = _as_totals(row)
+    totals['days_logged'] = row.days_logged
+    return totals
+
+def day_entries(user_id, day, page=1, per_page=20):
+    """Paginated DietLog entries for one day, newest first."""
+    day_start = datetime.combine(day, time.min)
+    return DietLog.query.filter(
+        DietLog.user_id == user_id,
+        DietLog.date >= day_start,
+        DietLog.date < day_start + timedelta(days=1)
+    ).order_by(DietLog.date.desc()).paginate(page=page, per_page=per_page, error_out=False)
+
+def rebuild_totals_statements(user_id=None):
+    """
+    DELETE + INSERT ... SELECT that recompute daily rows from DietLog, for
+    backfills or repairs. Optionally limited to one user.
+    """
+    day = db.func.date(DietLog.date)
+    source = db.select(
+        DietLog.user_id,
+        day,
+        db.func.sum(DietLog.calories),
+        db.func.coalesce(db.func.sum(DietLog.protein), 0.0),
+        db.func.coalesce(db.func.sum(DietLog.carbs), 0.0),
+        db.func.coalesce(db.func.sum(DietLog.fat), 0.0),
+        db.func.count(DietLog.id)
+    ).group_by(DietLog.user_id, day)
+    delete = db.delete(DailyNutritionTotal.__table__)
+
+    if user_id is not None:
+        source = source.where(DietLog.user_id == user_id)
+        delete = delete.where(DailyNutritionTotal.user_id == user_id)
+
+    table = DailyNutritionTotal.__table__
+    insert = table.insert().from_select(
+        [table.c.user_id, table.c.day, table.c.calories, table.c.protein, table.c.carbs, table.c.fat, table.c.entries],
+        source
+    )
+    return delete, insert
+
+def rebuild_totals(user_id=None):
+    shards = [shard_for_user(user_id)] if user_id is not None else shard_ids()
+    for shard_id in shards:
+        with using_shard(shard_id):
+            for statement in rebuild_totals_statements(user_id):
+                db.session.execute(statement)
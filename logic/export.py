@@ -0,0 +1,166 @@
+"""
+Streaming exports of workout and diet history, for /api/export and
+export_history.py.
+
+Rows come from a yield_per query (a server-side cursor where the driver has
+one) and are encoded, buffered into EXPORT_CHUNK_SIZE pieces and optionally
+gzipped one piece at a time, so memory stays flat however long the history.
+
+    workouts  one row per set: user_id, log_id, date, exercise_id, exercise,
+              set_index, reps, weight, rpe (a log without set rows gives one
+              row with empty set columns)
+    diet      one row per DietLog entry
+
+A single user's history is read from their shard in date order. Without a
+user_id every shard is read in turn, each in id order (no sort over the whole
+table), for bulk dumps.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime, time, timedelta
+
+from models import db, WorkoutExercise, WorkoutLog, WorkoutSet, DietLog
+from logic.catalog import load_catalog
+from sharding import shard_ids, user_shard, using_shard
+
+FORMATS = ('csv', 'jsonl')
+BATCH_SIZE = 1000 # rows per cursor fetch
+EXPORT_CHUNK_SIZE = 64 * 1024 # characters per yielded piece
+
+WORKOUT_COLUMNS = ('user_id', 'log_id', 'date', 'exercise_id', 'exercise', 'set_index', 'reps', 'weight', 'rpe')
+DIET_COLUMNS = ('user_id', 'entry_id', 'date', 'food_name', 'calories', 'protein', 'carbs', 'fat')
+
+def parse_date_range(start=None, end=None):
+    """
+    'YYYY-MM-DD' strings (either may be empty) -> (start, end) datetimes for
+    date >= start AND date < end, with end inclusive of its day. Raises ValueError.
+    """
+    try:
+        first = date.fromisoformat(start) if start else None
+        last = date.fromisoformat(end) if end else None
+    except ValueError:
+        raise ValueError("start and end must be dates like 2024-05-01")
+    if first and last and first > last:
+        raise ValueError("start is after end")
+    return (
+        datetime.combine(first, time.min) if first else None,
+        datetime.combine(last + timedelta(days=1), time.min) if last else None,
+    )
+
+def _in_range(query, column, start, end):
+    if start is not None:
+        query = query.where(column >= start)
+    if end is not None:
+        query = query.where(column < end)
+    return query
+
+def _workout_query(user_id, start, end):
+    query = db.select(
+        WorkoutLog.user_id, WorkoutLog.id, WorkoutLog.date, WorkoutExercise.exercise_id,
+        WorkoutSet.set_index, WorkoutSet.reps, db.func.coalesce(WorkoutSet.weight, WorkoutLog.weight), WorkoutSet.rpe
+    ).join(WorkoutExercise, WorkoutExercise.id == WorkoutLog.workout_exercise_id).outerjoin(
+        WorkoutSet, WorkoutSet.log_id == WorkoutLog.id
+    )
+    if user_id is not None:
+        query = query.where(WorkoutLog.user_id == user_id).order_by(WorkoutLog.date, WorkoutLog.id, WorkoutSet.set_index)
+    else:
+        query = query.order_by(WorkoutLog.id, WorkoutSet.set_index)
+    return _in_range(query, WorkoutLog.date, start, end)
+
+def _workout_row(row, names):
+    user_id, log_id, logged_at, exercise_id, set_index, reps, weight, rpe = row
+    return (user_id, log_id, logged_at.isoformat(), exercise_id, names.get(exercise_id),
+            set_index, reps, weight, rpe)
+
+def _diet_query(user_id, start, end):
+    query = db.select(
+        DietLog.user_id, DietLog.id, DietLog.date, DietLog.food_name,
+        DietLog.calories, DietLog.protein, DietLog.carbs, DietLog.fat
+    )
+    if user_id is not None:
+        query = query.where(DietLog.user_id == user_id).order_by(DietLog.date, DietLog.id)
+    else:
+        query = query.order_by(DietLog.id)
+    return _in_range(query, DietLog.date, start, end)
+
+def _diet_row(row, names):
+    user_id, entry_id, eaten_at, food_name, calories, protein, carbs, fat = row
+    return (user_id, entry_id, eaten_at.isoformat(), food_name, calories, protein, carbs, fat)
+
+# kind -> (columns, query builder, row formatter)
+KINDS = {
+    'workouts': (WORKOUT_COLUMNS, _workout_query, _workout_row),
+    'diet': (DIET_COLUMNS, _diet_query, _diet_row),
+}
+
+def _stream(query, to_row, names, batch_size):
+    for row in db.session.execute(query.execution_options(yield_per=batch_size)):
+        yield to_row(row, names)
+
+def history_rows(kind, user_id=None, start=None, end=None, batch_size=BATCH_SIZE):
+    """Yields export rows (tuples in KINDS[kind][0] order) for one user, or for every user with user_id=None."""
+    _, build_query, to_row = KINDS[kind]
+    # Exercise names from the cached catalog, taken once before a cursor is open
+    names = {entry.id: entry.name for entry in load_catalog().get((None, None, None), ())}
+    query = build_query(user_id, start, end)
+    if user_id is not None:
+        with user_shard(user_id):
+            yield from _stream(query, to_row, names, batch_size)
+        return
+    for shard_id in shard_ids():
+        with using_shard(shard_id):
+            yield from _stream(query, to_row, names, batch_size)
+            # Don't hold a read transaction on one shard while reading the next
+            db.session.commit()
+
+def encode(rows, columns, fmt):
+    """Yields the rows as CSV (with a header) or JSONL text, a line at a time."""
+    if fmt == 'jsonl':
+        for row in rows:
+            yield json.dumps(dict(zip(columns, row))) + '\n'
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for row in _with_header(columns, rows):
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def _with_header(columns, rows):
+    yield columns
+    yield from rows
+
+def chunked(lines, size=EXPORT_CHUNK_SIZE):
+    """Joins text lines into UTF-8 pieces of about size characters."""
+    pending, length = [], 0
+    for line in lines:
+        pending.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(pending).encode('utf-8')
+            pending, length = [], 0
+    if pending:
+        yield ''.join(pending).encode('utf-8')
+
+def gzipped(chunks, level=6):
+    """Compresses a stream of bytes into one gzip member, piece by piece."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export(kind, fmt='csv', user_id=None, start=None, end=None, compress=False, batch_size=BATCH_SIZE):
+    """The whole export as an iterator of bytes pieces, gzipped with compress."""
+    if kind not in KINDS:
+        raise ValueError(f"unknown export {kind!r}; expected one of {', '.join(KINDS)}")
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    rows = history_rows(kind, user_id, start, end, batch_size)
+    chunks = chunked(encode(rows, KINDS[kind][0], fmt))
+    return gzipped(chunks) if compress else chunks
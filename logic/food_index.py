@@ -0,0 +1,158 @@
+"""
+Local full-text food index (SQLite FTS5) built from an OpenFoodFacts dump.
+
+The index lives in its own SQLite file, separate from fitness.db, so it can be
+rebuilt offline and swapped in atomically. Path defaults to instance/foods.db
+and can be overridden with the FOOD_INDEX_PATH environment variable.
+"""
+import csv
+import gzip
+import json
+import os
+import re
+import sqlite3
+import threading
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'foods.db')
+
+# Candidates pulled from FTS before Python-side ranking
+MAX_CANDIDATES = 500
+
+_local = threading.local()
+
+def index_path():
+    return os.environ.get('FOOD_INDEX_PATH', DEFAULT_PATH)
+
+def is_available(path=None):
+    return os.path.exists(path or index_path())
+
+def _connect(path):
+    """Read-only connection, cached per thread and per index file."""
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    mtime = os.path.getmtime(path)
+    cached = connections.get(path)
+    if cached and cached[1] == mtime:
+        return cached[0]
+    if cached:
+        cached[0].close() # index was rebuilt and swapped in
+
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    connections[path] = (conn, mtime)
+    return conn
+
+def match_expression(query):
+    """Every query token must match as a word prefix: 'chicken bre' -> "chicken"* "bre"*"""
+    tokens = re.findall(r'\w+', query.lower())
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+def fuzzy_expression(query):
+    """Looser fallback: any token's 3-letter prefix, so 'bananna' still reaches 'banana' for fuzzy ranking."""
+    tokens = re.findall(r'\w+', query.lower())
+    return ' OR '.join(f'"{token[:3]}"*' for token in tokens)
+
+def lookup(query, path=None, max_candidates=MAX_CANDIDATES, fuzzy=False):
+    """
+    Returns candidate items ('name', 'calories', 'protein', 'carbs', 'fat' per 100g)
+    whose name matches the query, most popular first, ready for rank_items.
+    With fuzzy=True a query with no strict match is retried with fuzzy_expression.
+    """
+    expression = match_expression(query)
+    if not expression:
+        return []
+
+    conn = _connect(path or index_path())
+    rows = _match(conn, expression, max_candidates)
+    if not rows and fuzzy:
+        rows = _match(conn, fuzzy_expression(query), max_candidates)
+
+    return [
+        {"name": name, "calories": calories, "protein": protein, "carbs": carbs, "fat": fat}
+        for name, calories, protein, carbs, fat, _ in rows
+    ]
+
+def _match(conn, expression, max_candidates):
+    return conn.execute(
+        """
+        SELECT name, calories, protein, carbs, fat, popularity FROM (
+            SELECT name, calories, protein, carbs, fat, popularity FROM foods
+            WHERE foods MATCH ? ORDER BY rank LIMIT ?
+        ) ORDER BY popularity DESC
+        """,
+        (expression, max_candidates)
+    ).fetchall()
+
+# --- Import ---
+
+NUTRIMENT_COLUMNS = ['energy-kcal_100g', 'energy_100g', 'proteins_100g', 'carbohydrates_100g', 'fat_100g']
+
+def _open_text(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+def read_dump(path):
+    """
+    Yields OpenFoodFacts products from a JSONL dump (one product per line, as in
+    openfoodfacts-products.jsonl) or a CSV/TSV export with flat *_100g columns.
+    CSV rows are reshaped into the same {'product_name', 'nutriments', ...} form.
+    """
+    base = path[:-3] if path.endswith('.gz') else path
+
+    with _open_text(path) as f:
+        if base.endswith(('.jsonl', '.json')):
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            csv.field_size_limit(10 * 1024 * 1024)
+            # The official "CSV" export is tab-separated; sniff the header
+            delimiter = '\t' if '\t' in f.readline() else ','
+            f.seek(0)
+            for row in csv.DictReader(f, delimiter=delimiter):
+                yield {
+                    'product_name': row.get('product_name'),
+                    'unique_scans_n': row.get('unique_scans_n'),
+                    'nutriments': {key: row.get(key) for key in NUTRIMENT_COLUMNS if row.get(key) not in (None, '')}
+                }
+
+def build_index(rows, path=None, batch_size=5000):
+    """
+    Writes (item, popularity) pairs into a fresh index file. The index is built
+    next to the target and renamed over it, so readers never see a partial index.
+    Returns the number of rows written.
+    """
+    path = path or index_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    conn.execute(
+        "CREATE VIRTUAL TABLE foods USING fts5("
+        "name, calories UNINDEXED, protein UNINDEXED, carbs UNINDEXED, fat UNINDEXED, popularity UNINDEXED, "
+        "tokenize = 'unicode61 remove_diacritics 2')"
+    )
+
+    count = 0
+    batch = []
+    for item, popularity in rows:
+        batch.append((item['name'], item['calories'], item['protein'], item['carbs'], item['fat'], popularity))
+        if len(batch) >= batch_size:
+            conn.executemany("INSERT INTO foods VALUES (?, ?, ?, ?, ?, ?)", batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO foods VALUES (?, ?, ?, ?, ?, ?)", batch)
+        count += len(batch)
+
+    conn.execute("INSERT INTO foods(foods) VALUES ('optimize')")
+    conn.commit()
+    conn.close()
+
+    os.replace(tmp_path, path)
+    return count
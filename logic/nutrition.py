@@ -1,93 +1,343 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import logging
+import os
+import threading
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from logic import food_index, ranking
+from logic.cache import TTLCache, MemoryBackend, SQLiteBackend
+
+# Module logger: searches also run on executor threads, outside any app context
+logger = logging.getLogger(__name__)
+
+# Search result cache. Backend 'memory' is per process; 'sqlite' is shared by all workers.
+FOOD_CACHE_BACKEND = os.environ.get('FOOD_CACHE_BACKEND', 'memory')
+FOOD_CACHE_PATH = os.environ.get('FOOD_CACHE_PATH', os.path.join(os.path.dirname(food_index.DEFAULT_PATH), 'food_cache.db'))
+FOOD_CACHE_SIZE = int(os.environ.get('FOOD_CACHE_SIZE', 1024))
+FOOD_CACHE_TTL = int(os.environ.get('FOOD_CACHE_TTL', 24 * 3600))
+# Failures and empty results are remembered briefly so an outage doesn't hammer upstream
+FOOD_CACHE_NEGATIVE_TTL = int(os.environ.get('FOOD_CACHE_NEGATIVE_TTL', 60))
+# Typo-tolerant ranking (and a looser local-index lookup when the strict one finds nothing)
+FOOD_SEARCH_FUZZY = os.environ.get('FOOD_SEARCH_FUZZY', '0') == '1'
+
+_food_cache = None
+
+def food_cache():
+    global _food_cache
+    if _food_cache is None:
+        if FOOD_CACHE_BACKEND == 'sqlite':
+            backend = SQLiteBackend(FOOD_CACHE_PATH, max_entries=FOOD_CACHE_SIZE)
+        else:
+            backend = MemoryBackend(max_entries=FOOD_CACHE_SIZE)
+        _food_cache = TTLCache(backend, ttl=FOOD_CACHE_TTL, negative_ttl=FOOD_CACHE_NEGATIVE_TTL)
+    return _food_cache
+
+def cache_key(query, limit):
+    return f"{' '.join(query.lower().split())}|{limit}"
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def product_to_item(product):
+    """
+    Extracts the per-100g nutriments from an OpenFoodFacts product (API result or dump row).
+    Returns a dict with 'name', 'calories', 'protein', 'carbs', 'fat', or None if the product has no name.
+    """
+    nutriments = product.get('nutriments') or {}
+    product_name = product.get('product_name') or ''
+
+    if not product_name.strip():
+        return None
+
+    calories = _number(nutriments.get('energy-kcal_100g'))
+    if calories is None:
+        kj = _number(nutriments.get('energy_100g'))
+        if kj:
+            calories = kj / 4.184
+        else:
+            calories = 0
+
+    return {
+        "name": product_name,
+        "calories": float(calories),
+        "protein": _number(nutriments.get('proteins_100g')) or 0.0,
+        "carbs": _number(nutriments.get('carbohydrates_100g')) or 0.0,
+        "fat": _number(nutriments.get('fat_100g')) or 0.0
+    }
+
+def rank_items(query, items, limit=10, fuzzy=False):
+    """
+    Sorts results to prefer simple, exact matches over complex branded items
+    (see logic/ranking.py for the scoring). Items keep their incoming order on
+    ties (upstream popularity).
+    """
+    query_lower = query.lower().strip()
+
+    # Skip items with zero calories AND zero protein (likely bad data or water/additives)
+    # unless query is explicitly for something like "water"
+    if "water" not in query_lower:
+        items = [item for item in items if item['calories'] != 0 or item['protein'] != 0]
+
+    # Return top N items
+    return [items[i] for i in ranking.rank(query, [item['name'] for item in items], limit, fuzzy=fuzzy)]
+
+# --- OpenFoodFacts client ---
+
+NUTRITION_API_URL = os.environ.get('NUTRITION_API_URL', 'https://world.openfoodfacts.org')
+NUTRITION_TIMEOUT = float(os.environ.get('NUTRITION_TIMEOUT', 5))
+NUTRITION_RETRIES = int(os.environ.get('NUTRITION_RETRIES', 2))
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures and rejects calls for
+    reset_timeout seconds. Then one trial call is let through (half-open):
+    success closes the circuit, failure opens it again.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+class NutritionClient:
+    """
+    OpenFoodFacts search client on a persistent, connection-pooled session.
+    Transient errors (connection failures, 429/5xx) are retried with
+    exponential backoff; repeated failures trip the circuit breaker so callers
+    fail fast instead of waiting on a dead upstream.
+    """
+    # Upper bounds (seconds) of the latency histogram buckets
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, base_url=NUTRITION_API_URL, timeout=NUTRITION_TIMEOUT, retries=NUTRITION_RETRIES,
+                 backoff_factor=0.3, pool_size=10, breaker=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._lock = threading.Lock()
+        self.metrics = {
+            'requests': 0,
+            'errors': 0,
+            'rejected': 0,
+            'search_failures': 0, # search_food calls answered empty because of an error
+            'latency_sum': 0.0,
+            'latency_buckets': [0] * (len(self.LATENCY_BUCKETS) + 1)
+        }
+
+    def _observe(self, elapsed, error):
+        with self._lock:
+            self.metrics['requests'] += 1
+            self.metrics['latency_sum'] += elapsed
+            if error:
+                self.metrics['errors'] += 1
+            for i, bound in enumerate(self.LATENCY_BUCKETS):
+                if elapsed <= bound:
+                    self.metrics['latency_buckets'][i] += 1
+                    break
+            else:
+                self.metrics['latency_buckets'][-1] += 1
+
+    def search(self, query, page_size=100):
+        """
+        Returns the raw product list for the query, sorted by popularity.
+        Raises CircuitOpenError while the breaker is open, requests exceptions otherwise.
+        """
+        if not self.breaker.allow():
+            with self._lock:
+                self.metrics['rejected'] += 1
+            raise CircuitOpenError(f"Nutrition API circuit open after {self.breaker.failures} failures")
+
+        params = {
+            "search_terms": query,
+            "search_simple": 1,
+            "action": "process",
+            "json": 1,
+            "page_size": page_size,
+            "sort_by": "unique_scans_n"
+        }
+        start = time.perf_counter()
+        try:
+            response = self.session.get(f"{self.base_url}/cgi/search.pl", params=params, timeout=self.timeout)
+            response.raise_for_status()
+            products = response.json().get('products', [])
+        except Exception:
+            self._observe(time.perf_counter() - start, True)
+            self.breaker.record_failure()
+            raise
+
+        self._observe(time.perf_counter() - start, False)
+        self.breaker.record_success()
+        return products
+
+    def record_search_failure(self):
+        with self._lock:
+            self.metrics['search_failures'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics, latency_buckets=list(self.metrics['latency_buckets']))
+        stats['circuit'] = self.breaker.state
+        return stats
+
+    def close(self):
+        self.session.close()
+
+_client = None
+_client_pid = None
+
+def get_client():
+    # One client per process; pooled sockets must not be shared across a fork
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _client = NutritionClient()
+        _client_pid = os.getpid()
+    return _client
+
+def fetch_remote(query):
+    """
+    Fetches candidate products for the query from the OpenFoodFacts search API.
+    Raises on network/HTTP errors or while the circuit is open.
+    """
+    # Fetch more results initially to allow for filtering and re-ranking
+    products = get_client().search(query, page_size=100)
+    items = (product_to_item(product) for product in products)
+    return [item for item in items if item]
 
 def search_food(query, limit=10):
     """
-    Searches OpenFoodFacts for the given query.
+    Searches for the given query, in the local food index when one has been
+    imported (see import_foods.py), otherwise on OpenFoodFacts.
     Returns a list of dicts with 'name', 'calories', 'protein', 'carbs', 'fat' (per 100g).
     Sorts results to prefer simple, exact matches over complex branded items.
+    Results (including failures and empty results, briefly) are cached per normalized query and limit.
     """
-    url = "https://world.openfoodfacts.org/cgi/search.pl"
-    # Fetch more results initially to allow for filtering and re-ranking
-    params = {
-        "search_terms": query,
-        "search_simple": 1,
-        "action": "process",
-        "json": 1,
-        "page_size": 100, 
-        "sort_by": "unique_scans_n"
-    }
-    
-    candidates = []
-    
+    found, results = food_cache().get(cache_key(query, limit))
+    if found:
+        return results or []
+    return _search_and_store(query, limit)
+
+def _search_and_store(query, limit):
+    cache = food_cache()
+    key = cache_key(query, limit)
+
     try:
-        response = requests.get(url, params=params, timeout=5)
-        response.raise_for_status()
-        data = response.json()
-        
-        products = data.get('products', [])
-        
-        for product in products:
-            nutriments = product.get('nutriments', {})
-            product_name = product.get('product_name', '')
-            
-            if not product_name or not product_name.strip():
-                continue
-                
-            # Normalize name for scoring
-            name_lower = product_name.lower().strip()
-            query_lower = query.lower().strip()
-            
-            # Basic validation: must have some nutrition info
-            calories = nutriments.get('energy-kcal_100g')
-            if calories is None:
-                kj = nutriments.get('energy_100g')
-                if kj:
-                    calories = kj / 4.184
-                else:
-                    calories = 0
-            
-            # Skip items with zero calories AND zero protein (likely bad data or water/additives)
-            # unless query is explicitly for something like "water"
-            if calories == 0 and nutriments.get('proteins_100g', 0) == 0 and "water" not in query_lower:
-                continue
-
-            item = {
-                "name": product_name,
-                "calories": float(calories),
-                "protein": float(nutriments.get('proteins_100g', 0)),
-                "carbs": float(nutriments.get('carbohydrates_100g', 0)),
-                "fat": float(nutriments.get('fat_100g', 0))
-            }
-
-            # Scoring Logic
-            # Lower score is better (like rank)
-            score = 0
-            
-            # 1. Exact match (Overwhelming bonus)
-            if name_lower == query_lower:
-                score -= 1000
-            
-            # 2. Starts with query (bonus)
-            elif name_lower.startswith(query_lower):
-                score -= 50
-                
-            # 3. Contains query (prerequisite usually, but good to check)
-            if query_lower in name_lower:
-                score -= 10
-            
-            # 4. Penalty for length
-            # Add 2 points per character over the query length to penalize long names heavily
-            length_penalty = (len(name_lower) - len(query_lower)) * 2
-            score += length_penalty
-            
-            candidates.append((score, item))
-            
-        # Sort by score
-        candidates.sort(key=lambda x: x[0])
-        
-        # Return top N items
-        return [c[1] for c in candidates[:limit]]
-        
+        if food_index.is_available():
+            items = food_index.lookup(query, fuzzy=FOOD_SEARCH_FUZZY)
+        else:
+            items = fetch_remote(query)
+        results = rank_items(query, items, limit, fuzzy=FOOD_SEARCH_FUZZY)
+
     except Exception as e:
-        print(f"Error fetching food data: {e}")
+        logger.warning("Food search for %r failed: %s: %s", query, type(e).__name__, e)
+        get_client().record_search_failure()
+        cache.set_negative(key)
         return []
+
+    if results:
+        cache.set(key, results)
+    else:
+        cache.set_negative(key, results)
+    return results
+
+# --- Background search with request coalescing ---
+
+FOOD_SEARCH_THREADS = int(os.environ.get('FOOD_SEARCH_THREADS', 4))
+
+_executor = None
+_executor_pid = None
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+def _get_executor():
+    # Created lazily and per process: a pool inherited across fork has no threads
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=FOOD_SEARCH_THREADS, thread_name_prefix='food-search')
+        _executor_pid = os.getpid()
+        _inflight.clear()
+    return _executor
+
+def search_food_async(query, limit=10):
+    """
+    Returns a Future for search_food(query, limit) without blocking the caller.
+    Cache hits come back as an already-completed future. Concurrent misses for
+    the same normalized query share one in-flight fetch (single-flight), so a
+    burst of identical searches in this process costs one upstream call.
+    Coalesced callers share the result list, so treat it as read-only.
+    """
+    key = cache_key(query, limit)
+    found, results = food_cache().get(key)
+    if found:
+        future = Future()
+        future.set_result(results or [])
+        return future
+
+    with _inflight_lock:
+        executor = _get_executor()
+        future = _inflight.get(key)
+        if future is None:
+            future = executor.submit(_search_and_store, query, limit)
+            _inflight[key] = future
+            future.add_done_callback(lambda f: _forget(key, f))
+    return future
+
+def _forget(key, future):
+    with _inflight_lock:
+        if _inflight.get(key) is future:
+            del _inflight[key]
@@ -1,44 +1,252 @@
-from models import db, WorkoutExercise
+"""
+Progression engine: next-session loads for plan exercises.
+
+next_loads() works on plain data for any number of exercises (and users) at
+once: the last few sessions of each exercise, newest first, and its rep range
+and muscle group. refresh_suggestions() feeds it from two queries and stores
+the results in SuggestedLoad. Plan generation (the generate_plans job and
+regenerate_plans.py) stores them for new plans, /log POST refreshes the logged
+exercise, and /log GET only reads: an exercise without a stored row (plans
+from before SuggestedLoad) is computed with compute_suggestions() and shown,
+not written, until its next log.
+
+Rules, per exercise:
+    no history                     new       DEFAULT_START_LOAD
+    every set at the top of range  progress  +5 kg legs, +2.5 kg otherwise
+    STALL_SESSIONS sessions at the
+    same weight, e1RM not improving deload    DELOAD_FACTOR of the weight, rounded to PLATE_STEP
+                                              (never above the weight)
+    otherwise                      hold      same weight
+"""
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+
+from models import db, WorkoutPlan, WorkoutExercise, WorkoutLog, WorkoutSet, SuggestedLoad, parse_reps
+from logic.catalog import get_entry
+from logic.training_log import epley_1rm
+
+DEFAULT_START_LOAD = 20.0 # empty bar
+STALL_SESSIONS = 3
+DELOAD_FACTOR = 0.9
+PLATE_STEP = 2.5
+HISTORY_DEPTH = STALL_SESSIONS
+
+# One logged session: weight and the reps of each set
+LoggedSession = namedtuple('LoggedSession', ['weight', 'reps'])
+Suggestion = namedtuple('Suggestion', ['weight', 'e1rm', 'status', 'sessions'])
+
+def parse_rep_range(text):
+    """'8-12' -> (8, 12), None if unparseable."""
+    try:
+        low, high = map(int, text.split('-'))
+    except (AttributeError, ValueError):
+        return None
+    return low, high
+
+def session_e1rm(session):
+    if session.weight is None or not session.reps:
+        return None
+    return max(epley_1rm(session.weight, reps) for reps in session.reps)
+
+def increment_for(muscle_group):
+    return 5.0 if muscle_group and 'legs' in muscle_group else 2.5
+
+def _is_stalled(history):
+    if len(history) < STALL_SESSIONS:
+        return False
+    window = history[:STALL_SESSIONS]
+    if any(session.weight != window[0].weight for session in window):
+        return False
+    newest, oldest = session_e1rm(window[0]), session_e1rm(window[-1])
+    return newest is not None and oldest is not None and newest <= oldest
+
+def deload_weight(weight):
+    """DELOAD_FACTOR of the weight on the plate grid, never above the weight itself (2 kg stays 2 kg)."""
+    return min(weight, round(weight * DELOAD_FACTOR / PLATE_STEP) * PLATE_STEP)
+
+def next_loads(histories, targets):
+    """
+    histories: {key: [LoggedSession, ...] newest first} (missing key = never logged)
+    targets: {key: (reps_range, muscle_group)}
+    Returns {key: Suggestion} for every key of targets; keys are whatever the
+    caller uses (workout exercise ids here).
+
+    Works a column at a time over the whole batch, like array code would:
+    rep ranges and increments are parsed once per distinct value (a batch of
+    thousands of keys shares a handful), each rule is a mask over the keys the
+    earlier rules left undecided, and the stall check only runs on those.
+    """
+    keys = list(targets)
+    rep_ranges = {text: parse_rep_range(text) for text, _ in set(targets.values())}
+    increments = {group: increment_for(group) for _, group in set(targets.values())}
+
+    history = [histories.get(key) or () for key in keys]
+    last = [sessions[0] if sessions else None for sessions in history]
+    tops = [(rep_ranges[targets[key][0]] or (None, None))[1] for key in keys]
+    e1rms = [session_e1rm(session) if session else None for session in last]
+
+    # Rule masks, first match wins; None = undecided so far
+    statuses = ['new' if session is None else None for session in last]
+    statuses = [status or ('hold' if session.weight is None or top is None or not session.reps else None)
+                for status, session, top in zip(statuses, last, tops)]
+    statuses = [status or ('progress' if min(session.reps) >= top else None)
+                for status, session, top in zip(statuses, last, tops)]
+    statuses = [status or ('deload' if _is_stalled(sessions) else 'hold')
+                for status, sessions in zip(statuses, history)]
+
+    weights = [
+        DEFAULT_START_LOAD if session is None or session.weight is None
+        else session.weight + increments[targets[key][1]] if status == 'progress'
+        else deload_weight(session.weight) if status == 'deload'
+        else session.weight
+        for key, session, status in zip(keys, last, statuses)
+    ]
+    return {
+        key: Suggestion(weight, e1rm, status, len(sessions))
+        for key, weight, e1rm, status, sessions in zip(keys, weights, e1rms, statuses, history)
+    }
 
 def suggest_next_load(exercise_history):
     """
-    Suggests the next load based on the most recent workout history for an exercise.
-    exercise_history: list of WorkoutLog objects (or dicts) sorted by date (most recent first).
-    
-    Rule:
-    If user completed all sets with max reps in range -> Increase weight by 2.5kg (Upper) or 5kg (Lower) for next session.
+    Next load from WorkoutLog objects of one exercise, most recent first.
+    Kept for single-exercise callers; pages read SuggestedLoad instead.
     """
     if not exercise_history:
         return None # No history, can't suggest
 
-    last_session = exercise_history[0]
-    
-    # Check if we hit the top of the rep range
-    # reps_range format: "8-12"
+    workout_exercise = exercise_history[0].workout_exercise
+    history = [LoggedSession(log.weight, log.sets_performed) for log in exercise_history[:HISTORY_DEPTH]]
+    target = (workout_exercise.reps_range, workout_exercise.exercise.muscle_group)
+    return next_loads({0: history}, {0: target})[0].weight
+
+def latest_logs(user_id, workout_exercise_ids):
+    """
+    Fetches the most recent WorkoutLog for each of the given workout exercises
+    in a single query (ROW_NUMBER per workout_exercise_id, newest first).
+    Returns a dict of workout_exercise_id -> WorkoutLog.
+    """
+    if not workout_exercise_ids:
+        return {}
+
+    ranked = _ranked_logs(user_id, workout_exercise_ids)
+    logs = db.session.execute(
+        db.select(WorkoutLog).join(ranked, WorkoutLog.id == ranked.c.id).where(ranked.c.rn == 1)
+        .options(selectinload(WorkoutLog.sets)) # sets_performed without a query per log
+    ).scalars()
+    return {log.workout_exercise_id: log for log in logs}
+
+def _ranked_logs(user_id, workout_exercise_ids):
+    return db.select(
+        WorkoutLog.id,
+        db.func.row_number().over(
+            partition_by=WorkoutLog.workout_exercise_id,
+            order_by=(WorkoutLog.date.desc(), WorkoutLog.id.desc())
+        ).label('rn')
+    ).where(
+        WorkoutLog.user_id == user_id,
+        WorkoutLog.workout_exercise_id.in_(workout_exercise_ids)
+    ).subquery()
+
+def recent_sessions(user_id, workout_exercise_ids, depth=HISTORY_DEPTH):
+    """
+    The last `depth` sessions of each workout exercise as LoggedSession lists,
+    newest first: one ranked query for the logs, one for their sets.
+    """
+    if not workout_exercise_ids:
+        return {}
+
+    ranked = _ranked_logs(user_id, workout_exercise_ids)
+    logs = db.session.execute(
+        db.select(WorkoutLog.id, WorkoutLog.workout_exercise_id, WorkoutLog.weight, WorkoutLog.reps_performed)
+        .join(ranked, WorkoutLog.id == ranked.c.id)
+        .where(ranked.c.rn <= depth)
+        .order_by(WorkoutLog.workout_exercise_id, ranked.c.rn)
+    ).all()
+
+    reps_by_log = {}
+    if logs:
+        for log_id, reps in db.session.execute(
+            db.select(WorkoutSet.log_id, WorkoutSet.reps)
+            .where(WorkoutSet.log_id.in_([log.id for log in logs]))
+            .order_by(WorkoutSet.log_id, WorkoutSet.set_index)
+        ):
+            reps_by_log.setdefault(log_id, []).append(reps)
+
+    histories = {}
+    for log in logs:
+        # Logs without WorkoutSet rows (not backfilled yet) fall back to the CSV
+        reps = reps_by_log.get(log.id) or parse_reps(log.reps_performed)
+        histories.setdefault(log.workout_exercise_id, []).append(LoggedSession(log.weight, reps))
+    return histories
+
+def _targets(user_id, workout_exercise_ids):
+    query = db.select(WorkoutExercise.id, WorkoutExercise.exercise_id, WorkoutExercise.reps_range).join(
+        WorkoutPlan, WorkoutExercise.plan_id == WorkoutPlan.id
+    ).where(WorkoutPlan.user_id == user_id)
+    if workout_exercise_ids is not None:
+        query = query.where(WorkoutExercise.id.in_(workout_exercise_ids))
+
+    targets = {}
+    for we_id, exercise_id, reps_range in db.session.execute(query):
+        # Exercise lives in the main database; the catalog index saves a cross-database lookup
+        entry = get_entry(exercise_id)
+        targets[we_id] = (reps_range, entry.muscle_group if entry else None)
+    return targets
+
+def compute_suggestions(user_id, workout_exercise_ids=None):
+    """Suggestions for the user's plan exercises (all by default), without storing them: {workout_exercise_id: Suggestion}."""
+    if workout_exercise_ids is not None and not workout_exercise_ids:
+        return {}
+    targets = _targets(user_id, workout_exercise_ids)
+    if not targets:
+        return {}
+    return next_loads(recent_sessions(user_id, list(targets)), targets)
+
+def refresh_suggestions(user_id, workout_exercise_ids=None):
+    """
+    Recomputes and stores SuggestedLoad rows for the user's plan exercises
+    (all of them by default) in the caller's transaction; the caller commits.
+    Returns {workout_exercise_id: Suggestion}.
+    """
+    suggestions = compute_suggestions(user_id, workout_exercise_ids)
+    if not suggestions:
+        return {}
+
+    now = datetime.utcnow()
+    rows = [
+        {'user_id': user_id, 'workout_exercise_id': we_id, 'weight': s.weight, 'e1rm': s.e1rm,
+         'status': s.status, 'sessions': s.sessions, 'updated_at': now}
+        for we_id, s in suggestions.items()
+    ]
+    replace = db.delete(SuggestedLoad).where(
+        SuggestedLoad.workout_exercise_id.in_(list(suggestions))
+    ).execution_options(synchronize_session=False)
+
     try:
-        min_reps, max_reps = map(int, last_session.reps_range.split('-'))
-    except:
-        return last_session.weight # Fallback
-        
-    # Check if all sets met the max_reps condition
-    # 'sets_performed' is a property on WorkoutLog that returns a list of ints.
-    sets_performed = last_session.sets_performed
-    
-    if not sets_performed:
-        return last_session.weight
-
-    all_maxed = all(r >= max_reps for r in sets_performed)
-    
-    if all_maxed:
-        # Determine increment based on muscle group
-        # We need the exercise object.
-        # last_session.workout_exercise is the association object, which has .exercise
-        exercise = last_session.workout_exercise.exercise
-        if 'legs' in exercise.muscle_group:
-            increment = 5.0
-        else:
-            increment = 2.5
-        
-        return last_session.weight + increment
-    else:
-        return last_session.weight
+        with db.session.begin_nested():
+            db.session.execute(replace)
+            db.session.execute(db.insert(SuggestedLoad), rows)
+    except IntegrityError:
+        # A concurrent refresh of the same exercise inserted first; ours is as fresh
+        with db.session.begin_nested():
+            db.session.execute(replace)
+            db.session.execute(db.insert(SuggestedLoad), rows)
+    return suggestions
+
+def suggested_loads(user_id, workout_exercise_ids):
+    """Stored suggestions for the given workout exercises: {workout_exercise_id: Suggestion}."""
+    if not workout_exercise_ids:
+        return {}
+    rows = db.session.execute(
+        db.select(
+            SuggestedLoad.workout_exercise_id, SuggestedLoad.weight, SuggestedLoad.e1rm,
+            SuggestedLoad.status, SuggestedLoad.sessions
+        ).where(
+            SuggestedLoad.user_id == user_id,
+            SuggestedLoad.workout_exercise_id.in_(workout_exercise_ids)
+        )
+    )
+    return {row.workout_exercise_id: Suggestion(row.weight, row.e1rm, row.status, row.sessions) for row in rows}
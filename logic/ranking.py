@@ -0,0 +1,89 @@
+"""
+Batch scorer for food search candidates.
+
+Scores a whole list of candidate names at once (lower is better) and selects the
+top k with a heap instead of sorting every candidate, so ranking tens of
+thousands of local-index hits stays cheap. Scoring rules:
+
+    exact match           -1000
+    starts with query       -50
+    contains query          -10
+    length penalty           +2 per character over the query length
+    fuzzy token match (opt) up to -60 (prefix + contains), for names that don't contain the query
+"""
+from array import array
+from difflib import SequenceMatcher
+import heapq
+import re
+
+FUZZY_THRESHOLD = 0.75
+
+_token_re = re.compile(r'\w+')
+
+def normalize(name):
+    return name.lower().strip()
+
+def normalize_all(names):
+    return [name.lower().strip() for name in names]
+
+def _token_similarity(query_tokens, name):
+    """Mean best-match ratio of each query token against the name's tokens (0..1)."""
+    name_tokens = _token_re.findall(name)
+    if not name_tokens:
+        return 0.0
+
+    total = 0.0
+    for q in query_tokens:
+        best = 0.0
+        for t in name_tokens:
+            matcher = SequenceMatcher(None, q, t)
+            # Cheap upper bounds first; most pairs are rejected before ratio()
+            if matcher.real_quick_ratio() < FUZZY_THRESHOLD or matcher.quick_ratio() < FUZZY_THRESHOLD:
+                continue
+            best = max(best, matcher.ratio())
+        total += best
+    return total / len(query_tokens)
+
+def score_names(query, names, fuzzy=False):
+    """
+    Scores already-normalized names against the query.
+    Returns an array of ints aligned with names.
+    """
+    q = normalize(query)
+    q_len = len(q)
+    scores = array('l', [(len(name) - q_len) * 2 for name in names])
+
+    # Only names containing the query get a bonus; exact/prefix stack with it
+    for i in [i for i, name in enumerate(names) if q in name]:
+        name = names[i]
+        if name == q:
+            scores[i] -= 1010
+        elif name.startswith(q):
+            scores[i] -= 60
+        else:
+            scores[i] -= 10
+
+    if fuzzy:
+        query_tokens = _token_re.findall(q)
+        if query_tokens:
+            for i, name in enumerate(names):
+                if q not in name:
+                    similarity = _token_similarity(query_tokens, name)
+                    if similarity >= FUZZY_THRESHOLD:
+                        scores[i] -= int(round(60 * similarity))
+    return scores
+
+def top_k(scores, k):
+    """
+    Indices of the k lowest scores, best first. Ties keep their input order
+    (heapq.nsmallest is stable), so upstream popularity breaks ties.
+    """
+    if k >= len(scores):
+        return sorted(range(len(scores)), key=scores.__getitem__)
+    return heapq.nsmallest(k, range(len(scores)), key=scores.__getitem__)
+
+def rank(query, names, k, fuzzy=False, normalized=False):
+    """Indices of the best k names for the query. Pass normalized=True to skip re-normalizing."""
+    if not normalized:
+        names = normalize_all(names)
+    return top_k(score_names(query, names, fuzzy=fuzzy), k)
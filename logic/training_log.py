@@ -0,0 +1,287 @@
+from datetime import datetime, timedelta, timezone
+import json
+import math
+import os
+
+from models import db, WorkoutPlan, WorkoutExercise, WorkoutLog, WorkoutSet, IdempotencyKey, parse_reps
+from sharding import shard_ids, using_shard
+
+# Limits of one session posted to /api/sessions. 12 sets of up to 999 reps
+# keep the reps_performed summary within its 50 characters.
+MAX_SESSION_EXERCISES = 30
+MAX_SETS = 12
+MAX_REPS = 999
+MAX_WEIGHT = 1000.0 # kg
+RPE_RANGE = (1, 10)
+# How long a session's idempotency key (and stored response) is kept. A
+# client replaying its offline queue after this logs the session again.
+IDEMPOTENCY_KEY_TTL_DAYS = float(os.environ.get('IDEMPOTENCY_KEY_TTL_DAYS', 30))
+EXPIRE_BATCH_SIZE = 1000
+
+def _set_rows(log_id, weight, reps, rpe=None):
+    return [
+        {'log_id': log_id, 'set_index': index, 'reps': count, 'weight': weight, 'rpe': rpe}
+        for index, count in enumerate(reps, start=1)
+    ]
+
+def log_workout(user_id, workout_exercise_id, weight, reps, date=None, rpe=None):
+    """
+    Logs a session as a WorkoutLog plus one WorkoutSet per entry in reps, in
+    the caller's transaction (the caller commits). reps_performed keeps the
+    "10,10,8" summary for display. Returns the new WorkoutLog.
+    """
+    entry = WorkoutLog(
+        user_id=user_id,
+        workout_exercise_id=workout_exercise_id,
+        weight=weight,
+        reps_performed=','.join(map(str, reps)),
+        date=date or datetime.utcnow()
+    )
+    db.session.add(entry)
+    db.session.flush()
+    if reps:
+        # One executemany rather than a flush per set object
+        db.session.execute(db.insert(WorkoutSet), _set_rows(entry.id, weight, reps, rpe))
+    return entry
+
+def log_session(user_id, entries, date=None):
+    """
+    Logs a whole session in two INSERTs (logs, then every set) in the
+    caller's transaction. entries: [{'workout_exercise_id', 'weight',
+    'sets': [{'reps', 'weight', 'rpe'}]}] as returned by parse_session.
+    Returns the new log ids in entry order.
+    """
+    if not entries:
+        return []
+    date = date or datetime.utcnow()
+    log_rows = [
+        {'user_id': user_id, 'workout_exercise_id': entry['workout_exercise_id'], 'weight': entry['weight'],
+         'reps_performed': ','.join(str(s['reps']) for s in entry['sets']), 'date': date}
+        for entry in entries
+    ]
+    log_ids = db.session.execute(
+        db.insert(WorkoutLog).returning(WorkoutLog.id, sort_by_parameter_order=True), log_rows
+    ).scalars().all()
+
+    set_rows = [
+        {'log_id': log_id, 'set_index': index, 'reps': s['reps'], 'weight': s['weight'], 'rpe': s['rpe']}
+        for log_id, entry in zip(log_ids, entries)
+        for index, s in enumerate(entry['sets'], start=1)
+    ]
+    if set_rows:
+        db.session.execute(db.insert(WorkoutSet), set_rows)
+    return log_ids
+
+def _number(value, name, integer=False, low=None, high=None):
+    # json.loads accepts NaN and Infinity, so finiteness is checked here
+    if (isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value)
+            or (integer and not float(value).is_integer())):
+        raise ValueError(f"{name} must be {'an integer' if integer else 'a number'}")
+    if (low is not None and value < low) or (high is not None and value > high):
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return int(value) if integer else float(value)
+
+def _parse_date(value):
+    if value is None:
+        return None
+    try:
+        date = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError("performed_at must be an ISO 8601 timestamp")
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+def parse_session(payload):
+    """
+    Validates a session posted as JSON:
+        {"performed_at": "2024-05-01T18:30:00Z",        optional, default now
+         "exercises": [{"workout_exercise_id": 12,
+                        "weight": 60,                     default for sets without one
+                        "sets": [{"reps": 10, "weight": 62.5, "rpe": 8}, ...]}]}
+    A set may also be given as a bare rep count. Returns (date, entries) or
+    raises ValueError with a message for the client.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("expected a JSON object")
+    exercises = payload.get('exercises')
+    if not isinstance(exercises, list) or not exercises:
+        raise ValueError("exercises must be a non-empty list")
+    if len(exercises) > MAX_SESSION_EXERCISES:
+        raise ValueError(f"at most {MAX_SESSION_EXERCISES} exercises per session")
+
+    entries = []
+    for n, exercise in enumerate(exercises, start=1):
+        where = f"exercises[{n}]"
+        if not isinstance(exercise, dict):
+            raise ValueError(f"{where} must be an object")
+        default_weight = exercise.get('weight')
+        if default_weight is not None:
+            default_weight = _number(default_weight, f"{where}.weight", low=0, high=MAX_WEIGHT)
+        sets = exercise.get('sets')
+        if not isinstance(sets, list) or not sets or len(sets) > MAX_SETS:
+            raise ValueError(f"{where}.sets must list 1 to {MAX_SETS} sets")
+
+        parsed_sets = []
+        for m, s in enumerate(sets, start=1):
+            s = s if isinstance(s, dict) else {'reps': s}
+            reps = _number(s.get('reps'), f"{where}.sets[{m}].reps", integer=True, low=1, high=MAX_REPS)
+            weight = s.get('weight', default_weight)
+            if weight is None:
+                raise ValueError(f"{where}.sets[{m}] needs a weight (or set one on the exercise)")
+            rpe = s.get('rpe')
+            if rpe is not None:
+                rpe = _number(rpe, f"{where}.sets[{m}].rpe", low=RPE_RANGE[0], high=RPE_RANGE[1])
+            parsed_sets.append({
+                'reps': reps,
+                'weight': _number(weight, f"{where}.sets[{m}].weight", low=0, high=MAX_WEIGHT),
+                'rpe': rpe,
+            })
+
+        entries.append({
+            'workout_exercise_id': _number(exercise.get('workout_exercise_id'), f"{where}.workout_exercise_id", integer=True),
+            # The log's headline weight: the exercise's, else the heaviest set
+            'weight': default_weight if default_weight is not None else max(s['weight'] for s in parsed_sets),
+            'sets': parsed_sets,
+        })
+    return _parse_date(payload.get('performed_at')), entries
+
+def known_workout_exercises(user_id, workout_exercise_ids):
+    """
+    The ids among workout_exercise_ids the user may log against: exercises of
+    their current plans, or ones they have logged before (a session queued
+    offline may predate a plan regeneration).
+    """
+    # One SELECT rather than a UNION: compound selects can't be routed to a shard
+    user_plans = db.select(WorkoutPlan.id).where(WorkoutPlan.user_id == user_id)
+    logged = db.select(WorkoutLog.id).where(
+        WorkoutLog.user_id == user_id, WorkoutLog.workout_exercise_id == WorkoutExercise.id
+    ).exists()
+    return set(db.session.execute(
+        db.select(WorkoutExercise.id).where(
+            WorkoutExercise.id.in_(workout_exercise_ids),
+            db.or_(WorkoutExercise.plan_id.in_(user_plans), logged)
+        )
+    ).scalars())
+
+def stored_response(user_id, key):
+    """The JSON response recorded for an idempotency key, or None if the key is new."""
+    response = db.session.execute(
+        db.select(IdempotencyKey.response).where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+    ).scalar()
+    return json.loads(response) if response is not None else None
+
+def record_response(user_id, key, response):
+    """
+    Stores the response for the key in the caller's transaction. Raises
+    IntegrityError (at flush) if a concurrent request with the same key got
+    there first.
+    """
+    db.session.add(IdempotencyKey(user_id=user_id, key=key, response=json.dumps(response)))
+    db.session.flush()
+
+def expire_idempotency_keys(ttl_days=None):
+    """
+    Deletes idempotency keys older than ttl_days (IDEMPOTENCY_KEY_TTL_DAYS)
+    on every shard, in batches, committing each. Returns the number deleted.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=IDEMPOTENCY_KEY_TTL_DAYS if ttl_days is None else ttl_days)
+    deleted = 0
+    for shard_id in shard_ids():
+        with using_shard(shard_id):
+            while True:
+                batch = db.select(IdempotencyKey.id).where(
+                    IdempotencyKey.created_at < cutoff
+                ).limit(EXPIRE_BATCH_SIZE).scalar_subquery()
+                count = db.session.execute(db.delete(IdempotencyKey).where(IdempotencyKey.id.in_(batch))).rowcount
+                db.session.commit()
+                deleted += count
+                if count < EXPIRE_BATCH_SIZE:
+                    break
+    return deleted
+
+def backfill_sets(conn, batch_size=1000):
+    """
+    Creates WorkoutSet rows from reps_performed for logs that have none.
+    Runs on a Core connection (migrations, one database at a time). Returns the
+    number of sets written.
+    """
+    logs = WorkoutLog.__table__
+    sets = WorkoutSet.__table__
+    has_sets = db.select(sets.c.id).where(sets.c.log_id == logs.c.id).exists()
+
+    written = 0
+    last_id = 0
+    while True:
+        batch = conn.execute(
+            db.select(logs.c.id, logs.c.weight, logs.c.reps_performed)
+            .where(logs.c.id > last_id, ~has_sets)
+            .order_by(logs.c.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            return written
+        rows = [row for log in batch for row in _set_rows(log.id, log.weight, parse_reps(log.reps_performed))]
+        if rows:
+            conn.execute(sets.insert(), rows)
+        written += len(rows)
+        last_id = batch[-1].id
+
+# --- Aggregates (computed by the database over WorkoutSet) ---
+
+def epley_1rm(weight, reps):
+    """Estimated one-rep max, Epley: weight * (1 + reps / 30). Works on numbers and SQL expressions."""
+    return weight * (1 + reps / 30.0)
+
+def exercise_summaries(user_id, workout_exercise_ids=None, since=None):
+    """
+    Per workout exercise: sessions, sets, total reps, volume (sum of
+    reps * weight), heaviest weight and best estimated 1RM, in one grouped
+    query. Returns a dict of workout_exercise_id -> dict.
+    """
+    query = db.select(
+        WorkoutLog.workout_exercise_id,
+        db.func.count(db.distinct(WorkoutLog.id)).label('sessions'),
+        db.func.count(WorkoutSet.id).label('sets'),
+        db.func.sum(WorkoutSet.reps).label('total_reps'),
+        db.func.sum(WorkoutSet.reps * WorkoutSet.weight).label('volume'),
+        db.func.max(WorkoutSet.weight).label('best_weight'),
+        db.func.max(epley_1rm(WorkoutSet.weight, WorkoutSet.reps)).label('best_e1rm')
+    ).join(WorkoutSet, WorkoutSet.log_id == WorkoutLog.id).where(
+        WorkoutLog.user_id == user_id
+    ).group_by(WorkoutLog.workout_exercise_id)
+
+    if workout_exercise_ids is not None:
+        if not workout_exercise_ids:
+            return {}
+        query = query.where(WorkoutLog.workout_exercise_id.in_(workout_exercise_ids))
+    if since is not None:
+        query = query.where(WorkoutLog.date >= since)
+
+    return {
+        row.workout_exercise_id: {
+            'sessions': row.sessions,
+            'sets': row.sets,
+            'total_reps': row.total_reps or 0,
+            'volume': row.volume or 0.0,
+            'best_weight': row.best_weight,
+            'best_e1rm': row.best_e1rm,
+        }
+        for row in db.session.execute(query)
+    }
+
+def daily_volume(user_id, start, end):
+    """[(day, sets, volume)] for logs in [start, end), oldest first."""
+    day = db.func.date(WorkoutLog.date)
+    rows = db.session.execute(
+        db.select(
+            day.label('day'),
+            db.func.count(WorkoutSet.id).label('sets'),
+            db.func.coalesce(db.func.sum(WorkoutSet.reps * WorkoutSet.weight), 0.0).label('volume')
+        ).join(WorkoutSet, WorkoutSet.log_id == WorkoutLog.id).where(
+            WorkoutLog.user_id == user_id,
+            WorkoutLog.date >= start,
+            WorkoutLog.date < end
+        ).group_by(day).order_by(day)
+    )
+    return [(row.day, row.sets, row.volume) for row in rows]
@@ -1,6 +1,11 @@
-from models import db, Exercise, WorkoutPlan, WorkoutExercise
+from collections import namedtuple
+import os
 import random
 
+from models import db, WorkoutPlan, WorkoutExercise, WorkoutLog, SuggestedLoad
+from logic.catalog import find_candidates, load_catalog
+from sharding import shard_for_user, using_shard
+
 def get_volume_settings(goal):
     if goal == 'strength':
         return {'sets': 5, 'reps': '3-5', 'rest': 180}
@@ -9,275 +14,294 @@ def get_volume_settings(goal):
     else: # endurance / weight_loss
         return {'sets': 3, 'reps': '15-20', 'rest': 60}
 
-def select_exercise(muscle_group=None, mechanics=None, type=None, exclude_ids=[], logic_type="any"):
-    query = Exercise.query
-    if muscle_group:
-        query = query.filter_by(muscle_group=muscle_group)
-    if mechanics:
-        query = query.filter_by(mechanics=mechanics)
-    if type:
-        query = query.filter_by(type=type)
-    
-    if exclude_ids:
-        query = query.filter(Exercise.id.notin_(exclude_ids))
-        
-    candidates = query.all()
+def select_exercise(muscle_group=None, mechanics=None, type=None, exclude_ids=[], logic_type="any", rng=None):
+    # Served from the in-memory catalog index, no query per pick.
+    # Candidates are in id order, so a seeded rng always picks the same exercise.
+    candidates = find_candidates(muscle_group, mechanics, type, exclude_ids)
     if not candidates:
         return None
         
-    return random.choice(candidates)
+    return (rng or random).choice(candidates)
 
-def create_fbw_session(user, name, day_num):
-    plan = WorkoutPlan(user_id=user.id, name=name, schedule_day=day_num)
-    db.session.add(plan)
-    db.session.flush() # get ID
-    
-    settings = get_volume_settings(user.goal)
+def build_plan(name, day_num, exercises, settings):
+    """
+    Plain-dict description of one session: the plan row plus its ordered
+    exercise rows, not tied to a user. Nothing touches the session here;
+    generate_routine collects the whole week, stamps the user id on it and
+    writes it with save_plans.
+    """
+    return {
+        'name': name,
+        'schedule_day': day_num,
+        'exercises': [
+            {
+                'exercise_id': ex.id,
+                'sets': settings['sets'],
+                'reps_range': settings['reps'],
+                'rest_time': settings['rest'],
+                'order': idx+1
+            }
+            for idx, ex in enumerate(exercises)
+        ]
+    }
+
+def save_plans(plan_specs):
+    """
+    Writes plan specs (for one or many users) with one multi-row INSERT per
+    table and shard. Plan ids come back through RETURNING, so no per-plan flush
+    is needed. Returns the inserted plan ids in spec order.
+    """
+    if not plan_specs:
+        return []
+
+    specs_by_shard = {}
+    for spec in plan_specs:
+        specs_by_shard.setdefault(shard_for_user(spec['user_id']), []).append(spec)
+
+    by_key = {}
+    for shard_id, specs in specs_by_shard.items():
+        with using_shard(shard_id):
+            by_key.update(_insert_plans(specs))
+    return [by_key[(spec['user_id'], spec['schedule_day'])] for spec in plan_specs]
+
+def clear_plans(user_ids):
+    """
+    Deletes the users' plans and stored suggestions before a regeneration,
+    a few statements per shard. Plan exercises go too, except those a
+    WorkoutLog still refers to (logged history keeps its exercise row).
+    """
+    ids_by_shard = {}
+    for user_id in user_ids:
+        ids_by_shard.setdefault(shard_for_user(user_id), []).append(user_id)
+
+    for shard_id, ids in ids_by_shard.items():
+        with using_shard(shard_id):
+            plan_ids = db.select(WorkoutPlan.id).where(WorkoutPlan.user_id.in_(ids))
+            logged = db.select(WorkoutLog.id).where(WorkoutLog.workout_exercise_id == WorkoutExercise.id).exists()
+            for statement in (
+                db.delete(SuggestedLoad).where(SuggestedLoad.user_id.in_(ids)),
+                db.delete(WorkoutExercise).where(WorkoutExercise.plan_id.in_(plan_ids), ~logged),
+                db.delete(WorkoutPlan).where(WorkoutPlan.user_id.in_(ids)),
+            ):
+                db.session.execute(statement.execution_options(synchronize_session=False))
+
+def _insert_plans(plan_specs):
+    plan_rows = [
+        {'user_id': spec['user_id'], 'name': spec['name'], 'schedule_day': spec['schedule_day']}
+        for spec in plan_specs
+    ]
+    # Plain rows, not entities: shards hand out overlapping ids, and entities
+    # from two shards would collide in the session's identity map
+    inserted = db.session.execute(
+        db.insert(WorkoutPlan).returning(WorkoutPlan.id, WorkoutPlan.user_id, WorkoutPlan.schedule_day), plan_rows
+    ).all()
+
+    # RETURNING order isn't guaranteed for multi-row inserts, match rows back by key.
+    # A user's week never has two sessions on the same day.
+    by_key = {(row.user_id, row.schedule_day): row.id for row in inserted}
+
+    exercise_rows = []
+    for spec in plan_specs:
+        plan_id = by_key[(spec['user_id'], spec['schedule_day'])]
+        for row in spec['exercises']:
+            exercise_rows.append(dict(row, plan_id=plan_id))
+
+    if exercise_rows:
+        db.session.execute(db.insert(WorkoutExercise), exercise_rows)
+    return by_key
+
+def create_fbw_session(profile, name, day_num, rng=None):
+    settings = get_volume_settings(profile.goal)
     selected_ids = []
     
     exercises_to_add = []
     
     # 1. Squat OR Lunge (Legs Quad) - Compound
-    ex1 = select_exercise(muscle_group='legs_quad', type='compound', exclude_ids=selected_ids)
+    ex1 = select_exercise(muscle_group='legs_quad', type='compound', exclude_ids=selected_ids, rng=rng)
     if ex1: 
         exercises_to_add.append(ex1)
         selected_ids.append(ex1.id)
         
     # 2. Hinge (Legs Ham) - Compound
-    ex2 = select_exercise(mechanics='hinge', type='compound', exclude_ids=selected_ids)
+    ex2 = select_exercise(mechanics='hinge', type='compound', exclude_ids=selected_ids, rng=rng)
     if ex2:
         exercises_to_add.append(ex2)
         selected_ids.append(ex2.id)
         
     # 3. Push (Chest/Shoulders) - Compound
     mech = 'push'
-    ex3 = select_exercise(mechanics=mech, type='compound', exclude_ids=selected_ids)
+    ex3 = select_exercise(mechanics=mech, type='compound', exclude_ids=selected_ids, rng=rng)
     if ex3:
         exercises_to_add.append(ex3)
         selected_ids.append(ex3.id)
     
     # 4. Pull (Back) - Compound
-    ex4 = select_exercise(mechanics='pull', type='compound', exclude_ids=selected_ids)
+    ex4 = select_exercise(mechanics='pull', type='compound', exclude_ids=selected_ids, rng=rng)
     if ex4:
         exercises_to_add.append(ex4)
         selected_ids.append(ex4.id)
         
     # 5. Core
-    ex5 = select_exercise(muscle_group='core', exclude_ids=selected_ids)
+    ex5 = select_exercise(muscle_group='core', exclude_ids=selected_ids, rng=rng)
     if ex5:
         exercises_to_add.append(ex5)
         selected_ids.append(ex5.id)
 
     # 6. Extra Accessory (Arms or another isolation)
-    ex6 = select_exercise(muscle_group='arms', exclude_ids=selected_ids)
+    ex6 = select_exercise(muscle_group='arms', exclude_ids=selected_ids, rng=rng)
     if not ex6:
-         ex6 = select_exercise(type='isolation', exclude_ids=selected_ids)
+         ex6 = select_exercise(type='isolation', exclude_ids=selected_ids, rng=rng)
     if ex6:
         exercises_to_add.append(ex6)
         selected_ids.append(ex6.id)
 
-    # Add to DB
-    for idx, ex in enumerate(exercises_to_add):
-        we = WorkoutExercise(
-            plan_id=plan.id,
-            exercise_id=ex.id,
-            sets=settings['sets'],
-            reps_range=settings['reps'],
-            rest_time=settings['rest'],
-            order=idx+1
-        )
-        db.session.add(we)
-        
-    return plan
+    return build_plan(name, day_num, exercises_to_add, settings)
 
-def create_upper_session(user, name, day_num):
-    plan = WorkoutPlan(user_id=user.id, name=name, schedule_day=day_num)
-    db.session.add(plan)
-    db.session.flush()
-    
-    settings = get_volume_settings(user.goal)
+def create_upper_session(profile, name, day_num, rng=None):
+    settings = get_volume_settings(profile.goal)
     selected_ids = []
     exercises_to_add = []
 
     # 1. Horizontal Push (Compound)
-    ex1 = select_exercise(muscle_group='chest', mechanics='push', type='compound', exclude_ids=selected_ids)
+    ex1 = select_exercise(muscle_group='chest', mechanics='push', type='compound', exclude_ids=selected_ids, rng=rng)
     if ex1: exercises_to_add.append(ex1); selected_ids.append(ex1.id)
 
     # 2. Horizontal Pull (Compound)
-    ex2 = select_exercise(muscle_group='back', mechanics='pull', type='compound', exclude_ids=selected_ids)
+    ex2 = select_exercise(muscle_group='back', mechanics='pull', type='compound', exclude_ids=selected_ids, rng=rng)
     if ex2: exercises_to_add.append(ex2); selected_ids.append(ex2.id)
     
     # 3. Vertical Push (Compound)
-    ex3 = select_exercise(muscle_group='shoulders', mechanics='push', type='compound', exclude_ids=selected_ids)
+    ex3 = select_exercise(muscle_group='shoulders', mechanics='push', type='compound', exclude_ids=selected_ids, rng=rng)
     if ex3: exercises_to_add.append(ex3); selected_ids.append(ex3.id)
 
     # 4. Vertical Pull (Compound)
-    ex4 = select_exercise(muscle_group='back', mechanics='pull', exclude_ids=selected_ids)
+    ex4 = select_exercise(muscle_group='back', mechanics='pull', exclude_ids=selected_ids, rng=rng)
     if ex4: exercises_to_add.append(ex4); selected_ids.append(ex4.id)
     
     # 5. Isolation Chest or Shoulder (Fly or Lat Raise)
-    ex5 = select_exercise(mechanics='push', type='isolation', exclude_ids=selected_ids)
+    ex5 = select_exercise(mechanics='push', type='isolation', exclude_ids=selected_ids, rng=rng)
     if ex5: exercises_to_add.append(ex5); selected_ids.append(ex5.id)
 
     # 6. Arms (Bicep or Tricep)
-    ex6 = select_exercise(muscle_group='arms', exclude_ids=selected_ids)
+    ex6 = select_exercise(muscle_group='arms', exclude_ids=selected_ids, rng=rng)
     if ex6: exercises_to_add.append(ex6); selected_ids.append(ex6.id)
     
-    # Add to DB
-    for idx, ex in enumerate(exercises_to_add):
-        we = WorkoutExercise(
-            plan_id=plan.id,
-            exercise_id=ex.id,
-            sets=settings['sets'],
-            reps_range=settings['reps'],
-            rest_time=settings['rest'],
-            order=idx+1
-        )
-        db.session.add(we)
-    return plan
-
-def create_lower_session(user, name, day_num):
-    plan = WorkoutPlan(user_id=user.id, name=name, schedule_day=day_num)
-    db.session.add(plan)
-    db.session.flush()
-    
-    settings = get_volume_settings(user.goal)
+    return build_plan(name, day_num, exercises_to_add, settings)
+
+def create_lower_session(profile, name, day_num, rng=None):
+    settings = get_volume_settings(profile.goal)
     selected_ids = []
     exercises_to_add = []
 
     # 1. Squat pattern
-    ex1 = select_exercise(muscle_group='legs_quad', mechanics='squat', type='compound', exclude_ids=selected_ids)
+    ex1 = select_exercise(muscle_group='legs_quad', mechanics='squat', type='compound', exclude_ids=selected_ids, rng=rng)
     if ex1: exercises_to_add.append(ex1); selected_ids.append(ex1.id)
 
     # 2. Hinge pattern
-    ex2 = select_exercise(mechanics='hinge', type='compound', exclude_ids=selected_ids)
+    ex2 = select_exercise(mechanics='hinge', type='compound', exclude_ids=selected_ids, rng=rng)
     if ex2: exercises_to_add.append(ex2); selected_ids.append(ex2.id)
     
     # 3. Lunge pattern / Single Leg
-    ex3 = select_exercise(mechanics='lunge', exclude_ids=selected_ids)
+    ex3 = select_exercise(mechanics='lunge', exclude_ids=selected_ids, rng=rng)
     if ex3: exercises_to_add.append(ex3); selected_ids.append(ex3.id)
     
     # 4. Leg Isolation (Extension)
-    ex4 = select_exercise(muscle_group='legs_quad', type='isolation', exclude_ids=selected_ids)
+    ex4 = select_exercise(muscle_group='legs_quad', type='isolation', exclude_ids=selected_ids, rng=rng)
     if ex4: exercises_to_add.append(ex4); selected_ids.append(ex4.id)
 
     # 5. Leg Isolation (Curl)
-    ex5 = select_exercise(muscle_group='legs_ham', type='isolation', exclude_ids=selected_ids)
+    ex5 = select_exercise(muscle_group='legs_ham', type='isolation', exclude_ids=selected_ids, rng=rng)
     if ex5: exercises_to_add.append(ex5); selected_ids.append(ex5.id)
     
     # 6. Core
-    ex6 = select_exercise(muscle_group='core', exclude_ids=selected_ids)
+    ex6 = select_exercise(muscle_group='core', exclude_ids=selected_ids, rng=rng)
     if ex6: exercises_to_add.append(ex6); selected_ids.append(ex6.id)
     
-    # Add to DB
-    for idx, ex in enumerate(exercises_to_add):
-        we = WorkoutExercise(
-            plan_id=plan.id,
-            exercise_id=ex.id,
-            sets=settings['sets'],
-            reps_range=settings['reps'],
-            rest_time=settings['rest'],
-            order=idx+1
-        )
-        db.session.add(we)
-    return plan
-
-def create_ppl_session(user, type_name, day_num):
-    plan = WorkoutPlan(user_id=user.id, name=f"{type_name} {day_num}", schedule_day=day_num)
-    db.session.add(plan)
-    db.session.flush()
-    
-    settings = get_volume_settings(user.goal)
+    return build_plan(name, day_num, exercises_to_add, settings)
+
+def create_ppl_session(profile, type_name, day_num, rng=None):
+    settings = get_volume_settings(profile.goal)
     selected_ids = []
     exercises_to_add = []
     
     if type_name == "Push":
         # 1. Compound Chest
-        ex1 = select_exercise(muscle_group='chest', type='compound', exclude_ids=selected_ids)
+        ex1 = select_exercise(muscle_group='chest', type='compound', exclude_ids=selected_ids, rng=rng)
         if ex1: exercises_to_add.append(ex1); selected_ids.append(ex1.id)
         # 2. Compound Shoulder
-        ex2 = select_exercise(muscle_group='shoulders', type='compound', exclude_ids=selected_ids)
+        ex2 = select_exercise(muscle_group='shoulders', type='compound', exclude_ids=selected_ids, rng=rng)
         if ex2: exercises_to_add.append(ex2); selected_ids.append(ex2.id)
         # 3. Isolation Chest
-        ex3 = select_exercise(muscle_group='chest', type='isolation', exclude_ids=selected_ids)
+        ex3 = select_exercise(muscle_group='chest', type='isolation', exclude_ids=selected_ids, rng=rng)
         if ex3: exercises_to_add.append(ex3); selected_ids.append(ex3.id)
         # 4. Isolation Shoulder
-        ex4 = select_exercise(muscle_group='shoulders', type='isolation', exclude_ids=selected_ids)
+        ex4 = select_exercise(muscle_group='shoulders', type='isolation', exclude_ids=selected_ids, rng=rng)
         if ex4: exercises_to_add.append(ex4); selected_ids.append(ex4.id)
         # 5. Tricep
-        ex5 = select_exercise(muscle_group='arms', mechanics='push', exclude_ids=selected_ids)
+        ex5 = select_exercise(muscle_group='arms', mechanics='push', exclude_ids=selected_ids, rng=rng)
         if ex5: exercises_to_add.append(ex5); selected_ids.append(ex5.id)
         # 6. Tricep or Chest
-        ex6 = select_exercise(muscle_group='arms', mechanics='push', exclude_ids=selected_ids)
-        if not ex6: ex6 = select_exercise(mechanics='push', exclude_ids=selected_ids)
+        ex6 = select_exercise(muscle_group='arms', mechanics='push', exclude_ids=selected_ids, rng=rng)
+        if not ex6: ex6 = select_exercise(mechanics='push', exclude_ids=selected_ids, rng=rng)
         if ex6: exercises_to_add.append(ex6); selected_ids.append(ex6.id)
 
     elif type_name == "Pull":
         # 1. Vertical Pull
-        ex1 = select_exercise(muscle_group='back', mechanics='pull', type='compound', exclude_ids=selected_ids)
+        ex1 = select_exercise(muscle_group='back', mechanics='pull', type='compound', exclude_ids=selected_ids, rng=rng)
         if ex1: exercises_to_add.append(ex1); selected_ids.append(ex1.id)
         # 2. Horizontal Pull
-        ex2 = select_exercise(muscle_group='back', mechanics='pull', type='compound', exclude_ids=selected_ids) 
+        ex2 = select_exercise(muscle_group='back', mechanics='pull', type='compound', exclude_ids=selected_ids, rng=rng) 
         if ex2: exercises_to_add.append(ex2); selected_ids.append(ex2.id)
         # 3. Back Isolation (or another compound)
-        ex3 = select_exercise(muscle_group='back', exclude_ids=selected_ids)
+        ex3 = select_exercise(muscle_group='back', exclude_ids=selected_ids, rng=rng)
         if ex3: exercises_to_add.append(ex3); selected_ids.append(ex3.id)
         # 4. Bicep
-        ex4 = select_exercise(muscle_group='arms', mechanics='pull', exclude_ids=selected_ids)
+        ex4 = select_exercise(muscle_group='arms', mechanics='pull', exclude_ids=selected_ids, rng=rng)
         if ex4: exercises_to_add.append(ex4); selected_ids.append(ex4.id)
         # 5. Bicep
-        ex5 = select_exercise(muscle_group='arms', mechanics='pull', exclude_ids=selected_ids)
+        ex5 = select_exercise(muscle_group='arms', mechanics='pull', exclude_ids=selected_ids, rng=rng)
         if ex5: exercises_to_add.append(ex5); selected_ids.append(ex5.id)
         # 6. Core or Rear Delt
-        ex6 = select_exercise(muscle_group='core', exclude_ids=selected_ids)
+        ex6 = select_exercise(muscle_group='core', exclude_ids=selected_ids, rng=rng)
         if ex6: exercises_to_add.append(ex6); selected_ids.append(ex6.id)
 
     elif type_name == "Legs":
         # 1. Squat
-        ex1 = select_exercise(muscle_group='legs_quad', mechanics='squat', type='compound', exclude_ids=selected_ids)
+        ex1 = select_exercise(muscle_group='legs_quad', mechanics='squat', type='compound', exclude_ids=selected_ids, rng=rng)
         if ex1: exercises_to_add.append(ex1); selected_ids.append(ex1.id)
         # 2. Hinge
-        ex2 = select_exercise(mechanics='hinge', exclude_ids=selected_ids)
+        ex2 = select_exercise(mechanics='hinge', exclude_ids=selected_ids, rng=rng)
         if ex2: exercises_to_add.append(ex2); selected_ids.append(ex2.id)
         # 3. Lunge
-        ex3 = select_exercise(mechanics='lunge', exclude_ids=selected_ids)
+        ex3 = select_exercise(mechanics='lunge', exclude_ids=selected_ids, rng=rng)
         if ex3: exercises_to_add.append(ex3); selected_ids.append(ex3.id)
         # 4. Quad Isolation
-        ex4 = select_exercise(muscle_group='legs_quad', type='isolation', exclude_ids=selected_ids)
+        ex4 = select_exercise(muscle_group='legs_quad', type='isolation', exclude_ids=selected_ids, rng=rng)
         if ex4: exercises_to_add.append(ex4); selected_ids.append(ex4.id)
         # 5. Ham Isolation
-        ex5 = select_exercise(muscle_group='legs_ham', type='isolation', exclude_ids=selected_ids)
+        ex5 = select_exercise(muscle_group='legs_ham', type='isolation', exclude_ids=selected_ids, rng=rng)
         if ex5: exercises_to_add.append(ex5); selected_ids.append(ex5.id)
         # 6. Core
-        ex6 = select_exercise(muscle_group='core', exclude_ids=selected_ids)
+        ex6 = select_exercise(muscle_group='core', exclude_ids=selected_ids, rng=rng)
         if ex6: exercises_to_add.append(ex6); selected_ids.append(ex6.id)
 
-    for idx, ex in enumerate(exercises_to_add):
-        we = WorkoutExercise(
-            plan_id=plan.id,
-            exercise_id=ex.id,
-            sets=settings['sets'],
-            reps_range=settings['reps'],
-            rest_time=settings['rest'],
-            order=idx+1
-        )
-        db.session.add(we)
-    return plan
-
-def generate_routine(user):
+    return build_plan(f"{type_name} {day_num}", day_num, exercises_to_add, settings)
+
+def generate_template(profile, rng=None):
     """
-    Generates a workout routine based on user profile.
-    Returns a list of WorkoutPlan objects (unsaved).
+    Builds a week of plan specs (no user id) for a profile: anything with
+    goal, experience_level and days_available, the only fields that shape a
+    routine. The same seeded rng always gives the same template.
     """
     
     # 1. Determine Structure
     structure = "FBW"
-    days = user.days_available
+    days = profile.days_available
     
-    if user.experience_level == 'beginner':
+    if profile.experience_level == 'beginner':
         structure = "FBW"
         num_plans = min(days, 3) 
-    elif user.experience_level == 'intermediate':
+    elif profile.experience_level == 'intermediate':
         if days == 4:
             structure = "UpperLower"
             num_plans = 4
@@ -301,27 +325,92 @@ def generate_routine(user):
 
         for i, day in enumerate(schedule):
             plan_name = f"FBW {chr(65+i)}" # FBW A, FBW B...
-            plan = create_fbw_session(user, plan_name, day)
+            plan = create_fbw_session(profile, plan_name, day, rng)
             plans.append(plan)
             
     elif structure == "UpperLower":
         # Upper A, Lower A, Upper B, Lower B
         # Mon, Tue, Thu, Fri -> 1, 2, 4, 5
-        plans.append(create_upper_session(user, "Upper A", 1))
-        plans.append(create_lower_session(user, "Lower A", 2))
-        plans.append(create_upper_session(user, "Upper B", 4))
-        plans.append(create_lower_session(user, "Lower B", 5))
+        plans.append(create_upper_session(profile, "Upper A", 1, rng))
+        plans.append(create_lower_session(profile, "Lower A", 2, rng))
+        plans.append(create_upper_session(profile, "Upper B", 4, rng))
+        plans.append(create_lower_session(profile, "Lower B", 5, rng))
         
     elif structure == "PPL":
         # Push, Pull, Legs...
         cycle = ["Push", "Pull", "Legs"]
         for i in range(1, num_plans + 1):
             type_name = cycle[(i-1) % 3]
-            plan = create_ppl_session(user, type_name, i)
+            plan = create_ppl_session(profile, type_name, i, rng)
             plans.append(plan)
-            
+
     return plans
 
+# --- Template cache ---
+# A new user gets a copy of one of PLAN_TEMPLATE_VARIANTS pre-generated
+# templates for their (goal, experience_level, days_available), picked by
+# user id, so users with the same profile still get some variety. Variant n of
+# a profile is always generated from the same seed, so it is identical in
+# every worker and across restarts as long as the catalog is.
+
+PLAN_TEMPLATE_VARIANTS = int(os.environ.get('PLAN_TEMPLATE_VARIANTS', 8))
+
+Profile = namedtuple('Profile', ['goal', 'experience_level', 'days_available'])
+
+_templates = None # (catalog index the templates were built from, {(Profile, variant): specs})
+
+def profile_of(user):
+    return Profile(user.goal, user.experience_level, user.days_available)
+
+def template_seed(profile, variant):
+    # String seeds are hashed with SHA-512 by random.seed, stable across processes (unlike hash())
+    return f"{profile.goal}:{profile.experience_level}:{profile.days_available}:{variant}"
+
+def get_template(profile, variant):
+    """Cached template for a profile and variant number, regenerated when the catalog changes."""
+    global _templates
+    index = load_catalog()
+    templates = _templates
+    if templates is None or templates[0] is not index:
+        templates = _templates = (index, {})
+    key = (profile, variant)
+    specs = templates[1].get(key)
+    if specs is None:
+        specs = templates[1][key] = generate_template(profile, random.Random(template_seed(profile, variant)))
+    return specs
+
+def clear_templates():
+    global _templates
+    _templates = None
+
+def instantiate(template, user_id):
+    """Per-user copy of a template's plan specs, ready for save_plans."""
+    return [
+        dict(spec, user_id=user_id, exercises=[dict(row) for row in spec['exercises']])
+        for spec in template
+    ]
+
+def routine_specs(user, rng=None):
+    """
+    The week of plan specs generate_routine would write for this user. With
+    an rng it is generated fresh (reproducible for a seeded rng); otherwise it
+    is a copy of the user's cached template variant.
+    """
+    profile = profile_of(user)
+    if rng is not None:
+        return instantiate(generate_template(profile, rng), user.id)
+    variant = user.id % max(PLAN_TEMPLATE_VARIANTS, 1)
+    return instantiate(get_template(profile, variant), user.id)
+
+def generate_routine(user, rng=None):
+    """
+    Generates a workout routine based on user profile.
+    The whole week is built in memory and written by save_plans, so the
+    INSERT count stays fixed (one per table) however many days are picked.
+    Returns the inserted (uncommitted) plan ids.
+    """
+    return save_plans(routine_specs(user, rng))
+
 def calculate_diet(user):
     if user.gender == 'male':
         bmr = 10 * user.weight + 6.25 * user.height - 5 * user.age + 5
@@ -0,0 +1,337 @@
+"""
+Request and SQL instrumentation with a Prometheus-text /metrics endpoint.
+
+Per request we record route latency, the number of SQL statements and the time
+spent in them (via SQLAlchemy engine events). Each gunicorn worker keeps its own
+registry and periodically writes a snapshot to METRICS_DIR; /metrics merges the
+snapshots of every live worker, so any worker can answer a scrape. A restarted
+worker starts its counters from zero, which Prometheus treats as a counter
+reset; snapshots of exited workers are deleted at the next scrape rather than
+summed forever.
+
+Config:
+    METRICS_DIR         where worker snapshots go (default instance/metrics)
+    METRICS_TOKEN       if set, /metrics requires "Authorization: Bearer <token>"
+    QUERY_BUDGET        log a warning when a request issues more statements than this
+    METRICS_STALE_AFTER seconds after which a snapshot is left out even if its pid
+                        is running (pid reuse, a directory shared across hosts);
+                        an idle worker counts again at its next flush (default 3600)
+"""
+import glob
+import json
+import os
+import sys
+import threading
+import time
+
+from flask import g, request, has_request_context, current_app, Response, abort
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+JOB_DURATION_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# name -> (type, help, buckets)
+DEFINITIONS = {
+    'http_requests_total': ('counter', 'HTTP requests by route, method and status.', None),
+    'http_request_duration_seconds': ('histogram', 'HTTP request latency by route.', LATENCY_BUCKETS),
+    'http_request_sql_statements': ('histogram', 'SQL statements issued per request, by route.', QUERY_COUNT_BUCKETS),
+    'sql_statements_total': ('counter', 'SQL statements executed, by route ("none" outside requests).', None),
+    'sql_statement_seconds_total': ('counter', 'Time spent executing SQL, by route.', None),
+    'jobs_total': ('counter', 'Background jobs run, by kind and result (done/retry/failed/superseded).', None),
+    'job_duration_seconds': ('histogram', 'Background job run time, by kind.', JOB_DURATION_BUCKETS),
+}
+
+_lock = threading.Lock()
+_series = {}   # (name, labels) -> float | {'buckets': [...], 'sum': float, 'count': int}
+_collectors = []
+_scrape_collectors = []
+_last_flush = 0.0
+
+def inc(name, labels=(), amount=1):
+    key = (name, tuple(labels))
+    with _lock:
+        _series[key] = _series.get(key, 0) + amount
+
+def observe(name, value, labels=()):
+    buckets = DEFINITIONS[name][2]
+    key = (name, tuple(labels))
+    with _lock:
+        hist = _series.get(key)
+        if hist is None:
+            hist = _series[key] = {'buckets': [0] * (len(buckets) + 1), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                hist['buckets'][i] += 1
+                break
+        else:
+            hist['buckets'][-1] += 1
+        hist['sum'] += value
+        hist['count'] += 1
+
+def register_collector(fn):
+    """
+    fn() returns extra samples at snapshot time as a list of
+    (name, type, help, labels, value) where value is a number, or for
+    histograms a dict with 'bounds', 'buckets', 'sum', 'count'.
+    """
+    _collectors.append(fn)
+    return fn
+
+def register_scrape_collector(fn):
+    """
+    Like register_collector, but fn runs once per scrape in the process
+    answering /metrics instead of in every worker's snapshot. For values
+    that describe shared state (e.g. rows in the database) rather than a worker.
+    """
+    _scrape_collectors.append(fn)
+    return fn
+
+# --- SQL ---
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+
+    if has_request_context() and 'sql_count' in g:
+        g.sql_count += 1
+        g.sql_time += elapsed
+    else:
+        inc('sql_statements_total', (('route', 'none'),))
+        inc('sql_statement_seconds_total', (('route', 'none'),), elapsed)
+
+# --- Flask ---
+
+def _route():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+def _before_request():
+    g.request_start = time.perf_counter()
+    g.sql_count = 0
+    g.sql_time = 0.0
+
+def _after_request(response):
+    g.response_status = response.status_code
+    return response
+
+def _teardown_request(exc):
+    start = g.pop('request_start', None)
+    if start is None:
+        return
+
+    elapsed = time.perf_counter() - start
+    route = _route()
+    status = g.pop('response_status', 500)
+    sql_count = g.pop('sql_count', 0)
+    sql_time = g.pop('sql_time', 0.0)
+
+    inc('http_requests_total', (('route', route), ('method', request.method), ('status', str(status))))
+    observe('http_request_duration_seconds', elapsed, (('route', route), ('method', request.method)))
+    observe('http_request_sql_statements', sql_count, (('route', route),))
+    inc('sql_statements_total', (('route', route),), sql_count)
+    inc('sql_statement_seconds_total', (('route', route),), sql_time)
+
+    budget = current_app.config.get('QUERY_BUDGET')
+    if budget and sql_count > budget:
+        current_app.logger.warning(
+            "Query budget exceeded: %s %s issued %d SQL statements (budget %d, %.1f ms in SQL, %.1f ms total)",
+            request.method, request.path, sql_count, budget, sql_time * 1000, elapsed * 1000
+        )
+
+    maybe_flush()
+
+# --- Snapshots ---
+
+def _encode_labels(labels):
+    return [list(pair) for pair in labels]
+
+def snapshot():
+    """This process's metrics as a JSON-serializable list of samples."""
+    samples = []
+    with _lock:
+        for (name, labels), value in _series.items():
+            kind, help_text, buckets = DEFINITIONS[name]
+            if kind == 'histogram':
+                value = {'bounds': list(buckets), 'buckets': list(value['buckets']), 'sum': value['sum'], 'count': value['count']}
+            samples.append([name, kind, help_text, _encode_labels(labels), value])
+
+    for collector in _collectors:
+        for name, kind, help_text, labels, value in collector():
+            samples.append([name, kind, help_text, _encode_labels(labels), value])
+    return samples
+
+def flush(directory):
+    """Atomically writes this worker's snapshot to <directory>/worker-<pid>.json."""
+    global _last_flush
+    _last_flush = time.monotonic()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"worker-{os.getpid()}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(tmp_path, path)
+
+def maybe_flush():
+    """
+    flush() to the app's METRICS_DIR if METRICS_FLUSH_INTERVAL has passed since
+    the last one; for request teardown and the job worker loop. Returns whether it wrote.
+    """
+    if time.monotonic() - _last_flush < current_app.config['METRICS_FLUSH_INTERVAL']:
+        return False
+    flush(current_app.config['METRICS_DIR'])
+    return True
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _is_live_snapshot(path, stale_after):
+    """
+    Whether a snapshot file still belongs to a live worker. Files of exited
+    workers are deleted; files not rewritten for stale_after seconds are only skipped.
+    """
+    pid = os.path.basename(path)[len('worker-'):-len('.json')]
+    if pid.isdigit() and not _is_running(int(pid)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return False
+    if stale_after is None:
+        return True
+    try:
+        return time.time() - os.path.getmtime(path) <= stale_after
+    except FileNotFoundError:
+        return False
+
+def merged_samples(directory, stale_after=None):
+    """
+    Sums the snapshots of the live workers (see _is_live_snapshot); gauges
+    take the maximum. Exited workers' counters are dropped with their file.
+    """
+    merged = {}
+    for path in glob.glob(os.path.join(directory, 'worker-*.json')):
+        if not _is_live_snapshot(path, stale_after):
+            continue
+        try:
+            with open(path) as f:
+                samples = json.load(f)
+        except (OSError, ValueError):
+            continue # worker mid-write or gone
+
+        for name, kind, help_text, labels, value in samples:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            if key not in merged:
+                merged[key] = [kind, help_text, value]
+            elif kind == 'histogram':
+                current = merged[key][2]
+                current['buckets'] = [a + b for a, b in zip(current['buckets'], value['buckets'])]
+                current['sum'] += value['sum']
+                current['count'] += value['count']
+            elif kind == 'gauge':
+                merged[key][2] = max(merged[key][2], value)
+            else:
+                merged[key][2] += value
+    return merged
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in pairs
+    )
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+def render(merged):
+    lines = []
+    seen = set()
+    for (name, labels), (kind, help_text, value) in sorted(merged.items()):
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        if kind == 'histogram':
+            cumulative = 0
+            for bound, count in zip(value['bounds'], value['buckets']):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {value['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {value['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+        else:
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+    return '\n'.join(lines) + '\n'
+
+def metrics_view():
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        abort(403)
+
+    directory = current_app.config['METRICS_DIR']
+    flush(directory)
+    merged = merged_samples(directory, current_app.config['METRICS_STALE_AFTER'])
+    for collector in _scrape_collectors:
+        for name, kind, help_text, labels, value in collector():
+            merged[(name, tuple(labels))] = [kind, help_text, value]
+    return Response(render(merged), mimetype='text/plain; version=0.0.4')
+
+# --- Food search ---
+
+@register_collector
+def _nutrition_samples():
+    # Read only if the nutrition module is already loaded; never import it from here
+    nutrition = sys.modules.get('logic.nutrition')
+    if nutrition is None:
+        return []
+
+    samples = []
+    client = nutrition._client if nutrition._client_pid == os.getpid() else None
+    if client is not None:
+        stats = client.stats()
+        samples += [
+            ('food_search_upstream_seconds', 'histogram', 'Latency of OpenFoodFacts calls made by search_food.', (),
+             {'bounds': list(client.LATENCY_BUCKETS), 'buckets': stats['latency_buckets'],
+              'sum': stats['latency_sum'], 'count': stats['requests']}),
+            ('food_search_upstream_errors_total', 'counter', 'Failed OpenFoodFacts calls.', (), stats['errors']),
+            ('food_search_upstream_rejected_total', 'counter', 'Calls rejected by the open circuit breaker.', (), stats['rejected']),
+            ('food_search_failures_total', 'counter', 'Food searches answered with no results because of an error.', (),
+             stats['search_failures']),
+            ('food_search_circuit_open', 'gauge', '1 if any worker has the upstream circuit open.', (),
+             0 if stats['circuit'] == 'closed' else 1),
+        ]
+
+    cache = nutrition._food_cache
+    if cache is not None:
+        for result, count in (('hit', cache.hits), ('negative_hit', cache.negative_hits), ('miss', cache.misses)):
+            samples.append(('food_cache_lookups_total', 'counter', 'search_food cache lookups by result.',
+                            (('result', result),), count))
+    return samples
+
+def init_app(app):
+    app.config.setdefault('METRICS_DIR', os.environ.get('METRICS_DIR', os.path.join(app.instance_path, 'metrics')))
+    app.config.setdefault('METRICS_TOKEN', os.environ.get('METRICS_TOKEN'))
+    app.config.setdefault('METRICS_FLUSH_INTERVAL', 1.0)
+    app.config.setdefault('METRICS_STALE_AFTER', float(os.environ.get('METRICS_STALE_AFTER', 3600)))
+    budget = os.environ.get('QUERY_BUDGET')
+    app.config.setdefault('QUERY_BUDGET', int(budget) if budget else None)
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,120 @@
+"""
+Minimal schema migrations.
+
+db.create_all() only creates tables that are missing; it never adds indexes or
+columns to a table that already exists in fitness.db. Every change to an existing
+table is registered here as a numbered migration, applied once and recorded in
+the schema_migrations table of every database (main and each shard, see
+sharding.py). Shard databases only hold the sharded tables; migrations that
+only touch main-database tables are registered with shards=False.
+
+Usage: python migrations.py
+"""
+from datetime import datetime
+
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateIndex
+
+from models import db, User, WorkoutLog, DietLog, IdempotencyKey, SchemaMigration
+from logic.diet_totals import rebuild_totals_statements
+from logic.training_log import backfill_sets
+from sharding import shard_metadata
+
+schema_migrations = SchemaMigration.__table__
+
+MIGRATIONS = []
+
+
+def migration(version, shards=True):
+    def register(fn):
+        MIGRATIONS.append((version, fn, shards))
+        return fn
+    return register
+
+
+def _create_indexes(conn, model):
+    for index in model.__table__.indexes:
+        conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+@migration(1)
+def add_log_indexes(conn):
+    """Composite indexes for the WorkoutLog last-log and DietLog today lookups."""
+    _create_indexes(conn, WorkoutLog)
+    _create_indexes(conn, DietLog)
+
+
+@migration(2)
+def backfill_daily_nutrition_totals(conn):
+    """Seeds DailyNutritionTotal from the DietLog history already on disk."""
+    for statement in rebuild_totals_statements():
+        conn.execute(statement)
+
+
+@migration(3, shards=False)
+def add_user_profile_version(conn):
+    """User.profile_version, the user loader cache stamp."""
+    columns = {column['name'] for column in inspect(conn).get_columns(User.__tablename__)}
+    if 'profile_version' not in columns:
+        conn.execute(db.text('ALTER TABLE "user" ADD COLUMN profile_version INTEGER NOT NULL DEFAULT 1'))
+
+
+@migration(4)
+def backfill_workout_sets(conn):
+    """WorkoutSet rows for the logs recorded as a reps_performed string only."""
+    backfill_sets(conn)
+
+
+@migration(5)
+def add_idempotency_key_expiry_index(conn):
+    """IdempotencyKey.created_at index for the expiry sweep."""
+    _create_indexes(conn, IdempotencyKey)
+
+
+def pending(conn, main=True):
+    applied = set(conn.execute(db.select(schema_migrations.c.version)).scalars())
+    return [(version, fn) for version, fn, shards in sorted(MIGRATIONS, key=lambda m: m[0])
+            if version not in applied and (main or shards)]
+
+
+def upgrade_database(engine, metadata, main=True):
+    """
+    Creates missing tables of the metadata, then runs pending migrations in
+    version order. Each migration commits together with its schema_migrations row.
+    Returns the list of applied versions.
+    """
+    metadata.create_all(engine)
+
+    with engine.connect() as conn:
+        todo = pending(conn, main)
+
+    applied = []
+    for version, fn in todo:
+        with engine.begin() as conn:
+            fn(conn)
+            conn.execute(schema_migrations.insert().values(
+                version=version, name=fn.__name__, applied_at=datetime.utcnow()
+            ))
+        applied.append(version)
+    return applied
+
+
+def upgrade():
+    """Upgrades the main database and every shard. Returns {database: applied versions}."""
+    results = {'main': upgrade_database(db.engine, db.metadata)}
+    shard_tables = shard_metadata(db.metadata)
+    for key, engine in db.engines.items():
+        if key is not None:
+            results[key] = upgrade_database(engine, shard_tables, main=False)
+    return results
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        for database, versions in upgrade().items():
+            if versions:
+                print(f"{database}: applied migrations {', '.join(map(str, versions))}")
+            else:
+                print(f"{database}: schema is up to date.")
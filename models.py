@@ -3,7 +3,10 @@ from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 
-db = SQLAlchemy()
+from sharding import ShardedSession
+
+# Tables with info={'sharded': True} live in the owning user's shard database (see sharding.py)
+db = SQLAlchemy(session_options={'class_': ShardedSession})
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -22,6 +25,8 @@ class User(UserMixin, db.Model):
     days_available = db.Column(db.Integer)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped on every profile change; keys the user loader cache (identity.py)
+    profile_version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     
     plans = db.relationship('WorkoutPlan', backref='user', lazy=True)
 
@@ -47,6 +52,8 @@ class WorkoutPlan(db.Model):
     
     exercises = db.relationship('WorkoutExercise', backref='plan', lazy=True, order_by='WorkoutExercise.order')
 
+    __table_args__ = {'info': {'sharded': True}}
+
 class WorkoutExercise(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     plan_id = db.Column(db.Integer, db.ForeignKey('workout_plan.id'), nullable=False)
@@ -59,6 +66,8 @@ class WorkoutExercise(db.Model):
 
     exercise = db.relationship('Exercise')
 
+    __table_args__ = {'info': {'sharded': True}}
+
 class WorkoutLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -66,16 +75,46 @@ class WorkoutLog(db.Model):
     date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
     weight = db.Column(db.Float)
-    reps_performed = db.Column(db.String(50)) # e.g., "10,10,10"
+    reps_performed = db.Column(db.String(50)) # e.g., "10,10,10"; display copy of the WorkoutSet rows
     
     workout_exercise = db.relationship('WorkoutExercise')
     user = db.relationship('User')
+    sets = db.relationship('WorkoutSet', backref='log', lazy=True, order_by='WorkoutSet.set_index',
+                           cascade='all, delete-orphan')
+
+    __table_args__ = (
+        # Last log per exercise: WHERE user_id, workout_exercise_id ORDER BY date DESC
+        db.Index('ix_workout_log_user_exercise_date', 'user_id', 'workout_exercise_id', 'date'),
+        {'info': {'sharded': True}},
+    )
 
     @property
     def sets_performed(self):
-        if self.reps_performed:
-            return [int(x) for x in self.reps_performed.split(',')]
+        # Rows logged before WorkoutSet existed (or not yet flushed) fall back to the CSV
+        if self.sets:
+            return [s.reps for s in self.sets]
+        return parse_reps(self.reps_performed)
+
+class WorkoutSet(db.Model):
+    """One performed set of a WorkoutLog, so per-set aggregates can run in SQL."""
+    id = db.Column(db.Integer, primary_key=True)
+    log_id = db.Column(db.Integer, db.ForeignKey('workout_log.id'), nullable=False)
+    set_index = db.Column(db.Integer, nullable=False) # 1-based, in the order performed
+    reps = db.Column(db.Integer, nullable=False)
+    weight = db.Column(db.Float) # kg
+    rpe = db.Column(db.Float) # optional, 1-10
+
+    __table_args__ = (
+        # Also the index for "sets of these logs"
+        db.UniqueConstraint('log_id', 'set_index', name='uq_workout_set_log_index'),
+        {'info': {'sharded': True}},
+    )
+
+def parse_reps(text):
+    """'10, 10,8' -> [10, 10, 8]. Non-numeric pieces are skipped."""
+    if not text:
         return []
+    return [int(piece) for piece in (p.strip() for p in text.split(',')) if piece.isdigit()]
 
 class DietLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -89,3 +128,93 @@ class DietLog(db.Model):
     fat = db.Column(db.Float)
 
     user = db.relationship('User')
+
+    __table_args__ = (
+        # Today's entries: WHERE user_id AND date >= day_start AND date < next_day_start
+        db.Index('ix_diet_log_user_date', 'user_id', 'date'),
+        {'info': {'sharded': True}},
+    )
+
+class DailyNutritionTotal(db.Model):
+    """Running per-user, per-day sums of DietLog, maintained on every diet add."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+
+    calories = db.Column(db.Integer, nullable=False, default=0)
+    protein = db.Column(db.Float, nullable=False, default=0.0)
+    carbs = db.Column(db.Float, nullable=False, default=0.0)
+    fat = db.Column(db.Float, nullable=False, default=0.0)
+    entries = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # One row per user and day; also serves weekly/monthly range scans
+        db.UniqueConstraint('user_id', 'day', name='uq_daily_nutrition_user_day'),
+        {'info': {'sharded': True}},
+    )
+
+class SuggestedLoad(db.Model):
+    """Next-session load per plan exercise, recomputed by logic.progression on every /log POST."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    workout_exercise_id = db.Column(db.Integer, db.ForeignKey('workout_exercise.id'), nullable=False)
+
+    weight = db.Column(db.Float, nullable=False) # kg
+    e1rm = db.Column(db.Float) # best estimated 1RM of the last session, None before the first log
+    status = db.Column(db.String(10), nullable=False) # new / progress / hold / deload
+    sessions = db.Column(db.Integer, nullable=False, default=0) # history the suggestion was based on
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('workout_exercise_id', name='uq_suggested_load_workout_exercise'),
+        {'info': {'sharded': True}},
+    )
+
+class IdempotencyKey(db.Model):
+    """A client-generated key of a session posted to /api/sessions, with the response it got, so replays don't log twice."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    key = db.Column(db.String(100), nullable=False)
+    response = db.Column(db.Text, nullable=False) # JSON body returned to the first request
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_key_user_key'),
+        # Expiry scan (logic.training_log.expire_idempotency_keys)
+        db.Index('ix_idempotency_key_created_at', 'created_at'),
+        {'info': {'sharded': True}},
+    )
+
+class Job(db.Model):
+    """A unit of background work for jobs.py; lives in the main database."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False) # handler name, e.g. generate_plans
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    payload = db.Column(db.Text, nullable=False, default='{}') # JSON arguments for the handler
+    dedup_key = db.Column(db.String(100)) # at most one queued job per key
+
+    status = db.Column(db.String(10), nullable=False, default='queued') # queued / running / done / failed / dismissed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow) # retry backoff
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # Claim order: oldest runnable job first
+        db.Index('ix_job_status_run_after', 'status', 'run_after'),
+        # A user's latest job of a kind (the /plan "generating" check)
+        db.Index('ix_job_user_kind', 'user_id', 'kind'),
+        db.Index('uq_job_queued_dedup_key', 'dedup_key', unique=True,
+                 sqlite_where=db.text("status = 'queued'"), postgresql_where=db.text("status = 'queued'")),
+    )
+
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100))
+    applied_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
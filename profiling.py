@@ -0,0 +1,169 @@
+"""
+Opt-in request profiling for production.
+
+A request is profiled when it is picked by PROFILE_SAMPLE_RATE, or when it
+carries "X-Profile: <PROFILE_TOKEN>". With neither configured init_app
+registers no hooks at all, so a disabled profiler costs nothing per request.
+
+Modes (PROFILE_MODE):
+    cprofile    deterministic cProfile, written as <PROFILE_DIR>/*.prof (pstats)
+    sample      wall-clock stack sampler, written as *.collapsed
+                (one "frame;frame;frame count" line per stack, for flamegraph tools)
+
+Summaries: GET /debug/profiles (requires the token) or
+    python profiling.py [profile_dir] [top_n]
+"""
+import cProfile
+import glob
+import hmac
+import io
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request, current_app, Response, abort
+
+class StackSampler:
+    """Samples one thread's Python stack every `interval` seconds from a helper thread."""
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+def _has_token(token):
+    # Compare bytes: compare_digest raises TypeError on non-ASCII str
+    supplied = request.headers.get('X-Profile', '').encode('utf-8', 'surrogateescape')
+    return bool(token) and hmac.compare_digest(supplied, token.encode('utf-8'))
+
+def _should_profile():
+    config = current_app.config
+    if _has_token(config['PROFILE_TOKEN']):
+        return True
+    rate = config['PROFILE_SAMPLE_RATE']
+    return rate > 0 and random.random() < rate
+
+def _before_request():
+    if not _should_profile():
+        return
+    if current_app.config['PROFILE_MODE'] == 'sample':
+        g.profiler = StackSampler(threading.get_ident(), current_app.config['PROFILE_INTERVAL'])
+        g.profiler.start()
+    else:
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+def _teardown_request(exc):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+
+    directory = current_app.config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', f"{request.method}{route}").strip('_')
+    base = os.path.join(directory, f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{os.getpid()}-{slug}")
+
+    if isinstance(profiler, StackSampler):
+        profiler.stop()
+        with open(f"{base}.collapsed", 'w') as f:
+            f.write(profiler.collapsed())
+    else:
+        profiler.disable()
+        profiler.dump_stats(f"{base}.prof")
+
+    _prune(directory, current_app.config['PROFILE_MAX_FILES'])
+
+def _prune(directory, max_files):
+    files = sorted(glob.glob(os.path.join(directory, '*.prof')) + glob.glob(os.path.join(directory, '*.collapsed')),
+                   key=os.path.getmtime)
+    for path in files[:-max_files]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def summary(directory, top=30):
+    """
+    Merges every profile in the directory into a text report: cumulative-time
+    top N from the pstats files, and the hottest leaf frames from the sampled ones.
+    """
+    out = io.StringIO()
+
+    prof_files = glob.glob(os.path.join(directory, '*.prof'))
+    if prof_files:
+        out.write(f"== cProfile: {len(prof_files)} profiles ==\n")
+        stats = pstats.Stats(*prof_files, stream=out)
+        stats.strip_dirs().sort_stats('cumulative').print_stats(top)
+
+    collapsed_files = glob.glob(os.path.join(directory, '*.collapsed'))
+    if collapsed_files:
+        leaves = Counter()
+        total = 0
+        for path in collapsed_files:
+            with open(path) as f:
+                for line in f:
+                    stack, _, count = line.rstrip('\n').rpartition(' ')
+                    leaves[stack.rsplit(';', 1)[-1]] += int(count)
+                    total += int(count)
+        out.write(f"== Sampled: {len(collapsed_files)} profiles, {total} samples ==\n")
+        for frame, count in leaves.most_common(top):
+            out.write(f"{count / total:7.1%}  {count:8d}  {frame}\n")
+
+    if not prof_files and not collapsed_files:
+        out.write("No profiles recorded.\n")
+    return out.getvalue()
+
+def summary_view():
+    if not _has_token(current_app.config['PROFILE_TOKEN']):
+        abort(403)
+    top = request.args.get('top', 30, type=int)
+    return Response(summary(current_app.config['PROFILE_DIR'], top), mimetype='text/plain')
+
+def init_app(app):
+    app.config.setdefault('PROFILE_SAMPLE_RATE', float(os.environ.get('PROFILE_SAMPLE_RATE', 0)))
+    app.config.setdefault('PROFILE_TOKEN', os.environ.get('PROFILE_TOKEN'))
+    app.config.setdefault('PROFILE_MODE', os.environ.get('PROFILE_MODE', 'cprofile'))
+    app.config.setdefault('PROFILE_INTERVAL', float(os.environ.get('PROFILE_INTERVAL', 0.005)))
+    app.config.setdefault('PROFILE_DIR', os.environ.get('PROFILE_DIR', os.path.join(app.instance_path, 'profiles')))
+    app.config.setdefault('PROFILE_MAX_FILES', int(os.environ.get('PROFILE_MAX_FILES', 500)))
+
+    if not app.config['PROFILE_SAMPLE_RATE'] and not app.config['PROFILE_TOKEN']:
+        return # disabled: no hooks, no overhead
+
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
+    if app.config['PROFILE_TOKEN']:
+        app.add_url_rule('/debug/profiles', 'profile_summary', summary_view)
+
+if __name__ == '__main__':
+    directory = sys.argv[1] if len(sys.argv) > 1 else os.path.join('instance', 'profiles')
+    top = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    print(summary(directory, top))
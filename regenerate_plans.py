@@ -0,0 +1,275 @@
+"""
+Offline plan regeneration, e.g. after adding exercises to the catalog.
+
+Existing users keep the plans they were given at /setup; this rebuilds them
+from the current catalog for every user (or a filtered subset) the way /setup
+would, without anyone re-submitting the form. Users with an incomplete
+profile are skipped.
+
+Users are split into chunks of --chunk-size ids and handed to a pool of
+--workers processes, each with its own app, sessions and catalog/template
+cache. A chunk is one batch: a SELECT of its users, then per shard a few
+DELETEs, the bulk plan INSERTs and the users' new SuggestedLoad rows in one
+transaction. Finished chunks are appended to the --progress file, so an
+interrupted run started again with the same filters skips them (--restart
+ignores the file). The file is removed once every chunk has been written.
+
+--dry-run writes nothing and prints, per changed user and day, the exercises
+that would be removed (-) and added (+).
+
+Usage:
+    python regenerate_plans.py [--goal G] [--experience E] [--days N] [--user-id ID ...]
+                               [--workers N] [--chunk-size N] [--progress PATH] [--restart] [--dry-run]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_PROGRESS_PATH = 'regenerate_plans.progress'
+
+# Per worker process
+_app = None
+
+def select_user_ids(filters):
+    """Ids of the users to regenerate, ascending."""
+    from models import db, User
+
+    query = db.select(User.id).where(
+        User.goal.isnot(None), User.experience_level.isnot(None), User.days_available.isnot(None)
+    ).order_by(User.id)
+    if filters.get('goal'):
+        query = query.where(User.goal == filters['goal'])
+    if filters.get('experience'):
+        query = query.where(User.experience_level == filters['experience'])
+    if filters.get('days'):
+        query = query.where(User.days_available == filters['days'])
+    if filters.get('user_ids'):
+        query = query.where(User.id.in_(filters['user_ids']))
+    return db.session.execute(query).scalars().all()
+
+def chunked(ids, size):
+    return [ids[start:start + size] for start in range(0, len(ids), size)]
+
+# --- Progress file ---
+# First line: the filters of the run. Then one line per finished chunk with
+# its first and last user id; chunks are contiguous slices of the sorted ids.
+
+def load_progress(path, filters):
+    """Finished (first_id, last_id) ranges, or [] for a new run."""
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    if not lines:
+        return []
+    if lines[0].get('filters') != filters:
+        raise SystemExit(f"{path} belongs to a run with other filters; use --restart or another --progress path")
+    return [(line['first'], line['last']) for line in lines[1:]]
+
+def start_progress(path, filters):
+    with open(path, 'w') as f:
+        f.write(json.dumps({'filters': filters}) + '\n')
+
+def record_chunk(path, chunk, plans):
+    with open(path, 'a') as f:
+        f.write(json.dumps({'first': chunk[0], 'last': chunk[-1], 'plans': plans}) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def is_done(user_id, done_ranges):
+    return any(first <= user_id <= last for first, last in done_ranges)
+
+# --- Chunk work ---
+
+def _current_plans(user_ids):
+    """{(user_id, schedule_day): (plan name, [exercise ids in order])} across the users' shards."""
+    from models import db, WorkoutPlan, WorkoutExercise
+    from sharding import shard_for_user, using_shard
+
+    ids_by_shard = {}
+    for user_id in user_ids:
+        ids_by_shard.setdefault(shard_for_user(user_id), []).append(user_id)
+
+    plans = {}
+    for shard_id, ids in ids_by_shard.items():
+        with using_shard(shard_id):
+            rows = db.session.execute(
+                db.select(WorkoutPlan.user_id, WorkoutPlan.schedule_day, WorkoutPlan.name, WorkoutExercise.exercise_id)
+                .outerjoin(WorkoutExercise, WorkoutExercise.plan_id == WorkoutPlan.id)
+                .where(WorkoutPlan.user_id.in_(ids))
+                .order_by(WorkoutPlan.user_id, WorkoutPlan.schedule_day, WorkoutExercise.order)
+            )
+            for user_id, day, name, exercise_id in rows:
+                plan = plans.setdefault((user_id, day), (name, []))
+                if exercise_id is not None:
+                    plan[1].append(exercise_id)
+    return plans
+
+def _diff(user_ids, specs):
+    """Human-readable lines for every user and day whose plan would change."""
+    from logic.catalog import get_entry
+
+    def name(exercise_id):
+        entry = get_entry(exercise_id)
+        return entry.name if entry else f"#{exercise_id}"
+
+    current = _current_plans(user_ids)
+    new = {(spec['user_id'], spec['schedule_day']): (spec['name'], [row['exercise_id'] for row in spec['exercises']])
+           for spec in specs}
+
+    lines = []
+    for key in sorted(current.keys() | new.keys()):
+        old_name, old_ids = current.get(key, (None, []))
+        new_name, new_ids = new.get(key, (None, []))
+        if old_ids == new_ids and old_name == new_name:
+            continue
+        removed = [f"-{name(i)}" for i in old_ids if i not in new_ids]
+        added = [f"+{name(i)}" for i in new_ids if i not in old_ids]
+        label = f"{old_name or '-'} -> {new_name or '-'}" if old_name != new_name else new_name
+        lines.append(f"user {key[0]} day {key[1]} ({label}): {' '.join(removed + added) or 'reordered'}")
+    return lines
+
+def regenerate_chunk(user_ids, dry_run=False):
+    """
+    Regenerates one chunk in the current app context. Returns a dict with
+    users, plans (written or that would be written) and, for a dry run, diff lines.
+    """
+    from models import db, User
+    from logic.progression import refresh_suggestions
+    from logic.workout_generator import clear_plans, routine_specs, save_plans
+    from sharding import shard_for_user, using_shard
+
+    users = db.session.execute(
+        db.select(User.id, User.goal, User.experience_level, User.days_available).where(User.id.in_(user_ids))
+    ).all()
+    # End the read before writing: under WAL a transaction that read and then
+    # writes fails at once if another worker committed in between
+    db.session.commit()
+
+    specs_by_shard = {}
+    for user in users:
+        shard = specs_by_shard.setdefault(shard_for_user(user.id), ([], []))
+        shard[0].append(user.id)
+        shard[1].extend(routine_specs(user))
+    result = {'users': len(users), 'plans': sum(len(specs) for _, specs in specs_by_shard.values())}
+
+    try:
+        if dry_run:
+            result['diff'] = [line for ids, specs in specs_by_shard.values() for line in _diff(ids, specs)]
+        else:
+            # One transaction per shard, so a worker never holds one shard's write
+            # lock while waiting for another's. Re-running a chunk is idempotent.
+            for shard_id, (ids, specs) in specs_by_shard.items():
+                clear_plans(ids)
+                save_plans(specs)
+                # Suggestions for the new plan exercises, as the generate_plans job stores them
+                with using_shard(shard_id):
+                    for user_id in ids:
+                        refresh_suggestions(user_id)
+                db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        # Keep worker memory flat across chunks
+        db.session.remove()
+    return result
+
+def _init_worker():
+    global _app
+    from app import app
+    _app = app
+
+def _run_chunk(chunk, dry_run):
+    with _app.app_context():
+        return chunk, regenerate_chunk(chunk, dry_run)
+
+# --- Driver ---
+
+def regenerate(app, filters, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, progress_path=DEFAULT_PROGRESS_PATH,
+               restart=False, dry_run=False, out=sys.stdout):
+    """Runs the regeneration. Returns (users, plans) processed in this run."""
+    with app.app_context():
+        user_ids = select_user_ids(filters)
+
+    if not dry_run:
+        done = [] if restart else load_progress(progress_path, filters)
+        if not done:
+            start_progress(progress_path, filters)
+        user_ids = [user_id for user_id in user_ids if not is_done(user_id, done)]
+
+    chunks = chunked(user_ids, chunk_size)
+    print(f"{len(user_ids)} users in {len(chunks)} chunks", file=out)
+
+    users = plans = 0
+    started = time.perf_counter()
+
+    def finished(chunk, result):
+        nonlocal users, plans
+        users += result['users']
+        plans += result['plans']
+        if dry_run:
+            for line in result['diff']:
+                print(line, file=out)
+        else:
+            record_chunk(progress_path, chunk, result['plans'])
+        rate = users / max(time.perf_counter() - started, 1e-9)
+        print(f"{users}/{len(user_ids)} users, {rate:.0f} users/s", file=sys.stderr)
+
+    if workers == 0:
+        # In-process, e.g. for an in-memory database
+        with app.app_context():
+            for chunk in chunks:
+                finished(chunk, regenerate_chunk(chunk, dry_run))
+    else:
+        # spawn: workers build their own engines instead of inheriting the parent's pooled connections
+        context = multiprocessing.get_context('spawn')
+        failed = 0
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+            futures = [pool.submit(_run_chunk, chunk, dry_run) for chunk in chunks]
+            for future in as_completed(futures):
+                try:
+                    finished(*future.result())
+                except Exception as e:
+                    # The other chunks still finish and are recorded; a re-run retries this one
+                    failed += 1
+                    print(f"chunk failed: {e!r}", file=sys.stderr)
+        if failed:
+            raise SystemExit(f"{failed} chunks failed; run again to retry them")
+
+    if not dry_run:
+        # Complete: the next run starts from scratch
+        os.remove(progress_path)
+    return users, plans
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--goal')
+    parser.add_argument('--experience', help='experience_level')
+    parser.add_argument('--days', type=int, help='days_available')
+    parser.add_argument('--user-id', dest='user_ids', type=int, action='append', help='repeatable')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes (0 = in-process)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--progress', default=DEFAULT_PROGRESS_PATH, help='resumable progress file')
+    parser.add_argument('--restart', action='store_true', help='ignore an existing progress file')
+    parser.add_argument('--dry-run', action='store_true', help='print what would change, write nothing')
+    args = parser.parse_args(argv)
+
+    filters = {'goal': args.goal, 'experience': args.experience, 'days': args.days,
+               'user_ids': sorted(args.user_ids) if args.user_ids else None}
+
+    from app import app
+
+    users, plans = regenerate(app, filters, args.workers, args.chunk_size, args.progress,
+                              args.restart, args.dry_run)
+    verb = 'Would write' if args.dry_run else 'Wrote'
+    print(f"{verb} {plans} plans for {users} users")
+
+if __name__ == '__main__':
+    main()
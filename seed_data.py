@@ -1,7 +1,7 @@
-from app import app
 from models import db, Exercise
 
 def seed_exercises():
+    """Inserts the catalog into an empty Exercise table (needs an app context). Returns how many were added."""
     exercises_data = [
         # Chest (Push)
         {"name": "Barbell Bench Press", "type": "compound", "muscle_group": "chest", "mechanics": "push", "equipment": "barbell"},
@@ -51,16 +51,21 @@ def seed_exercises():
         {"name": "Farmer's Walk", "type": "compound", "muscle_group": "core", "mechanics": "carry", "equipment": "dumbbell"}
     ]
 
+    # Check if exercises already exist to avoid duplicates
+    if Exercise.query.first() is not None:
+        return 0
+
+    for data in exercises_data:
+        ex = Exercise(**data)
+        db.session.add(ex)
+    db.session.commit()
+    return len(exercises_data)
+
+if __name__ == "__main__":
+    from app import app
+
     with app.app_context():
-        # Check if exercises already exist to avoid duplicates
-        if Exercise.query.first() is None:
-            for data in exercises_data:
-                ex = Exercise(**data)
-                db.session.add(ex)
-            db.session.commit()
+        if seed_exercises():
             print("Exercises seeded successfully!")
         else:
             print("Exercises already exist.")
-
-if __name__ == "__main__":
-    seed_exercises()
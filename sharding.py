@@ -0,0 +1,314 @@
+"""
+Per-user sharding of the workout and diet tables.
+
+Tables marked with info={'sharded': True} in models.py (plans, plan exercises,
+workout and diet logs, daily totals) live in one of SHARD_COUNT databases,
+chosen by user_id % SHARD_COUNT. Everything else (User, Exercise, migrations
+bookkeeping) stays in the main database, which also doubles as shard 0, so
+SHARD_COUNT=1 (the default) is exactly the old single-database layout.
+
+Routing is done by db.session (ShardedSession.get_bind): queries and flushes
+touching a sharded table go to the shard bound with bind_user() (the user
+loader does this for every logged-in request) or by user_shard()/using_shard()
+blocks. Core statements also accept bind_arguments={'shard_id': ...}; ORM bulk
+inserts don't, use a block for those. UNION/INTERSECT selects reach get_bind
+without a mapper or clause and would go to the main database; pass
+bind_arguments={'shard_id': ...} or write them as one SELECT. With SHARD_COUNT > 1
+an unbound query on a sharded table raises ShardingError rather than guessing.
+A session only ever talks to one shard at a time, so never join a sharded
+table with User or Exercise; load those separately (selectinload).
+
+Shard URLs come from SHARD_URL_TEMPLATE (e.g. "postgresql://db/titangym_{n}");
+for SQLite the default is the main file with a "-shard<n>" suffix.
+
+Changing SHARD_COUNT moves users between shards; stop the workers and run
+    python sharding.py rebalance --from-count <old count>
+    python sharding.py status
+Moved rows get new ids on their new shard. Stored idempotency responses are
+copied as they are, so a retried /api/sessions POST after a move replays the
+log ids the user had before it.
+"""
+import argparse
+import os
+from contextlib import contextmanager
+
+from flask import current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy import MetaData, create_engine, inspect, select, delete, func
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.util import find_tables
+
+class ShardingError(Exception):
+    pass
+
+def shard_key(n):
+    return f"shard{n}"
+
+def shard_count():
+    return current_app.config['SHARD_COUNT']
+
+def shard_for_user(user_id, count=None):
+    return shard_key(user_id % (count or shard_count()))
+
+def shard_ids(count=None):
+    return [shard_key(n) for n in range(count or shard_count())]
+
+def is_sharded_table(table):
+    return bool(table.info.get('sharded'))
+
+def shard_url(base_url, n, template=None):
+    """URL of shard n. Shard 0 is always the main database."""
+    if n == 0:
+        return base_url
+    if template:
+        return template.format(n=n)
+
+    url = make_url(base_url)
+    if url.get_backend_name() != 'sqlite':
+        raise ShardingError("SHARD_URL_TEMPLATE is required to shard a non-SQLite database")
+    if url.database in (None, '', ':memory:'):
+        return 'sqlite://'
+    root, ext = os.path.splitext(url.database)
+    return url.set(database=f"{root}-shard{n}{ext}").render_as_string(hide_password=False)
+
+def shard_binds(app):
+    """SQLALCHEMY_BINDS entries for shards 1..N-1 (shard 0 is the default engine)."""
+    count = app.config['SHARD_COUNT']
+    base_url = app.config['SQLALCHEMY_DATABASE_URI']
+    template = app.config['SHARD_URL_TEMPLATE']
+    return {shard_key(n): shard_url(base_url, n, template) for n in range(1, count)}
+
+def shard_metadata(metadata):
+    """
+    Copy of the sharded tables (plus schema_migrations) for creating shard
+    databases. Foreign keys into the main database are dropped, they can't
+    cross databases.
+    """
+    target = MetaData()
+    for table in metadata.sorted_tables:
+        if not is_sharded_table(table) and table.name != 'schema_migrations':
+            continue
+        copy = table.to_metadata(target)
+        for constraint in list(copy.foreign_key_constraints):
+            referred = constraint.elements[0].target_fullname.split('.')[0]
+            if not is_sharded_table(metadata.tables[referred]):
+                copy.constraints.discard(constraint)
+                for fk in constraint.elements:
+                    copy.foreign_keys.discard(fk)
+                    fk.parent.foreign_keys.discard(fk)
+    return target
+
+def _touches_shard(mapper, clause):
+    if mapper is not None:
+        return is_sharded_table(inspect(mapper).local_table)
+    return clause is not None and any(is_sharded_table(t) for t in find_tables(clause, include_crud=True))
+
+class ShardedSession(Session):
+    """
+    db.session. Statements and flushes that touch a sharded table go to the
+    bound shard (or bind_arguments={'shard_id': ...}); everything else goes
+    through Flask-SQLAlchemy's usual engine lookup.
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, shard_id=None, **kwargs):
+        if bind is None and (shard_id is not None or _touches_shard(mapper, clause)):
+            return self.shard_engine(shard_id or self.bound_shard())
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def bound_shard(self):
+        if shard_count() == 1:
+            return shard_key(0)
+        shard_id = self.info.get('shard_id')
+        if shard_id is None:
+            raise ShardingError(
+                "Query on a sharded table without a shard: use sharding.bind_user(), user_shard() or using_shard()"
+            )
+        return shard_id
+
+    def shard_engine(self, shard_id):
+        engines = self._db.engines
+        return engines[None] if shard_id == shard_key(0) else engines[shard_id]
+
+def bind_user(user_id, session=None):
+    """Routes the session's statements on sharded tables to this user's shard."""
+    from models import db
+    (session or db.session()).info['shard_id'] = shard_for_user(user_id)
+
+@contextmanager
+def using_shard(shard_id, session=None):
+    """Binds the session to a shard for the duration of a block, then restores the previous binding."""
+    from models import db
+    session = session or db.session()
+    previous = session.info.get('shard_id')
+    session.info['shard_id'] = shard_id
+    try:
+        yield
+    finally:
+        if previous is None:
+            session.info.pop('shard_id', None)
+        else:
+            session.info['shard_id'] = previous
+
+def user_shard(user_id, session=None):
+    """using_shard() for the given user's shard."""
+    return using_shard(shard_for_user(user_id), session)
+
+def init_app(app):
+    app.config.setdefault('SHARD_COUNT', int(os.environ.get('SHARD_COUNT', 1)))
+    app.config.setdefault('SHARD_URL_TEMPLATE', os.environ.get('SHARD_URL_TEMPLATE'))
+    if app.config['SHARD_COUNT'] < 1:
+        raise ShardingError("SHARD_COUNT must be at least 1")
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    for key, url in shard_binds(app).items():
+        binds.setdefault(key, url)
+
+# --- Rebalancing ---
+
+def _sharded_fks(table):
+    return [fk for fk in table.foreign_keys if is_sharded_table(fk.column.table)]
+
+def _select_in(conn, table, column, ids):
+    ids = sorted(ids)
+    rows = []
+    for start in range(0, len(ids), 500):
+        rows += conn.execute(select(table).where(column.in_(ids[start:start + 500]))).mappings().all()
+    return rows
+
+def _collect_user_rows(conn, tables, user_id):
+    """
+    A user's rows per sharded table, in dependency order. Tables with user_id
+    are selected directly; the others (plan exercises) are the children of the
+    user's rows plus any row the user's rows still point at, e.g. the exercises
+    of plans replaced by /setup that old workout logs reference.
+    """
+    found = {}
+    for table in tables:
+        if 'user_id' in table.c:
+            found[table.name] = {row['id']: row for row in conn.execute(
+                select(table).where(table.c.user_id == user_id)).mappings()}
+
+    for table in tables:
+        if table.name in found:
+            continue
+        rows = {}
+        for fk in _sharded_fks(table):
+            parent_ids = found.get(fk.column.table.name, {}).keys()
+            rows.update((row['id'], row) for row in _select_in(conn, table, fk.parent, parent_ids))
+        referenced = {
+            row[fk.parent.name]
+            for other in tables if other.name in found
+            for fk in _sharded_fks(other) if fk.column.table is table
+            for row in found[other.name].values()
+        }
+        rows.update((row['id'], row) for row in _select_in(conn, table, table.c.id, referenced - rows.keys()))
+        found[table.name] = rows
+
+    return {table.name: sorted(found[table.name].values(), key=lambda row: row['id']) for table in tables}
+
+def _delete_rows(conn, tables, rows_by_table):
+    for table in reversed(tables):
+        ids = [row['id'] for row in rows_by_table[table.name]]
+        for start in range(0, len(ids), 500):
+            conn.execute(delete(table).where(table.c.id.in_(ids[start:start + 500])))
+
+def move_user(user_id, source, target, tables):
+    """
+    Copies a user's rows from the source to the target engine (new ids, foreign
+    keys remapped), then deletes them from the source. Safe to re-run after a
+    crash: the target copy is rebuilt from scratch while the source still has rows.
+    Returns the number of rows moved.
+    """
+    with source.connect() as src:
+        rows_by_table = _collect_user_rows(src, tables, user_id)
+    moved = sum(len(rows) for rows in rows_by_table.values())
+    if not moved:
+        return 0
+
+    with target.begin() as dst:
+        _delete_rows(dst, tables, _collect_user_rows(dst, tables, user_id))
+        id_maps = {}
+        for table in tables:
+            remap = [(fk.parent.name, fk.column.table.name) for fk in _sharded_fks(table)]
+            new_rows = []
+            for row in rows_by_table[table.name]:
+                new_row = {key: value for key, value in row.items() if key != 'id'}
+                for column, parent in remap:
+                    # A parent that no longer exists (already dangling in the source)
+                    # becomes 0, which no autoincrement id matches
+                    new_row[column] = id_maps[parent].get(row[column], 0)
+                new_rows.append(new_row)
+
+            id_maps[table.name] = {}
+            if new_rows:
+                new_ids = dst.execute(
+                    table.insert().returning(table.c.id, sort_by_parameter_order=True), new_rows
+                ).scalars().all()
+                id_maps[table.name] = dict(zip((row['id'] for row in rows_by_table[table.name]), new_ids))
+
+    with source.begin() as src:
+        _delete_rows(src, tables, rows_by_table)
+    return moved
+
+def rebalance(app, from_count, dry_run=False):
+    """Moves every user whose shard differs between from_count and the configured SHARD_COUNT."""
+    from models import db, User
+
+    to_count = app.config['SHARD_COUNT']
+    base_url = app.config['SQLALCHEMY_DATABASE_URI']
+    template = app.config['SHARD_URL_TEMPLATE']
+
+    with app.app_context():
+        tables = [t for t in db.metadata.sorted_tables if is_sharded_table(t)]
+        engines = {n: db.engines[None] if n == 0 else db.engines.get(shard_key(n))
+                   for n in range(max(from_count, to_count))}
+        for n, engine in engines.items():
+            if engine is None:
+                # Shards beyond the new count: still need reading while they're drained
+                engines[n] = create_engine(shard_url(base_url, n, template) if n else base_url)
+
+        user_ids = db.session.execute(select(User.id).order_by(User.id)).scalars().all()
+        db.session.remove()
+
+    moves = [(uid, uid % from_count, uid % to_count) for uid in user_ids if uid % from_count != uid % to_count]
+    total = 0
+    for uid, old, new in moves:
+        if dry_run:
+            print(f"user {uid}: shard{old} -> shard{new}")
+            continue
+        rows = move_user(uid, engines[old], engines[new], tables)
+        total += rows
+        if rows:
+            print(f"user {uid}: moved {rows} rows shard{old} -> shard{new}")
+    return len(moves), total
+
+def status(app):
+    """Rows per sharded table per shard."""
+    from models import db
+
+    with app.app_context():
+        tables = [t for t in db.metadata.sorted_tables if is_sharded_table(t)]
+        counts = {}
+        for n in range(app.config['SHARD_COUNT']):
+            engine = db.engines[None] if n == 0 else db.engines[shard_key(n)]
+            with engine.connect() as conn:
+                counts[shard_key(n)] = {
+                    t.name: conn.execute(select(func.count()).select_from(t)).scalar() for t in tables
+                }
+    return counts
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Shard maintenance')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('status', help='rows per table per shard')
+    rebalance_parser = sub.add_parser('rebalance', help='move users after changing SHARD_COUNT')
+    rebalance_parser.add_argument('--from-count', type=int, required=True, help='SHARD_COUNT the data was written with')
+    rebalance_parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    from app import app
+
+    if args.command == 'status':
+        for shard, tables in status(app).items():
+            print(shard, ' '.join(f"{name}={count}" for name, count in tables.items()))
+    else:
+        users, rows = rebalance(app, args.from_count, args.dry_run)
+        print(f"{users} users to move" if args.dry_run else f"Moved {rows} rows for {users} users")
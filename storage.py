@@ -0,0 +1,115 @@
+"""
+Database engine configuration.
+
+The URL comes from DATABASE_URL (default sqlite:///fitness.db, relative to the
+instance folder); shard databases (sharding.py) get the same options. Any
+SQLAlchemy URL works; SQLite-specific tuning is only applied when the URL is
+SQLite, so moving to a server database is a config change.
+
+SQLite connections get these pragmas on connect:
+    journal_mode=WAL       readers don't block on the writer (and vice versa)
+    busy_timeout           wait this long for a lock instead of "database is locked"
+    synchronous=NORMAL     fsync at checkpoints only; safe with WAL
+    mmap_size, cache_size  larger page cache / memory-mapped reads
+
+Config (env var of the same name overrides the default):
+    SQLITE_BUSY_TIMEOUT_MS  5000
+    SQLITE_SYNCHRONOUS      NORMAL
+    SQLITE_MMAP_SIZE        268435456 (256 MiB, 0 disables)
+    SQLITE_CACHE_SIZE_KB    65536 (64 MiB per connection)
+    DB_POOL_SIZE            5
+    DB_MAX_OVERFLOW         10
+    DB_POOL_TIMEOUT         30 (seconds to wait for a pooled connection)
+    DB_POOL_RECYCLE         1800 (server databases only)
+"""
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from models import db
+import sharding
+
+DEFAULT_DATABASE_URL = 'sqlite:///fitness.db'
+
+def database_url():
+    url = os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URL)
+    # Heroku/Render style URLs; SQLAlchemy only accepts the postgresql:// scheme
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+def _setting(app, name, default, cast=int):
+    value = os.environ.get(name)
+    app.config.setdefault(name, cast(value) if value is not None else default)
+    return app.config[name]
+
+def is_memory_sqlite(url):
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+def engine_options(app):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured URL."""
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    pool_size = _setting(app, 'DB_POOL_SIZE', 5)
+    max_overflow = _setting(app, 'DB_MAX_OVERFLOW', 10)
+    pool_timeout = _setting(app, 'DB_POOL_TIMEOUT', 30)
+    pool_recycle = _setting(app, 'DB_POOL_RECYCLE', 1800)
+
+    if url.get_backend_name() == 'sqlite':
+        if is_memory_sqlite(url):
+            return {} # Flask-SQLAlchemy pins in-memory databases to one shared connection
+        return {
+            'pool_size': pool_size,
+            'max_overflow': max_overflow,
+            'pool_timeout': pool_timeout,
+            # Seconds; sqlite3's own lock wait, busy_timeout below covers the same ground per connection
+            'connect_args': {'timeout': app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000},
+        }
+
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': pool_timeout,
+        'pool_recycle': pool_recycle,
+        'pool_pre_ping': True,
+    }
+
+def sqlite_pragmas(app):
+    return [
+        ('journal_mode', 'WAL'),
+        ('busy_timeout', app.config['SQLITE_BUSY_TIMEOUT_MS']),
+        ('synchronous', app.config['SQLITE_SYNCHRONOUS']),
+        ('mmap_size', app.config['SQLITE_MMAP_SIZE']),
+        ('cache_size', -app.config['SQLITE_CACHE_SIZE_KB']), # negative = KiB rather than pages
+    ]
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """Runs the pragmas on every new DBAPI connection of a SQLite engine."""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas:
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+def init_app(app):
+    """Configures the engine from the environment and binds db to the app."""
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', database_url())
+    app.config.setdefault('SQLALCHEMY_TRACK_MODIFICATIONS', False)
+    _setting(app, 'SQLITE_BUSY_TIMEOUT_MS', 5000)
+    _setting(app, 'SQLITE_SYNCHRONOUS', 'NORMAL', str)
+    _setting(app, 'SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+    _setting(app, 'SQLITE_CACHE_SIZE_KB', 64 * 1024)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app))
+    sharding.init_app(app)
+
+    db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            apply_sqlite_pragmas(engine, sqlite_pragmas(app))
@@ -0,0 +1,51 @@
+import pytest
+
+from app import create_app
+import commands
+import identity
+from logic.catalog import invalidate_catalog
+from logic.workout_generator import clear_templates, generate_routine
+from models import db, User, WorkoutPlan, WorkoutExercise
+from sharding import bind_user
+
+@pytest.fixture
+def app(tmp_path):
+    """An app on a fresh, migrated and seeded SQLite file, with jobs run inline."""
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'titangym.db'}",
+        'METRICS_DIR': str(tmp_path / 'metrics'),
+        'JOBS_INLINE': True,
+    })
+    with app.app_context():
+        commands.init_db()
+        # Process-wide caches must not carry another test's catalog or users
+        invalidate_catalog()
+        clear_templates()
+        identity.clear()
+        yield app
+        db.session.remove()
+    invalidate_catalog()
+    clear_templates()
+    identity.clear()
+
+@pytest.fixture
+def client(app):
+    """A test client logged in as a user with a generated routine; .workout_exercise_id is one of its exercises."""
+    user = User(username='lifter', goal='strength', experience_level='beginner', days_available=3,
+                weight=80, height=180, age=30, gender='male')
+    user.set_password('pw')
+    db.session.add(user)
+    db.session.commit()
+    # The test shares the app context's session with the requests; route it to
+    # the user's shard like the user loader does (matters with SHARD_COUNT > 1)
+    bind_user(user.id)
+    generate_routine(user)
+    db.session.commit()
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'lifter', 'password': 'pw'})
+    client.workout_exercise_id = db.session.execute(
+        db.select(WorkoutExercise.id).join(WorkoutPlan).where(WorkoutPlan.user_id == user.id)
+    ).scalars().first()
+    return client
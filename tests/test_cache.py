@@ -0,0 +1,82 @@
+"""TTLCache over both backends, on a fake clock: expiry, negative entries and the LRU bound."""
+import pytest
+
+from logic import cache
+from logic.cache import TTLCache, MemoryBackend, SQLiteBackend
+
+@pytest.fixture
+def clock(monkeypatch):
+    """cache's time.time(), advanced by hand."""
+    now = [1_000_000.0]
+    monkeypatch.setattr(cache.time, 'time', lambda: now[0])
+    return now
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_cache(request, tmp_path, clock):
+    def make(max_entries=3, ttl=100, negative_ttl=10):
+        if request.param == 'memory':
+            backend = MemoryBackend(max_entries=max_entries)
+        else:
+            backend = SQLiteBackend(str(tmp_path / 'cache.db'), max_entries=max_entries)
+        return TTLCache(backend, ttl=ttl, negative_ttl=negative_ttl)
+    return make
+
+def test_entries_expire_after_the_ttl(make_cache, clock):
+    c = make_cache()
+    c.set('rice|10', [{'name': 'Rice'}])
+    clock[0] += 99
+    assert c.get('rice|10') == (True, [{'name': 'Rice'}])
+    clock[0] += 1
+    assert c.get('rice|10') == (False, None)
+    assert c.stats()['size'] == 0
+
+def test_values_are_copies(make_cache):
+    c = make_cache()
+    c.set('k', [1, 2])
+    c.get('k')[1].append(3)
+    assert c.get('k') == (True, [1, 2])
+
+def test_negative_entries_use_the_short_ttl(make_cache, clock):
+    c = make_cache()
+    c.set_negative('broken|10')
+    c.set_negative('empty|10', [])
+    assert c.get('broken|10') == (True, None)
+    assert c.get('empty|10') == (True, [])
+    clock[0] += 10
+    assert c.get('broken|10') == (False, None)
+
+    stats = c.stats()
+    assert (stats['hits'], stats['negative_hits'], stats['misses']) == (0, 2, 1)
+    assert stats['hit_ratio'] == pytest.approx(2 / 3)
+
+def test_least_recently_used_entry_is_evicted_at_the_bound(make_cache, clock):
+    c = make_cache(max_entries=3, ttl=3600)
+    for key in ('a', 'b', 'c'):
+        c.set(key, key)
+        clock[0] += 61 # past SQLiteBackend.TOUCH_INTERVAL, so reads below count as uses
+    assert c.get('a') == (True, 'a')
+    clock[0] += 1
+
+    c.set('d', 'd')
+    assert c.stats()['size'] == 3
+    assert c.get('b') == (False, None)
+    assert [c.get(key)[0] for key in ('a', 'c', 'd')] == [True, True, True]
+
+def test_expired_entries_go_before_live_ones(make_cache, clock):
+    c = make_cache(max_entries=2)
+    c.set_negative('failed', None)
+    clock[0] += 1
+    c.set('a', 'a')
+    clock[0] += 10 # 'failed' is expired now
+    c.set('b', 'b')
+    assert c.get('a') == (True, 'a')
+    assert c.get('b') == (True, 'b')
+
+def test_sqlite_backend_is_shared_between_instances(tmp_path, clock):
+    path = str(tmp_path / 'shared.db')
+    writer = TTLCache(SQLiteBackend(path))
+    reader = TTLCache(SQLiteBackend(path))
+    writer.set('oats|10', [{'name': 'Oats'}])
+    assert reader.get('oats|10') == (True, [{'name': 'Oats'}])
+    reader.clear()
+    assert writer.get('oats|10') == (False, None)
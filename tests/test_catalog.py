@@ -0,0 +1,105 @@
+"""The in-memory exercise catalog: same candidates as the SQL filter it replaced, and when it reloads."""
+from itertools import product
+
+import pytest
+
+from logic import catalog
+from logic.catalog import find_candidates, get_entry, load_catalog
+from models import db, Exercise
+
+def legacy_candidates(muscle_group=None, mechanics=None, type=None, exclude_ids=()):
+    """The query select_exercise ran before the catalog index existed."""
+    query = Exercise.query
+    if muscle_group:
+        query = query.filter_by(muscle_group=muscle_group)
+    if mechanics:
+        query = query.filter_by(mechanics=mechanics)
+    if type:
+        query = query.filter_by(type=type)
+    if exclude_ids:
+        query = query.filter(Exercise.id.notin_(exclude_ids))
+    return [exercise.id for exercise in query.order_by(Exercise.id)]
+
+def candidate_ids(*args, **kwargs):
+    return [entry.id for entry in find_candidates(*args, **kwargs)]
+
+def add_exercise(name='Landmine Press', muscle_group='shoulders'):
+    exercise = Exercise(name=name, type='compound', muscle_group=muscle_group, mechanics='push', equipment='barbell')
+    db.session.add(exercise)
+    return exercise
+
+@pytest.fixture
+def clock(monkeypatch):
+    """catalog's monotonic clock, advanced by hand."""
+    now = [1000.0]
+    monkeypatch.setattr(catalog.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(catalog, '_checked_at', 0.0)
+    return now
+
+def test_same_candidates_as_the_sql_filter(app):
+    exercises = Exercise.query.all()
+    values = lambda column: [None] + sorted({getattr(e, column) for e in exercises if getattr(e, column)})
+    exclude = [e.id for e in exercises[::3]]
+
+    combos = list(product(values('muscle_group'), values('mechanics'), values('type')))
+    assert len(combos) > 50
+    for muscle_group, mechanics, type in combos:
+        assert candidate_ids(muscle_group, mechanics, type) == legacy_candidates(muscle_group, mechanics, type)
+        assert candidate_ids(muscle_group, mechanics, type, exclude) == \
+            legacy_candidates(muscle_group, mechanics, type, exclude)
+
+def test_commit_in_this_session_reloads(app):
+    before = load_catalog()
+    exercise = add_exercise()
+    db.session.flush()
+    # Not before the commit: the transaction may still roll back
+    assert load_catalog() is before
+
+    db.session.commit()
+    assert exercise.id in candidate_ids('shoulders', 'push', 'compound')
+    assert get_entry(exercise.id).name == 'Landmine Press'
+
+def test_bulk_statements_reload(app):
+    load_catalog()
+    db.session.execute(db.insert(Exercise), [{'name': 'Sled Push', 'type': 'compound', 'muscle_group': 'legs_quad',
+                                              'mechanics': 'push', 'equipment': 'machine'}])
+    db.session.commit()
+    sled = [entry for entry in find_candidates('legs_quad') if entry.name == 'Sled Push']
+    assert len(sled) == 1
+
+    db.session.execute(db.update(Exercise).where(Exercise.id == sled[0].id).values(name='Prowler Push'))
+    db.session.commit()
+    assert get_entry(sled[0].id).name == 'Prowler Push'
+
+def test_rollback_keeps_the_index(app):
+    before = load_catalog()
+    add_exercise()
+    db.session.flush()
+    db.session.rollback()
+    assert load_catalog() is before
+    # The flag went with the rollback; an unrelated commit doesn't reload
+    db.session.commit()
+    assert load_catalog() is before
+
+def test_other_processes_writes_show_after_the_check_interval(app, clock):
+    before = load_catalog()
+    # Another process: its own connection, none of this session's events
+    with db.engine.begin() as conn:
+        new_id = conn.execute(db.insert(Exercise).values(
+            name='Belt Squat', type='compound', muscle_group='legs_quad', mechanics='squat', equipment='machine'
+        )).inserted_primary_key[0]
+
+    clock[0] += catalog.CATALOG_CHECK_INTERVAL - 1
+    assert load_catalog() is before
+    assert get_entry(new_id) is None
+
+    clock[0] += 1
+    assert get_entry(new_id).name == 'Belt Squat'
+    assert new_id in candidate_ids('legs_quad', 'squat')
+
+def test_unchanged_table_keeps_the_index_after_the_check(app, clock):
+    before = load_catalog()
+    clock[0] += catalog.CATALOG_CHECK_INTERVAL
+    # Fingerprint matches: the same index object, just re-checked
+    assert load_catalog() is before
+    assert catalog._checked_at == clock[0]
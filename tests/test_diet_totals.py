@@ -0,0 +1,134 @@
+"""DailyNutritionTotal: incremental upkeep in add_entry, range sums, and the backfill that seeds it."""
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import event
+
+import migrations
+from logic.diet_totals import MACROS, add_entry, day_totals, range_totals, rebuild_totals
+from models import db, User, DietLog, DailyNutritionTotal
+from sharding import bind_user
+
+@pytest.fixture
+def user_id(app):
+    user = User(username='eater', goal='weight_loss', experience_level='beginner', days_available=3)
+    user.set_password('pw')
+    db.session.add(user)
+    db.session.commit()
+    bind_user(user.id)
+    return user.id
+
+def entries_sum(user_id, day):
+    """What the totals should be: the DietLog entries of the day summed directly."""
+    logs = DietLog.query.filter(DietLog.user_id == user_id, db.func.date(DietLog.date) == day.isoformat()).all()
+    totals = {macro: sum(getattr(log, macro) for log in logs) for macro in MACROS}
+    totals['entries'] = len(logs)
+    return totals
+
+def statements(engine):
+    seen = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        seen.append(' '.join(statement.split()[:3]).upper())
+    event.listen(engine, 'before_cursor_execute', record)
+    return seen, lambda: event.remove(engine, 'before_cursor_execute', record)
+
+FOODS = [
+    ('Oats', 380, 13.0, 60.0, 7.0),
+    ('Banana', 105, 1.3, 27.0, 0.4),
+    ('Chicken breast', 330, 62.0, 0.0, 7.2),
+    ('Olive oil', 119, 0.0, 0.0, 13.5),
+]
+
+def test_totals_equal_the_sum_of_entries(user_id):
+    for hour, food in enumerate(FOODS):
+        add_entry(user_id, *food, date=datetime(2024, 5, 1, 8 + hour))
+        db.session.commit()
+    add_entry(user_id, 'Rice', 130, 2.7, 28.0, 0.3, date=datetime(2024, 5, 2, 12))
+    db.session.commit()
+
+    for day in (date(2024, 5, 1), date(2024, 5, 2)):
+        totals, expected = day_totals(user_id, day), entries_sum(user_id, day)
+        assert totals['entries'] == expected['entries']
+        for macro in MACROS:
+            assert totals[macro] == pytest.approx(expected[macro])
+    assert day_totals(user_id, date(2024, 5, 3))['entries'] == 0
+
+def test_first_entry_inserts_the_day_and_later_ones_increment(user_id):
+    engine = db.session.get_bind(mapper=DailyNutritionTotal.__mapper__)
+    seen, stop = statements(engine)
+    try:
+        add_entry(user_id, *FOODS[0], date=datetime(2024, 5, 1, 8))
+        db.session.commit()
+        first = list(seen)
+        seen.clear()
+        add_entry(user_id, *FOODS[1], date=datetime(2024, 5, 1, 9))
+        db.session.commit()
+    finally:
+        stop()
+
+    assert 'UPDATE DAILY_NUTRITION_TOTAL SET' in first
+    assert 'INSERT INTO DAILY_NUTRITION_TOTAL' in first
+    # Second add: one UPDATE adds in SQL, no read-modify-write and no insert
+    assert 'INSERT INTO DAILY_NUTRITION_TOTAL' not in seen
+    assert seen.count('UPDATE DAILY_NUTRITION_TOTAL SET') == 1
+    assert not any(statement.startswith('SELECT') and 'DAILY_NUTRITION_TOTAL' in statement for statement in seen)
+
+def test_day_row_created_concurrently_is_incremented(user_id, monkeypatch):
+    real_begin_nested = db.session.begin_nested
+
+    def other_request_inserts_first():
+        # Between our UPDATE (no row yet) and our INSERT, another request creates the day's row
+        monkeypatch.undo()
+        db.session.execute(db.insert(DailyNutritionTotal).values(
+            user_id=user_id, day=date(2024, 5, 1), calories=105, protein=1.3, carbs=27.0, fat=0.4, entries=1
+        ))
+        return real_begin_nested()
+    monkeypatch.setattr(db.session, 'begin_nested', other_request_inserts_first)
+
+    add_entry(user_id, *FOODS[0], date=datetime(2024, 5, 1, 8))
+    db.session.commit()
+
+    totals = day_totals(user_id, date(2024, 5, 1))
+    assert totals['entries'] == 2
+    assert totals['calories'] == 485
+    assert totals['protein'] == pytest.approx(14.3)
+    assert DailyNutritionTotal.query.filter_by(user_id=user_id).count() == 1
+
+def test_range_totals(user_id):
+    for day, food in zip((1, 2, 2, 8), FOODS):
+        add_entry(user_id, *food, date=datetime(2024, 5, day, 12))
+    db.session.commit()
+
+    week = range_totals(user_id, date(2024, 5, 1), date(2024, 5, 8))
+    assert week['days_logged'] == 2
+    assert week['entries'] == 3
+    assert week['calories'] == 380 + 105 + 330
+    assert week['fat'] == pytest.approx(7.0 + 0.4 + 7.2)
+
+    empty = range_totals(user_id, date(2024, 6, 1), date(2024, 6, 8))
+    assert empty == {'calories': 0, 'protein': 0.0, 'carbs': 0.0, 'fat': 0.0, 'entries': 0, 'days_logged': 0}
+
+def test_backfill_seeds_totals_from_existing_entries(user_id):
+    # History logged before DailyNutritionTotal existed: DietLog rows only
+    for day, food in zip((1, 1, 1, 3), FOODS):
+        name, calories, protein, carbs, fat = food
+        db.session.add(DietLog(user_id=user_id, food_name=name, calories=calories, protein=protein, carbs=carbs,
+                               fat=fat, date=datetime(2024, 5, day, 12)))
+    db.session.commit()
+    assert day_totals(user_id, date(2024, 5, 1))['entries'] == 0
+
+    engine = db.session.get_bind(mapper=DailyNutritionTotal.__mapper__)
+    with engine.begin() as conn:
+        migrations.backfill_daily_nutrition_totals(conn)
+
+    for day in (date(2024, 5, 1), date(2024, 5, 3)):
+        totals, expected = day_totals(user_id, day), entries_sum(user_id, day)
+        assert totals['entries'] == expected['entries']
+        for macro in MACROS:
+            assert totals[macro] == pytest.approx(expected[macro])
+
+    # Rebuilding one user (the rebuild_diet_totals job) gives the same rows again
+    before = range_totals(user_id, date(2024, 5, 1), date(2024, 6, 1))
+    rebuild_totals(user_id)
+    db.session.commit()
+    assert range_totals(user_id, date(2024, 5, 1), date(2024, 6, 1)) == before
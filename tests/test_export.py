@@ -0,0 +1,124 @@
+"""History exports: /api/export (the logged-in user only) and export_history.py (one user or --all)."""
+import csv
+import gzip
+import io
+import json
+from datetime import datetime
+
+import pytest
+
+import app as app_module
+import export_history
+from logic.diet_totals import add_entry
+from logic.export import DIET_COLUMNS, WORKOUT_COLUMNS
+from logic.training_log import log_workout
+from logic.workout_generator import generate_routine
+from models import db, User, WorkoutPlan, WorkoutExercise
+from sharding import user_shard
+
+def first_workout_exercise(user_id):
+    return db.session.execute(
+        db.select(WorkoutExercise.id).join(WorkoutPlan).where(WorkoutPlan.user_id == user_id)
+    ).scalars().first()
+
+@pytest.fixture
+def history(client):
+    """Two users with workouts and meals, each on their own shard: {user_id: workout exercise id}, lifter first."""
+    users = {}
+    for username in ('lifter', 'other'):
+        user = db.session.execute(db.select(User).where(User.username == username)).scalar()
+        if user is None:
+            user = User(username=username, goal='hypertrophy', experience_level='beginner', days_available=3)
+            user.set_password('pw')
+            db.session.add(user)
+            db.session.commit()
+        with user_shard(user.id):
+            if username != 'lifter':
+                generate_routine(user)
+                db.session.flush()
+            we_id = first_workout_exercise(user.id)
+            base = 60 if username == 'lifter' else 100
+            log_workout(user.id, we_id, base, [10, 8], date=datetime(2024, 5, 1, 18))
+            log_workout(user.id, we_id, base + 2.5, [8], date=datetime(2024, 5, 8, 18), rpe=9)
+            add_entry(user.id, f'{username} oats', 380, 13.0, 60.0, 7.0, date=datetime(2024, 5, 1, 8))
+            add_entry(user.id, f'{username} rice', 130, 2.7, 28.0, 0.3, date=datetime(2024, 5, 9, 13))
+            db.session.commit()
+        users[user.id] = we_id
+    return users
+
+def csv_rows(text):
+    rows = list(csv.reader(io.StringIO(text)))
+    return rows[0], rows[1:]
+
+def test_workouts_csv_is_the_users_sets_in_date_order(client, history):
+    lifter_id = next(iter(history))
+    response = client.get('/api/export/workouts')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert 'attachment; filename="titangym-workouts.csv"' == response.headers['Content-Disposition']
+
+    header, rows = csv_rows(response.get_data(as_text=True))
+    assert tuple(header) == WORKOUT_COLUMNS
+    assert {row[0] for row in rows} == {str(lifter_id)}
+    assert [(row[2][:10], row[5], row[6], row[7], row[8]) for row in rows] == [
+        ('2024-05-01', '1', '10', '60.0', ''),
+        ('2024-05-01', '2', '8', '60.0', ''),
+        ('2024-05-08', '1', '8', '62.5', '9.0'),
+    ]
+    # Exercise names come from the catalog
+    assert all(row[3] and row[4] for row in rows)
+
+def test_jsonl_and_date_range(client, history):
+    lifter_id = next(iter(history))
+    response = client.get('/api/export/diet?format=jsonl&start=2024-05-02&end=2024-05-09')
+    assert response.mimetype == 'application/x-ndjson'
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    # end is inclusive of its day
+    assert [(r['user_id'], r['food_name'], r['calories']) for r in records] == [(lifter_id, 'lifter rice', 130)]
+    assert set(records[0]) == set(DIET_COLUMNS)
+
+def test_gzip_when_accepted(client, history):
+    plain = client.get('/api/export/diet').get_data()
+    response = client.get('/api/export/diet', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.get_data()) == plain
+
+@pytest.mark.parametrize('path, status', [
+    ('/api/export/users', 404),
+    ('/api/export/diet?format=xml', 404),
+    ('/api/export/diet?start=May', 400),
+    ('/api/export/diet?start=2024-05-09&end=2024-05-01', 400),
+])
+def test_bad_requests(client, path, status):
+    assert client.get(path).status_code == status
+
+@pytest.fixture
+def cli(app, monkeypatch):
+    """export_history.main() against the test app instead of the one built from the environment."""
+    monkeypatch.setattr(app_module, 'app', app)
+    return export_history.main
+
+def test_cli_one_user_to_a_gzipped_file(cli, history, tmp_path, capsys):
+    other_id = list(history)[1]
+    output = tmp_path / 'other.jsonl.gz'
+    cli(['workouts', '--user-id', str(other_id), '--format', 'jsonl', '--output', str(output), '--batch-size', '1'])
+
+    records = [json.loads(line) for line in gzip.decompress(output.read_bytes()).decode().splitlines()]
+    assert {r['user_id'] for r in records} == {other_id}
+    assert [(r['set_index'], r['reps'], r['weight']) for r in records] == [(1, 10, 100.0), (2, 8, 100.0), (1, 8, 102.5)]
+    assert not (tmp_path / 'other.jsonl.gz.partial').exists()
+    assert f'to {output}' in capsys.readouterr().err
+
+def test_cli_all_users_to_stdout(cli, history, capsysbinary):
+    cli(['diet', '--all', '--end', '2024-05-01'])
+    header, rows = csv_rows(capsysbinary.readouterr().out.decode())
+    assert tuple(header) == DIET_COLUMNS
+    # Every user's entries, from every shard; the date filter still applies
+    assert sorted((int(row[0]), row[3]) for row in rows) == sorted(
+        (user_id, f"{name} oats") for user_id, name in zip(history, ('lifter', 'other'))
+    )
+
+def test_cli_requires_a_user_or_all(cli):
+    with pytest.raises(SystemExit):
+        cli(['workouts'])
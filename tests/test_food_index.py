@@ -0,0 +1,102 @@
+"""The FTS5 food index built from data/sample_foods.jsonl, ranked like the original search_food loop."""
+import os
+import re
+
+import pytest
+
+from import_foods import import_foods
+from logic import food_index
+from logic.food_index import read_dump
+from logic.nutrition import rank_items
+
+SAMPLE_DUMP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'sample_foods.jsonl')
+
+QUERIES = ['rice', 'Rice', 'chicken', 'chicken bre', 'banana', 'oat', 'water', 'potato', 'rice noodles', 'milk']
+
+def legacy_rank(query, products, limit=10):
+    """The scoring loop search_food ran over API results before the index and ranking module existed."""
+    candidates = []
+    query_lower = query.lower().strip()
+    for product in products:
+        nutriments = product.get('nutriments', {})
+        product_name = product.get('product_name', '')
+        if not product_name or not product_name.strip():
+            continue
+        name_lower = product_name.lower().strip()
+
+        calories = nutriments.get('energy-kcal_100g')
+        if calories is None:
+            kj = nutriments.get('energy_100g')
+            calories = kj / 4.184 if kj else 0
+        if calories == 0 and nutriments.get('proteins_100g', 0) == 0 and "water" not in query_lower:
+            continue
+
+        score = 0
+        if name_lower == query_lower:
+            score -= 1000
+        elif name_lower.startswith(query_lower):
+            score -= 50
+        if query_lower in name_lower:
+            score -= 10
+        score += (len(name_lower) - len(query_lower)) * 2
+        candidates.append((score, product_name))
+
+    candidates.sort(key=lambda c: c[0])
+    return [name for _, name in candidates[:limit]]
+
+def prefix_matches(query, products):
+    """Products whose name has every query token as a word prefix, most scanned first (the API's sort)."""
+    tokens = re.findall(r'\w+', query.lower())
+    matched = [
+        p for p in products
+        if p.get('product_name') and all(
+            any(word.startswith(token) for word in re.findall(r'\w+', p['product_name'].lower())) for token in tokens
+        )
+    ]
+    return sorted(matched, key=lambda p: -int(p.get('unique_scans_n') or 0))
+
+@pytest.fixture(scope='module')
+def index(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('foods') / 'foods.db')
+    count = import_foods(SAMPLE_DUMP, path)
+    return path, count
+
+@pytest.fixture(scope='module')
+def products():
+    return list(read_dump(SAMPLE_DUMP))
+
+def test_index_holds_every_named_product(index, products):
+    path, count = index
+    assert count == sum(1 for p in products if (p.get('product_name') or '').strip())
+    assert food_index.is_available(path)
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_lookup_returns_prefix_matches_by_popularity(index, products, query):
+    path, _ = index
+    names = [item['name'] for item in food_index.lookup(query, path)]
+    assert names == [p['product_name'] for p in prefix_matches(query, products)]
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_ranking_matches_legacy_loop(index, products, query):
+    path, _ = index
+    ranked = [item['name'] for item in rank_items(query, food_index.lookup(query, path), limit=10)]
+    assert ranked == legacy_rank(query, prefix_matches(query, products))
+
+def test_exact_then_prefix_then_contains_then_length(index):
+    path, _ = index
+    ranked = [item['name'] for item in rank_items('rice', food_index.lookup('rice', path), limit=10)]
+    assert ranked[0] == 'Rice'
+    # Prefix matches before names that only contain the query, shorter names first within each
+    assert ranked[1:3] == ['Rice Cakes', 'Rice Noodles']
+    assert ranked[3:6] == ['Wild Rice', 'Brown Rice', 'Basmati Rice']
+    assert ranked[-1] == 'Jasmine Rice Microwave Pouch with Garlic & Herbs'
+
+def test_zero_calorie_items_only_for_water(index):
+    path, _ = index
+    assert 'Mineral Water' in [item['name'] for item in rank_items('water', food_index.lookup('water', path))]
+    assert food_index.lookup('sweetener', path)
+    assert rank_items('sweetener', food_index.lookup('sweetener', path)) == []
+
+def test_empty_query_matches_nothing(index):
+    path, _ = index
+    assert food_index.lookup('  ', path) == []
@@ -0,0 +1,67 @@
+"""Background food search: single-flight upstream fetches and the /api/foods/search polling contract."""
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from logic import food_index, nutrition
+from logic.cache import TTLCache, MemoryBackend
+
+RICE = {'name': 'Rice', 'calories': 130.0, 'protein': 2.7, 'carbs': 28.0, 'fat': 0.3}
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """fetch_remote replaced by an Event that blocks the fetch until it is set, and counts its calls."""
+    stub = threading.Event()
+    stub.calls = []
+    def fetch(query):
+        stub.calls.append(query)
+        assert stub.wait(5)
+        return [RICE]
+    monkeypatch.setattr(nutrition, 'fetch_remote', fetch)
+    monkeypatch.setattr(food_index, 'is_available', lambda: False)
+    monkeypatch.setattr(nutrition, '_food_cache', TTLCache(MemoryBackend(max_entries=100), ttl=60, negative_ttl=5))
+    return stub
+
+def test_concurrent_searches_share_one_upstream_call(upstream):
+    futures = [nutrition.search_food_async(query, 10) for query in ('rice', 'Rice', '  rice ')]
+    assert futures[0] is futures[1] is futures[2]
+    # A different limit is a different result, so a separate fetch
+    other = nutrition.search_food_async('rice', 5)
+    assert other is not futures[0]
+
+    upstream.set()
+    assert futures[0].result(timeout=5)[0]['name'] == 'Rice'
+    assert other.result(timeout=5)[0]['name'] == 'Rice'
+    assert upstream.calls == ['rice', 'rice']
+
+    # The finished fetch filled the cache; the next search is a hit
+    again = nutrition.search_food_async('rice', 10)
+    assert again.done() and again.result()[0]['name'] == 'Rice'
+    assert len(upstream.calls) == 2
+
+def test_slow_search_answers_202_then_results(client, upstream, app):
+    app.config['FOOD_SEARCH_WAIT'] = 0.01
+    pending = client.get('/api/foods/search?q=rice')
+    assert pending.status_code == 202
+    assert pending.get_json() == {'status': 'pending', 'query': 'rice'}
+
+    upstream.set()
+    nutrition.search_food_async('rice', 10).result(timeout=5)
+    done = client.get('/api/foods/search?q=rice')
+    assert done.status_code == 200
+    assert done.get_json()['results'][0]['name'] == 'Rice'
+    assert len(upstream.calls) == 1
+
+@pytest.mark.parametrize('limit, expected', [('0', 1), ('-5', 1), ('7', 7), ('500', 50), ('x', 10)])
+def test_limit_is_clamped(client, monkeypatch, limit, expected):
+    seen = []
+    def search(query, limit):
+        seen.append(limit)
+        future = Future()
+        future.set_result([])
+        return future
+    monkeypatch.setattr(nutrition, 'search_food_async', search)
+
+    assert client.get(f'/api/foods/search?q=rice&limit={limit}').status_code == 200
+    assert seen == [expected]
@@ -0,0 +1,83 @@
+"""The cached user loader: cache hits, and profile updates reaching the next request."""
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event
+
+import identity
+from models import db, User
+
+SETUP_FORM = {'weight': '92.5', 'height': '180', 'age': '31', 'gender': 'male', 'goal': 'hypertrophy',
+              'experience_level': 'beginner', 'days_available': '3'}
+
+@pytest.fixture
+def clock(monkeypatch):
+    """identity's clock only; patching time.time itself would also age the login cookie."""
+    now = [1_000_000.0]
+    monkeypatch.setattr(identity, 'time', SimpleNamespace(time=lambda: now[0]))
+    return now
+
+def get(app, client, path):
+    """
+    Requests path in an app context of its own, as a server would. The test
+    client otherwise reuses the fixture's, and with it g (where Flask-Login
+    keeps the loaded user) and the session's identity map.
+    """
+    with app.app_context():
+        response = client.get(path)
+        assert response.status_code == 200
+        return response.get_data(as_text=True)
+
+def update_profile(app, client):
+    with app.app_context():
+        assert client.post('/setup', data=SETUP_FORM).status_code == 302
+
+def user_selects(app, client, path):
+    """SELECTs on the user table issued while the client gets path."""
+    seen = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and 'FROM user' in statement.replace('"', ''):
+            seen.append(statement)
+    engine = db.engines[None]
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        get(app, client, path)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return len(seen)
+
+def profile_version():
+    db.session.expire_all()
+    return db.session.execute(db.select(User.profile_version).where(User.username == 'lifter')).scalar_one()
+
+def test_cached_user_is_reused(app, client, clock):
+    get(app, client, '/setup')
+    assert user_selects(app, client, '/setup') == 0
+    # Past the TTL the row is read again
+    clock[0] += identity.USER_CACHE_TTL + 1
+    assert user_selects(app, client, '/setup') == 1
+
+def test_profile_update_bumps_the_version_and_is_seen_next_request(app, client, clock):
+    page = get(app, client, '/setup')
+    assert 'value="80.0"' in page
+    assert profile_version() == 1
+
+    update_profile(app, client)
+    assert profile_version() == 2
+
+    # Same browser, same instant: the old cache entry no longer matches the session's version
+    page = get(app, client, '/setup')
+    assert 'value="92.5"' in page
+    assert '<option value="hypertrophy" selected>' in ' '.join(page.split())
+
+def test_other_browser_sees_the_update_within_the_ttl(app, client, clock):
+    other = app.test_client()
+    other.post('/login', data={'username': 'lifter', 'password': 'pw'})
+    assert 'value="80.0"' in get(app, other, '/setup')
+
+    update_profile(app, client)
+
+    # Its cookie still carries version 1, cached until the TTL runs out
+    assert 'value="80.0"' in get(app, other, '/setup')
+    clock[0] += identity.USER_CACHE_TTL + 1
+    assert 'value="92.5"' in get(app, other, '/setup')
@@ -0,0 +1,73 @@
+"""Job queue: idle polling, failure display, pruning and the queue depth gauge."""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+import jobs
+from models import db, Job, User
+
+@pytest.fixture
+def queue(app):
+    app.config['JOBS_INLINE'] = False
+    return app
+
+def statements(engine):
+    seen = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        seen.append(statement.split(None, 1)[0].upper())
+    event.listen(engine, 'before_cursor_execute', record)
+    return seen, lambda: event.remove(engine, 'before_cursor_execute', record)
+
+def test_idle_poll_only_reads(queue):
+    seen, stop = statements(db.engine)
+    try:
+        assert jobs.claim('worker-1') is None
+    finally:
+        stop()
+    assert seen == ['SELECT']
+
+def test_claim_runs_a_queued_job_once(queue):
+    job = jobs.enqueue('refresh_suggestions', None, dedup_key='k')
+    assert jobs.enqueue('refresh_suggestions', None, dedup_key='k').id == job.id
+    db.session.commit()
+
+    assert jobs.claim('worker-1') == job.id
+    assert jobs.claim('worker-2') is None
+
+def test_failed_generation_is_shown_once(client, queue):
+    user_id = db.session.execute(db.select(User.id).where(User.username == 'lifter')).scalar_one()
+    db.session.add(Job(kind='generate_plans', user_id=user_id, status='failed', finished_at=datetime.utcnow(),
+                       last_error='boom'))
+    db.session.commit()
+
+    assert client.get('/api/plan/status').get_json() == {'status': 'failed'}
+    assert "couldn&#39;t generate your new plan" in client.get('/plan').get_data(as_text=True)
+    assert "couldn&#39;t generate your new plan" not in client.get('/plan').get_data(as_text=True)
+    assert client.get('/api/plan/status').get_json() == {'status': 'ready'}
+
+def test_prune_keeps_recent_and_active_jobs(queue):
+    old = datetime.utcnow() - timedelta(days=30)
+    db.session.add_all([
+        Job(kind='x', status='done', finished_at=old),
+        Job(kind='x', status='dismissed', finished_at=old),
+        Job(kind='x', status='failed', finished_at=datetime.utcnow()),
+        Job(kind='x', status='queued'),
+    ])
+    db.session.commit()
+
+    assert jobs.prune(retention_days=7) == 2
+    assert sorted(db.session.execute(db.select(Job.status)).scalars()) == ['failed', 'queued']
+
+def test_queue_depth_is_read_at_scrape_time(queue, tmp_path):
+    # A snapshot left by a worker that has exited must not keep the gauge up
+    (tmp_path / 'metrics').mkdir(exist_ok=True)
+    (tmp_path / 'metrics' / 'worker-999999999.json').write_text(
+        '[["job_queue_depth", "gauge", "h", [["kind", "generate_plans"], ["status", "queued"]], 5]]'
+    )
+    jobs.enqueue('generate_plans', None)
+    db.session.commit()
+
+    body = queue.test_client().get('/metrics').get_data(as_text=True)
+    assert 'job_queue_depth{kind="generate_plans",status="queued"} 1' in body
+    assert 'job_queue_depth{kind="generate_plans",status="running"} 0' in body
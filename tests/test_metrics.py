@@ -0,0 +1,74 @@
+"""Per-worker metric snapshots: flushing and merging them for /metrics."""
+import json
+import os
+import subprocess
+import sys
+import time
+
+import metrics
+
+def snapshot_path(app):
+    return os.path.join(app.config['METRICS_DIR'], f"worker-{os.getpid()}.json")
+
+def test_maybe_flush_waits_for_the_interval(app, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(metrics.time, 'monotonic', lambda: clock[0])
+    monkeypatch.setattr(metrics, '_last_flush', 0.0)
+    app.config['METRICS_FLUSH_INTERVAL'] = 5.0
+
+    assert metrics.maybe_flush()
+    assert os.path.exists(snapshot_path(app))
+    os.remove(snapshot_path(app))
+
+    clock[0] += 4.9
+    assert not metrics.maybe_flush()
+    assert not os.path.exists(snapshot_path(app))
+
+    clock[0] += 0.1
+    assert metrics.maybe_flush()
+    assert os.path.exists(snapshot_path(app))
+
+def write_snapshot(directory, pid, requests, circuit_open=0, age=0):
+    path = os.path.join(directory, f"worker-{pid}.json")
+    samples = [
+        ['http_requests_total', 'counter', 'HTTP requests.', [['route', 'plan']], requests],
+        ['food_search_circuit_open', 'gauge', 'Circuit open.', [], circuit_open],
+    ]
+    with open(path, 'w') as f:
+        json.dump(samples, f)
+    if age:
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+    return path
+
+def exited_pid():
+    child = subprocess.Popen([sys.executable, '-c', 'pass'])
+    child.wait()
+    return child.pid
+
+def test_merge_drops_exited_and_stale_workers(tmp_path):
+    live = write_snapshot(tmp_path, os.getpid(), 5)
+    other_live = write_snapshot(tmp_path, os.getppid(), 7)
+    dead = write_snapshot(tmp_path, exited_pid(), 100, circuit_open=1)
+    stale = write_snapshot(tmp_path, 1, 1000, circuit_open=1, age=7200)
+
+    merged = metrics.merged_samples(str(tmp_path), stale_after=3600)
+    assert merged[('http_requests_total', (('route', 'plan'),))][2] == 12
+    assert merged[('food_search_circuit_open', ())][2] == 0
+    # An exited worker's file is gone for good; a stale one is only skipped until it's rewritten
+    assert not os.path.exists(dead)
+    assert all(os.path.exists(path) for path in (live, other_live, stale))
+
+    write_snapshot(tmp_path, 1, 1001)
+    merged = metrics.merged_samples(str(tmp_path), stale_after=3600)
+    assert merged[('http_requests_total', (('route', 'plan'),))][2] == 1013
+
+def test_scrape_deletes_snapshots_of_exited_workers(app):
+    os.makedirs(app.config['METRICS_DIR'], exist_ok=True)
+    write_snapshot(app.config['METRICS_DIR'], exited_pid(), 100)
+    metrics.inc('http_requests_total', (('route', 'restart-test'), ('method', 'GET'), ('status', '200')))
+
+    body = app.test_client().get('/metrics').get_data(as_text=True)
+    assert 'http_requests_total{route="plan"}' not in body
+    assert 'route="restart-test"' in body
+    assert os.listdir(app.config['METRICS_DIR']) == [f"worker-{os.getpid()}.json"]
@@ -0,0 +1,128 @@
+"""NutritionClient retries, timeouts and circuit breaker against a local stub of the search API."""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from logic.nutrition import CircuitBreaker, CircuitOpenError, NutritionClient
+
+PRODUCTS = {'products': [{'product_name': 'Rice', 'nutriments': {'energy-kcal_100g': 130}}]}
+
+class StubAPI:
+    """Answers each request with the next scripted reply: a status code, or ('sleep', seconds)."""
+    def __init__(self):
+        self.script = []
+        self.hits = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stub.lock:
+                    stub.hits += 1
+                    reply = stub.script.pop(0) if stub.script else 200
+                if isinstance(reply, tuple):
+                    time.sleep(reply[1])
+                    reply = 200
+                body = json.dumps(PRODUCTS if reply == 200 else {'error': reply}).encode()
+                self.send_response(reply)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+@pytest.fixture
+def api():
+    stub = StubAPI()
+    stub.thread.start()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+def make_client(api, retries=2, timeout=2.0, breaker=None):
+    return NutritionClient(base_url=api.url, timeout=timeout, retries=retries, backoff_factor=0, breaker=breaker)
+
+def test_transient_5xx_is_retried(api):
+    api.script = [503, 502]
+    client = make_client(api, retries=2)
+
+    products = client.search('rice')
+
+    assert products[0]['product_name'] == 'Rice'
+    assert api.hits == 3
+    stats = client.stats()
+    # One logical call, however many attempts it took
+    assert (stats['requests'], stats['errors'], stats['circuit']) == (1, 0, 'closed')
+
+def test_exhausted_retries_raise_and_count_an_error(api):
+    api.script = [500, 500, 500]
+    client = make_client(api, retries=2)
+
+    with pytest.raises(requests.HTTPError):
+        client.search('rice')
+
+    assert api.hits == 3
+    stats = client.stats()
+    assert (stats['requests'], stats['errors']) == (1, 1)
+    assert client.breaker.failures == 1
+
+def test_timeout_is_an_error_with_its_latency_recorded(api):
+    api.script = [('sleep', 0.5)]
+    client = make_client(api, retries=0, timeout=0.1)
+
+    # With a Retry adapter mounted, requests reports the read timeout as a ConnectionError
+    with pytest.raises(requests.RequestException, match='timed out'):
+        client.search('rice')
+
+    stats = client.stats()
+    assert (stats['requests'], stats['errors']) == (1, 1)
+    assert 0.1 <= stats['latency_sum'] < 0.5
+    # 0.1 < latency <= 0.25: the third bucket
+    assert stats['latency_buckets'][2] == 1 and sum(stats['latency_buckets']) == 1
+
+def test_breaker_opens_rejects_then_half_opens(api):
+    api.script = [500, 500]
+    client = make_client(api, retries=0, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.2))
+
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            client.search('rice')
+    assert client.breaker.state == 'open'
+
+    # Open: fails fast without calling upstream
+    with pytest.raises(CircuitOpenError):
+        client.search('rice')
+    assert api.hits == 2
+    assert client.stats()['rejected'] == 1
+
+    time.sleep(0.25)
+    assert client.breaker.state == 'half_open'
+    assert client.search('rice')
+    assert client.breaker.state == 'closed'
+    assert client.stats()['circuit'] == 'closed'
+
+def test_failed_half_open_trial_reopens(api):
+    api.script = [500, 500]
+    client = make_client(api, retries=0, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.2))
+
+    with pytest.raises(requests.HTTPError):
+        client.search('rice')
+    time.sleep(0.25)
+    assert client.breaker.state == 'half_open'
+
+    with pytest.raises(requests.HTTPError):
+        client.search('rice')
+    assert client.breaker.state == 'open'
+    with pytest.raises(CircuitOpenError):
+        client.search('rice')
+    assert api.hits == 2
@@ -0,0 +1,63 @@
+"""next_loads rules, and /log reading the precomputed suggestions without writing."""
+import pytest
+from sqlalchemy import event
+
+from logic.progression import DEFAULT_START_LOAD, LoggedSession as S, Suggestion, next_loads
+from logic.training_log import epley_1rm
+from models import db, SuggestedLoad
+
+# (history newest first, reps_range, muscle_group) -> (weight, status)
+CASES = {
+    'never logged': ([], '8-12', 'chest', (DEFAULT_START_LOAD, 'new')),
+    'every set at the top': ([S(60, [12, 12, 12])], '8-12', 'chest', (62.5, 'progress')),
+    'legs go up 5 kg': ([S(100, [10, 10])], '6-10', 'legs_quad', (105, 'progress')),
+    'one set short of the top': ([S(60, [12, 12, 11])], '8-12', 'chest', (60, 'hold')),
+    'unparseable rep range': ([S(60, [12, 12])], 'AMRAP', 'chest', (60, 'hold')),
+    'no weight logged': ([S(None, [10])], '8-12', 'chest', (DEFAULT_START_LOAD, 'hold')),
+    'no reps logged': ([S(60, [])], '8-12', 'chest', (60, 'hold')),
+    'stalled three sessions': ([S(60, [8, 8]), S(60, [8, 8]), S(60, [9, 8])], '8-12', 'chest', (55, 'deload')),
+    'stalled but e1rm improving': ([S(60, [9, 8]), S(60, [8, 8]), S(60, [8, 8])], '8-12', 'chest', (60, 'hold')),
+    'weight changed in the window': ([S(60, [8, 8]), S(57.5, [8, 8]), S(60, [9, 8])], '8-12', 'chest', (60, 'hold')),
+    'only two sessions': ([S(60, [8, 8]), S(60, [9, 8])], '8-12', 'chest', (60, 'hold')),
+    'deload rounds to the plate step': ([S(100, [6])] * 3, '8-12', 'back', (90, 'deload')),
+    'deload never raises the load': ([S(2, [6])] * 3, '8-12', 'arms', (2, 'deload')),
+    'top of range beats a stall': ([S(60, [12, 12])] * 3, '8-12', 'chest', (62.5, 'progress')),
+}
+
+@pytest.mark.parametrize('history, reps_range, muscle_group, expected', CASES.values(), ids=CASES.keys())
+def test_next_loads_rules(history, reps_range, muscle_group, expected):
+    suggestion = next_loads({'k': history}, {'k': (reps_range, muscle_group)})['k']
+    assert (suggestion.weight, suggestion.status) == expected
+    assert suggestion.sessions == len(history)
+
+def test_next_loads_batches_every_case_at_once():
+    histories = {name: history for name, (history, _, _, _) in CASES.items()}
+    targets = {name: (reps_range, group) for name, (_, reps_range, group, _) in CASES.items()}
+    # Keys absent from histories count as never logged
+    del histories['never logged']
+
+    suggestions = next_loads(histories, targets)
+    assert {name: (s.weight, s.status) for name, s in suggestions.items()} == {
+        name: expected for name, (_, _, _, expected) in CASES.items()
+    }
+    assert suggestions['every set at the top'].e1rm == pytest.approx(epley_1rm(60, 12))
+    assert suggestions['never logged'] == Suggestion(DEFAULT_START_LOAD, None, 'new', 0)
+
+def test_log_page_reads_suggestions_without_writing(client):
+    db.session.execute(db.delete(SuggestedLoad))
+    db.session.commit()
+
+    # The shard holding the user's rows (the main database unless SHARD_COUNT > 1)
+    engine = db.session.get_bind(mapper=SuggestedLoad.__mapper__)
+    seen = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        seen.append(statement.split(None, 1)[0].upper())
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        page = client.get('/log').get_data(as_text=True)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+    assert f'{DEFAULT_START_LOAD}' in page
+    assert seen and set(seen) == {'SELECT'}
+    assert db.session.execute(db.select(db.func.count()).select_from(SuggestedLoad)).scalar() == 0
@@ -0,0 +1,120 @@
+"""regenerate_plans.py: chunked writes with suggestions, resuming from the progress file, dry runs and worker processes."""
+import io
+
+import pytest
+
+import regenerate_plans
+from logic.progression import DEFAULT_START_LOAD
+from logic.workout_generator import generate_routine
+from models import db, User, WorkoutPlan, WorkoutExercise, SuggestedLoad
+from sharding import user_shard
+
+FILTERS = {'goal': None, 'experience': None, 'days': None, 'user_ids': None}
+
+@pytest.fixture
+def users(app):
+    """Five users whose stored plans are for 3 days a week, though their profiles now say 2."""
+    ids = []
+    for n in range(5):
+        user = User(username=f'user{n}', goal='strength', experience_level='beginner', days_available=3,
+                    weight=80, height=180, age=30, gender='male')
+        user.set_password('pw')
+        db.session.add(user)
+        db.session.commit()
+        with user_shard(user.id):
+            generate_routine(user)
+            db.session.commit()
+        user.days_available = 2
+        db.session.commit()
+        ids.append(user.id)
+    return ids
+
+def plan_days(user_id):
+    with user_shard(user_id):
+        days = db.session.execute(
+            db.select(WorkoutPlan.schedule_day).where(WorkoutPlan.user_id == user_id).order_by(WorkoutPlan.schedule_day)
+        ).scalars().all()
+        db.session.commit()
+    return days
+
+def suggestions(user_id):
+    """{workout_exercise_id: weight} stored for the user, and the ids of their current plan exercises."""
+    with user_shard(user_id):
+        stored = dict(db.session.execute(
+            db.select(SuggestedLoad.workout_exercise_id, SuggestedLoad.weight).where(SuggestedLoad.user_id == user_id)
+        ).all())
+        current = set(db.session.execute(
+            db.select(WorkoutExercise.id).join(WorkoutPlan).where(WorkoutPlan.user_id == user_id)
+        ).scalars())
+        db.session.commit()
+    return stored, current
+
+def run(app, tmp_path, **kwargs):
+    kwargs.setdefault('workers', 0)
+    return regenerate_plans.regenerate(app, FILTERS, progress_path=str(tmp_path / 'progress'), out=io.StringIO(),
+                                       **kwargs)
+
+def test_regenerates_plans_and_stores_suggestions(app, tmp_path, users):
+    assert run(app, tmp_path, chunk_size=2) == (5, 10)
+
+    for user_id in users:
+        assert len(plan_days(user_id)) == 2
+        stored, current = suggestions(user_id)
+        assert set(stored) == current
+        assert set(stored.values()) == {DEFAULT_START_LOAD}
+    # Finished: the next run starts from scratch
+    assert not (tmp_path / 'progress').exists()
+
+def test_dry_run_prints_changes_and_writes_nothing(app, tmp_path, users):
+    out = io.StringIO()
+    assert regenerate_plans.regenerate(app, FILTERS, workers=0, progress_path=str(tmp_path / 'progress'),
+                                       dry_run=True, out=out) == (5, 10)
+
+    changed = [line for line in out.getvalue().splitlines() if line.startswith('user ')]
+    assert {int(line.split()[1]) for line in changed} == set(users)
+    assert all(len(plan_days(user_id)) == 3 for user_id in users)
+    assert all(not suggestions(user_id)[0] for user_id in users)
+    assert not (tmp_path / 'progress').exists()
+
+def test_interrupted_run_resumes_after_the_last_finished_chunk(app, tmp_path, users, monkeypatch):
+    real_chunk = regenerate_plans.regenerate_chunk
+    seen = []
+    def crash_on_third_chunk(chunk, dry_run=False):
+        seen.append(chunk)
+        if len(seen) == 3:
+            raise RuntimeError('worker killed')
+        return real_chunk(chunk, dry_run)
+    monkeypatch.setattr(regenerate_plans, 'regenerate_chunk', crash_on_third_chunk)
+
+    with pytest.raises(RuntimeError):
+        run(app, tmp_path, chunk_size=2)
+    assert regenerate_plans.load_progress(str(tmp_path / 'progress'), FILTERS) == [
+        (users[0], users[1]), (users[2], users[3])
+    ]
+    assert [len(plan_days(user_id)) for user_id in users] == [2, 2, 2, 2, 3]
+
+    # Same filters: only the unfinished chunk runs again
+    seen.clear()
+    assert run(app, tmp_path, chunk_size=2) == (1, 2)
+    assert seen == [[users[4]]]
+    assert len(plan_days(users[4])) == 2
+    assert not (tmp_path / 'progress').exists()
+
+def test_progress_of_other_filters_is_refused(app, tmp_path, users):
+    regenerate_plans.start_progress(str(tmp_path / 'progress'), dict(FILTERS, goal='hypertrophy'))
+    with pytest.raises(SystemExit, match='other filters'):
+        run(app, tmp_path)
+    # --restart ignores it
+    assert run(app, tmp_path, restart=True) == (5, 10)
+
+def test_worker_processes(app, tmp_path, users, monkeypatch):
+    # Spawned workers build their app from the environment
+    monkeypatch.setenv('DATABASE_URL', app.config['SQLALCHEMY_DATABASE_URI'])
+    monkeypatch.setenv('SHARD_COUNT', str(app.config['SHARD_COUNT']))
+    db.session.remove()
+
+    assert run(app, tmp_path, workers=2, chunk_size=2) == (5, 10)
+    for user_id in users:
+        assert len(plan_days(user_id)) == 2
+        stored, current = suggestions(user_id)
+        assert set(stored) == current
@@ -0,0 +1,87 @@
+"""POST /api/sessions: validation, idempotent replay and key expiry."""
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+import views
+from logic.training_log import expire_idempotency_keys, log_session
+from models import db, User, WorkoutLog, IdempotencyKey
+
+def session_body(workout_exercise_id, **set_fields):
+    return {'performed_at': '2024-05-01T18:30:00Z',
+            'exercises': [{'workout_exercise_id': workout_exercise_id, 'weight': 60,
+                           'sets': [{'reps': 10}, dict({'reps': 8}, **set_fields)]}]}
+
+def post(client, body, key='key-1'):
+    data = body if isinstance(body, str) else json.dumps(body)
+    return client.post('/api/sessions', data=data, content_type='application/json', headers={'Idempotency-Key': key})
+
+def test_session_is_logged_once_per_key(client):
+    body = session_body(client.workout_exercise_id, rpe=9)
+    first = post(client, body)
+    assert first.status_code == 201
+    replay = post(client, body)
+    assert replay.status_code == 200
+    assert replay.get_json() == dict(first.get_json(), replayed=True)
+    assert db.session.execute(db.select(db.func.count(WorkoutLog.id))).scalar() == 1
+
+def test_concurrent_request_with_the_same_key_is_replayed(client, monkeypatch):
+    other = {'status': 'logged', 'logs': [], 'suggested_loads': {}}
+    user_id = db.session.execute(db.select(User.id).where(User.username == 'lifter')).scalar_one()
+    engine = db.session.get_bind(mapper=IdempotencyKey.__mapper__)
+
+    def log_after_the_other_request(*args):
+        # The other request commits the same key between our replay check and our insert
+        with engine.begin() as conn:
+            conn.execute(db.insert(IdempotencyKey).values(user_id=user_id, key='key-1', response=json.dumps(other)))
+        return log_session(*args)
+    monkeypatch.setattr(views, 'log_session', log_after_the_other_request)
+
+    response = post(client, session_body(client.workout_exercise_id))
+    assert response.status_code == 200
+    assert response.get_json() == dict(other, replayed=True)
+    # Our copy of the session was rolled back
+    assert db.session.execute(db.select(db.func.count(WorkoutLog.id))).scalar() == 0
+
+def test_conflict_without_a_stored_response_is_409(client, monkeypatch):
+    def conflict(*args):
+        raise IntegrityError('INSERT INTO idempotency_key', {}, Exception('UNIQUE constraint failed'))
+    monkeypatch.setattr(views, 'record_response', conflict)
+
+    response = post(client, session_body(client.workout_exercise_id))
+    assert response.status_code == 409
+    assert 'retry' in response.get_json()['error']
+    assert db.session.execute(db.select(db.func.count(WorkoutLog.id))).scalar() == 0
+
+@pytest.mark.parametrize('set_fields, message', [
+    ({'weight': -20}, 'weight must be between'),
+    ({'rpe': 11}, 'rpe must be between'),
+    ({'rpe': 0}, 'rpe must be between'),
+    ({'reps': 0}, 'reps must be between'),
+    ({'weight': True}, 'weight must be a number'),
+])
+def test_out_of_range_values_are_rejected(client, set_fields, message):
+    response = post(client, session_body(client.workout_exercise_id, **set_fields))
+    assert response.status_code == 400
+    assert message in response.get_json()['error']
+
+@pytest.mark.parametrize('literal', ['NaN', 'Infinity', '-Infinity'])
+def test_non_finite_numbers_are_rejected(client, literal):
+    body = json.dumps(session_body(client.workout_exercise_id)).replace('"weight": 60', f'"weight": {literal}')
+    response = post(client, body)
+    assert response.status_code == 400
+    assert 'must be a number' in response.get_json()['error']
+    assert db.session.execute(db.select(db.func.count(WorkoutLog.id))).scalar() == 0
+
+def test_expired_keys_are_deleted(client):
+    assert post(client, session_body(client.workout_exercise_id), key='old').status_code == 201
+    assert post(client, session_body(client.workout_exercise_id), key='new').status_code == 201
+    db.session.execute(db.update(IdempotencyKey).where(IdempotencyKey.key == 'old').values(
+        created_at=datetime.utcnow() - timedelta(days=31)
+    ))
+    db.session.commit()
+
+    assert expire_idempotency_keys(ttl_days=30) == 1
+    assert db.session.execute(db.select(IdempotencyKey.key)).scalars().all() == ['new']
@@ -0,0 +1,134 @@
+"""Per-user shard routing and moving users between shards with rebalance."""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+import commands
+import sharding
+from app import create_app
+from logic.catalog import invalidate_catalog
+from logic.training_log import log_workout
+from logic.workout_generator import clear_templates, generate_routine
+from models import db, User, WorkoutPlan, WorkoutExercise, WorkoutLog, WorkoutSet
+
+def make_app(tmp_path, shard_count):
+    return create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'titangym.db'}",
+        'METRICS_DIR': str(tmp_path / 'metrics'), 'JOBS_INLINE': True, 'SHARD_COUNT': shard_count})
+
+@pytest.fixture(autouse=True)
+def fresh_caches():
+    invalidate_catalog(); clear_templates()
+    yield
+    invalidate_catalog(); clear_templates()
+
+def add_users(names):
+    """Users with a generated routine and one logged session each, written on their own shards."""
+    users = []
+    for name in names:
+        user = User(username=name, goal='strength', experience_level='beginner', days_available=3,
+                    weight=80, height=180, age=30, gender='male')
+        user.set_password('pw')
+        db.session.add(user)
+        db.session.commit()
+        with sharding.user_shard(user.id):
+            generate_routine(user)
+            db.session.flush()
+            we_id = db.session.execute(
+                select(WorkoutExercise.id).join(WorkoutPlan).where(WorkoutPlan.user_id == user.id)
+            ).scalars().first()
+            log_workout(user.id, we_id, 40 + user.id, [10, 8], date=datetime(2024, 5, user.id))
+            db.session.commit()
+        users.append(user.id)
+    return users
+
+def history(user_id):
+    """The user's plans and sets by content, without ids: (plan exercise ids, logged sessions)."""
+    with sharding.user_shard(user_id):
+        plans = db.session.execute(
+            select(WorkoutPlan.schedule_day, WorkoutExercise.exercise_id).join(WorkoutPlan.exercises)
+            .where(WorkoutPlan.user_id == user_id).order_by(WorkoutPlan.schedule_day, WorkoutExercise.id)
+        ).all()
+        sets = db.session.execute(
+            select(WorkoutExercise.exercise_id, WorkoutLog.weight, WorkoutSet.set_index, WorkoutSet.reps)
+            .join(WorkoutLog, WorkoutLog.workout_exercise_id == WorkoutExercise.id)
+            .join(WorkoutSet, WorkoutSet.log_id == WorkoutLog.id)
+            .where(WorkoutLog.user_id == user_id).order_by(WorkoutLog.id, WorkoutSet.set_index)
+        ).all()
+        db.session.commit()
+    return [tuple(row) for row in plans], [tuple(row) for row in sets]
+
+def user_ids_on(engine, table):
+    with engine.connect() as conn:
+        return set(conn.execute(select(table.c.user_id).distinct()).scalars())
+
+def test_users_are_written_to_and_read_from_their_own_shard(tmp_path):
+    app = make_app(tmp_path, 3)
+    with app.app_context():
+        commands.init_db()
+        users = add_users(['a', 'b', 'c'])
+
+        for n in range(3):
+            engine = db.engines[None] if n == 0 else db.engines[sharding.shard_key(n)]
+            expected = {uid for uid in users if uid % 3 == n}
+            assert user_ids_on(engine, WorkoutPlan.__table__) == expected
+            assert user_ids_on(engine, WorkoutLog.__table__) == expected
+
+        for uid in users:
+            plans, sets = history(uid)
+            assert plans and sets == [(sets[0][0], 40.0 + uid, 1, 10), (sets[0][0], 40.0 + uid, 2, 8)]
+            # Another user's shard has nothing of theirs
+            with sharding.user_shard(uid + 1):
+                assert db.session.execute(
+                    select(WorkoutPlan.id).where(WorkoutPlan.user_id == uid)
+                ).first() is None
+        db.session.remove()
+
+def test_unbound_query_on_a_sharded_table_raises(tmp_path):
+    app = make_app(tmp_path, 3)
+    with app.app_context():
+        commands.init_db()
+        with pytest.raises(sharding.ShardingError):
+            db.session.execute(select(WorkoutPlan.id)).all()
+        # Unsharded tables still go to the main database
+        assert db.session.execute(select(User.id)).all() == []
+        db.session.remove()
+
+def test_rebalance_from_one_to_three_shards(tmp_path):
+    app = make_app(tmp_path, 1)
+    with app.app_context():
+        commands.init_db()
+        users = add_users(['a', 'b', 'c', 'd'])
+        before = {uid: history(uid) for uid in users}
+        old_log_ids = {uid: db.session.execute(
+            select(WorkoutLog.id).where(WorkoutLog.user_id == uid)).scalar_one() for uid in users}
+        db.session.remove()
+
+    app = make_app(tmp_path, 3)
+    with app.app_context():
+        commands.init_db()
+        moved_users, _ = run_rebalance(app, 1)
+        assert moved_users == sum(1 for uid in users if uid % 3 != 0)
+
+        for n in range(3):
+            engine = db.engines[None] if n == 0 else db.engines[sharding.shard_key(n)]
+            for table in (WorkoutPlan.__table__, WorkoutLog.__table__):
+                assert user_ids_on(engine, table) == {uid for uid in users if uid % 3 == n}
+
+        for uid in users:
+            # Same plans and sets, reached through the remapped foreign keys
+            assert history(uid) == before[uid]
+            with sharding.user_shard(uid):
+                log = db.session.execute(select(WorkoutLog).where(WorkoutLog.user_id == uid)).scalar_one()
+                assert db.session.get(WorkoutExercise, log.workout_exercise_id).plan.user_id == uid
+                if uid % 3 == 0:
+                    assert log.id == old_log_ids[uid]
+                db.session.commit()
+
+        # Re-running finds every user already in place
+        assert run_rebalance(app, 1) == (moved_users, 0)
+        db.session.remove()
+
+def run_rebalance(app, from_count):
+    db.session.remove()
+    return sharding.rebalance(app, from_count)
@@ -0,0 +1,55 @@
+"""WorkoutSet aggregates computed in SQL, and the /log page that shows them."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from logic.training_log import daily_volume, epley_1rm, exercise_summaries, log_workout
+from models import db, User
+
+@pytest.fixture
+def user_id(client):
+    return db.session.execute(db.select(User.id).where(User.username == 'lifter')).scalar_one()
+
+def test_exercise_summaries(client, user_id):
+    we_id = client.workout_exercise_id
+    log_workout(user_id, we_id, 60, [10, 10, 8], date=datetime(2024, 5, 1))
+    log_workout(user_id, we_id, 62.5, [8, 6], date=datetime(2024, 5, 3), rpe=9)
+    db.session.commit()
+
+    summary = exercise_summaries(user_id, [we_id])[we_id]
+    assert summary['sessions'] == 2
+    assert summary['sets'] == 5
+    assert summary['total_reps'] == 42
+    assert summary['volume'] == pytest.approx(60 * 28 + 62.5 * 14)
+    assert summary['best_weight'] == 62.5
+    assert summary['best_e1rm'] == pytest.approx(max(epley_1rm(60, 10), epley_1rm(62.5, 8)))
+
+    assert exercise_summaries(user_id, [we_id], since=datetime(2024, 5, 2))[we_id]['sessions'] == 1
+    assert exercise_summaries(user_id, []) == {}
+
+def test_daily_volume(client, user_id):
+    we_id = client.workout_exercise_id
+    log_workout(user_id, we_id, 50, [10, 10], date=datetime(2024, 5, 1, 9))
+    log_workout(user_id, we_id, 40, [12], date=datetime(2024, 5, 1, 18))
+    log_workout(user_id, we_id, 55, [5], date=datetime(2024, 5, 4))
+    db.session.commit()
+
+    days = daily_volume(user_id, datetime(2024, 5, 1), datetime(2024, 5, 4))
+    assert [(str(day), sets, volume) for day, sets, volume in days] == [('2024-05-01', 3, 1480.0)]
+    assert len(daily_volume(user_id, datetime(2024, 5, 1), datetime(2024, 5, 5))) == 2
+
+def test_log_page_shows_history_and_week(client, user_id):
+    we_id = client.workout_exercise_id
+    log_workout(user_id, we_id, 60, [10, 10], date=datetime.utcnow() - timedelta(days=10))
+    log_workout(user_id, we_id, 65, [8, 8, 8], date=datetime.utcnow())
+    db.session.commit()
+
+    page = ' '.join(client.get('/log').get_data(as_text=True).split())
+    assert '2 sessions, best 65.0kg, 2760 kg volume' in page
+    # Only the recent session falls in the last 7 days
+    assert 'Last 7 days: 3 sets on 1 day,' in page
+    assert '1560 kg total volume' in page
+
+def test_log_page_without_history(client):
+    page = client.get('/log').get_data(as_text=True)
+    assert 'Last 7 days' not in page
@@ -0,0 +1,358 @@
+"""
+Page and API views. Registered on the app by init_app with their historical
+endpoint names (url_for('plan'), url_for('diet'), ...).
+"""
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime, timedelta
+
+from flask import (
+    render_template, redirect, url_for, request, flash, jsonify, current_app, Response, stream_with_context
+)
+from flask_login import login_user, logout_user, login_required, current_user
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+
+from models import db, User, WorkoutPlan, WorkoutExercise, parse_reps
+import identity
+import jobs
+from logic.workout_generator import calculate_diet
+from logic.progression import DEFAULT_START_LOAD, compute_suggestions, latest_logs, refresh_suggestions, suggested_loads
+from logic.training_log import (
+    log_workout, log_session, parse_session, known_workout_exercises, stored_response, record_response,
+    exercise_summaries, daily_volume
+)
+from logic.export import KINDS, FORMATS, export, parse_date_range
+
+def index():
+    if current_user.is_authenticated:
+        return redirect(url_for('plan'))
+    return render_template('base.html')
+
+def login():
+    if request.method == 'POST':
+        username = request.form.get('username')
+        password = request.form.get('password')
+        user = User.query.filter_by(username=username).first()
+        if user and user.check_password(password):
+            login_user(user)
+            identity.remember(user)
+            return redirect(url_for('plan'))
+        flash('Invalid username or password')
+    return render_template('login.html')
+
+def register():
+    if request.method == 'POST':
+        username = request.form.get('username')
+        password = request.form.get('password')
+        
+        if User.query.filter_by(username=username).first():
+            flash('Username already exists')
+            return redirect(url_for('register'))
+            
+        new_user = User(username=username)
+        new_user.set_password(password)
+        db.session.add(new_user)
+        db.session.commit()
+        
+        login_user(new_user)
+        identity.remember(new_user)
+        return redirect(url_for('setup'))
+    return render_template('register.html')
+
+@login_required
+def setup():
+    if request.method == 'POST':
+        # current_user may be a cached, detached copy; write through the session's row
+        user = db.session.get(User, current_user.id)
+        user.weight = float(request.form.get('weight'))
+        user.height = float(request.form.get('height'))
+        user.age = int(request.form.get('age'))
+        user.gender = request.form.get('gender')
+        user.goal = request.form.get('goal')
+        user.experience_level = request.form.get('experience_level')
+        user.days_available = int(request.form.get('days_available'))
+        identity.profile_changed(user)
+        
+        # Plans are replaced by a job worker (jobs.generate_plans); /plan shows
+        # a "generating" page until it finishes
+        jobs.enqueue('generate_plans', user.id, dedup_key=f"generate_plans:{user.id}")
+        db.session.commit()
+        
+        return redirect(url_for('plan'))
+        
+    return render_template('setup.html')
+
+@login_required
+def plan():
+    if not current_user.goal:
+        return redirect(url_for('setup'))
+
+    job = jobs.latest(current_user.id, 'generate_plans')
+    if jobs.is_active(job):
+        return render_template('plan_generating.html')
+    if job is not None and job.status == 'failed':
+        flash("We couldn't generate your new plan. Please submit your settings again.")
+        # Once is enough; later visits show the plans as they are
+        jobs.dismiss(job)
+        db.session.commit()
+
+    plans = WorkoutPlan.query.filter_by(user_id=current_user.id).all()
+    diet = calculate_diet(current_user)
+    
+    return render_template('plan.html', plans=plans, diet=diet)
+
+@login_required
+def plan_status_api():
+    job = jobs.latest(current_user.id, 'generate_plans')
+    if jobs.is_active(job):
+        status = 'generating'
+    elif job is not None and job.status == 'failed':
+        status = 'failed'
+    else:
+        status = 'ready'
+    return jsonify({'status': status})
+
+@login_required
+def diet():
+    from logic.nutrition import search_food
+    from logic.diet_totals import add_entry, day_totals, day_entries, range_totals
+    
+    diet_targets = calculate_diet(current_user)
+    search_results = []
+    
+    if request.method == 'POST':
+        action = request.form.get('action')
+        
+        if action == 'search':
+            query = request.form.get('food_query')
+            weight = float(request.form.get('weight') or 0)
+            
+            if query and weight > 0:
+                results = search_food(query)
+                if not results:
+                    flash(f'No results found for "{query}".')
+                else:
+                    # Pre-calculate for the given weight
+                    for res in results:
+                        factor = weight / 100.0
+                        res['calc_calories'] = int(res['calories'] * factor)
+                        res['calc_protein'] = round(res['protein'] * factor, 1)
+                        res['calc_carbs'] = round(res['carbs'] * factor, 1)
+                        res['calc_fat'] = round(res['fat'] * factor, 1)
+                        res['weight'] = weight
+                    search_results = results
+            else:
+                flash('Invalid search.')
+
+        elif action == 'add':
+            name = request.form.get('name')
+            weight = float(request.form.get('weight'))
+            calories = float(request.form.get('calories'))
+            protein = float(request.form.get('protein'))
+            carbs = float(request.form.get('carbs'))
+            fat = float(request.form.get('fat'))
+            
+            add_entry(
+                user_id=current_user.id,
+                food_name=f"{name} ({weight}g)",
+                calories=int(calories),
+                protein=protein,
+                carbs=carbs,
+                fat=fat,
+                date=datetime.utcnow()
+            )
+            db.session.commit()
+            flash(f"Added {name}")
+            return redirect(url_for('diet'))
+        
+    # Today's totals come from the running daily aggregate; entries are paged
+    today = datetime.utcnow().date()
+    totals = day_totals(current_user.id, today)
+    logs = day_entries(current_user.id, today, page=request.args.get('page', 1, type=int))
+    
+    week_start = today - timedelta(days=today.weekday())
+    period_totals = {
+        'week': range_totals(current_user.id, week_start, today + timedelta(days=1)),
+        'month': range_totals(current_user.id, today.replace(day=1), today + timedelta(days=1))
+    }
+    
+    return render_template('diet.html', targets=diet_targets, logs=logs, totals=totals, period_totals=period_totals, search_results=search_results)
+
+@login_required
+def food_search_api():
+    from logic.nutrition import search_food_async
+    
+    query = (request.args.get('q') or '').strip()
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    if not query:
+        return jsonify({'error': 'Missing query'}), 400
+    
+    # The fetch runs on the search pool; the worker only waits briefly for it
+    future = search_food_async(query, limit)
+    try:
+        results = future.result(timeout=current_app.config['FOOD_SEARCH_WAIT'])
+    except FutureTimeoutError:
+        return jsonify({'status': 'pending', 'query': query}), 202
+    
+    return jsonify({'status': 'done', 'query': query, 'results': results})
+
+@login_required
+def log():
+    if request.method == 'POST':
+        # Processing log entry
+        workout_exercise_id = int(request.form.get('workout_exercise_id'))
+        weight = float(request.form.get('weight'))
+        reps = parse_reps(request.form.get('reps_performed')) # "10,10,10"
+        if not reps:
+            flash('Enter the reps of each set, e.g. 10,10,8')
+            return redirect(url_for('log'))
+
+        log_workout(current_user.id, workout_exercise_id, weight, reps)
+        refresh_suggestions(current_user.id, [workout_exercise_id])
+        db.session.commit()
+        
+        flash('Workout logged successfully!')
+        return redirect(url_for('log'))
+    
+    # Get user's current plans, with exercises and catalog rows in the same round trips
+    plans = WorkoutPlan.query.filter_by(user_id=current_user.id).options(
+        # selectinload, not a join: Exercise lives in the main database, plans may be in a shard
+        selectinload(WorkoutPlan.exercises).selectinload(WorkoutExercise.exercise)
+    ).all()
+    
+    we_ids = [we.id for plan in plans for we in plan.exercises]
+    # Last log for every exercise in one query instead of one per exercise
+    last_logs = latest_logs(current_user.id, we_ids)
+
+    # Precomputed at plan generation and on each log; a GET never writes, so
+    # exercises without a stored row are computed for display only
+    suggestions = suggested_loads(current_user.id, we_ids)
+    missing = [we_id for we_id in we_ids if we_id not in suggestions]
+    if missing:
+        suggestions.update(compute_suggestions(current_user.id, missing))
+    
+    # Per-exercise history and the last 7 days' training, aggregated by the database over WorkoutSet
+    summaries = exercise_summaries(current_user.id, we_ids)
+    week_start = datetime.combine(datetime.utcnow().date() - timedelta(days=6), datetime.min.time())
+    week = daily_volume(current_user.id, week_start, week_start + timedelta(days=7))
+    week_summary = {
+        'days': len(week),
+        'sets': sum(sets for _, sets, _ in week),
+        'volume': sum(volume for _, _, volume in week),
+    }
+
+    # Prepare data for logging view
+    logging_data = []
+    
+    for plan in plans:
+        plan_data = {'plan': plan, 'exercises': []}
+        for we in plan.exercises:
+            suggestion = suggestions.get(we.id)
+            plan_data['exercises'].append({
+                'we': we,
+                'last_log': last_logs.get(we.id),
+                'summary': summaries.get(we.id),
+                'suggestion': suggestion,
+                'suggested_weight': suggestion.weight if suggestion else DEFAULT_START_LOAD
+            })
+        logging_data.append(plan_data)
+
+    return render_template('log.html', logging_data=logging_data, week=week_summary)
+
+@login_required
+def session_api():
+    """
+    Logs a whole workout session from JSON (see parse_session) in one
+    transaction. Clients send a unique Idempotency-Key header (or an
+    idempotency_key field) per session; replaying a session, e.g. from an
+    offline queue, returns the first response again with "replayed": true
+    instead of logging it twice.
+    """
+    payload = request.get_json(silent=True)
+    key = request.headers.get('Idempotency-Key') or (payload.get('idempotency_key') if isinstance(payload, dict) else None)
+    if not isinstance(key, str) or not 0 < len(key) <= 100:
+        return jsonify({'error': 'An Idempotency-Key header of 1 to 100 characters is required'}), 400
+
+    replay = stored_response(current_user.id, key)
+    if replay is not None:
+        return jsonify(dict(replay, replayed=True))
+
+    try:
+        date, entries = parse_session(payload)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    we_ids = sorted({entry['workout_exercise_id'] for entry in entries})
+    unknown = set(we_ids) - known_workout_exercises(current_user.id, we_ids)
+    if unknown:
+        return jsonify({'error': 'Unknown workout exercises', 'workout_exercise_ids': sorted(unknown)}), 422
+
+    log_ids = log_session(current_user.id, entries, date)
+    suggestions = refresh_suggestions(current_user.id, we_ids)
+    response = {
+        'status': 'logged',
+        'logs': [{'workout_exercise_id': entry['workout_exercise_id'], 'log_id': log_id}
+                 for entry, log_id in zip(entries, log_ids)],
+        'suggested_loads': {str(we_id): s.weight for we_id, s in suggestions.items()},
+    }
+    try:
+        record_response(current_user.id, key, response)
+        db.session.commit()
+    except IntegrityError:
+        # The same session arrived concurrently and was logged by the other request
+        db.session.rollback()
+        replay = stored_response(current_user.id, key)
+        if replay is None:
+            # ...whose key is gone again (expired meanwhile); let the client retry
+            return jsonify({'error': 'A request with this Idempotency-Key is in conflict; retry it'}), 409
+        return jsonify(dict(replay, replayed=True))
+    return jsonify(response), 201
+
+@login_required
+def export_api(kind):
+    """
+    Streams the user's workout or diet history as CSV (default) or JSONL:
+    /api/export/workouts?format=jsonl&start=2024-01-01&end=2024-12-31, both
+    dates optional and inclusive. Gzipped on the fly when the client accepts it.
+    Always the current user's history only; every-user dumps are CLI-only
+    (export_history.py --all).
+    """
+    fmt = request.args.get('format', 'csv')
+    if kind not in KINDS or fmt not in FORMATS:
+        return jsonify({'error': f"Export one of {', '.join(KINDS)} as {' or '.join(FORMATS)}"}), 404
+    try:
+        start, end = parse_date_range(request.args.get('start'), request.args.get('end'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    compress = 'gzip' in request.accept_encodings
+    body = export(kind, fmt, current_user.id, start, end, compress=compress)
+    response = Response(
+        stream_with_context(body),
+        mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename="titangym-{kind}.{fmt}"', 'Vary': 'Accept-Encoding'}
+    )
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@login_required
+def logout():
+    logout_user()
+    identity.forget()
+    return redirect(url_for('index'))
+
+
+def init_app(app):
+    app.add_url_rule('/', 'index', index)
+    app.add_url_rule('/login', 'login', login, methods=['GET', 'POST'])
+    app.add_url_rule('/register', 'register', register, methods=['GET', 'POST'])
+    app.add_url_rule('/setup', 'setup', setup, methods=['GET', 'POST'])
+    app.add_url_rule('/plan', 'plan', plan)
+    app.add_url_rule('/diet', 'diet', diet, methods=['GET', 'POST'])
+    app.add_url_rule('/api/plan/status', 'plan_status_api', plan_status_api)
+    app.add_url_rule('/api/foods/search', 'food_search_api', food_search_api)
+    app.add_url_rule('/log', 'log', log, methods=['GET', 'POST'])
+    app.add_url_rule('/api/sessions', 'session_api', session_api, methods=['POST'])
+    app.add_url_rule('/api/export/<kind>', 'export_api', export_api)
+    app.add_url_rule('/logout', 'logout', logout)